@@ -9,13 +9,19 @@ from pathlib import Path
 from database import db
 from models import Announcement, Log
 from sqlalchemy import func
-from parser import AvitoParser
-from publisher import VKPublisher
-from telegram_publisher import TelegramPublisher
-import threading
+import metrics
+from loguru import logger
+import jobs
+from jobs import JobConflict
+from job_runner import JobQueueFull, PRIORITY_LOW
+from pipeline import get_pipeline
+from tenancy import tenant_id, tenant_db
+from api_features import install_features
 
 app = Flask(__name__, static_folder='../frontend/dist')
 CORS(app)
+metrics.install(app)
+jobs.install(app)
 
 CONFIG_PATH = "config.yaml"
 
@@ -90,6 +96,10 @@ def get_default_config():
     }
 
 
+# Фоновые задачи, поиск, выгрузка, цены, узлы, кеш ответов и логи (api_features.py)
+runner, api_cache = install_features(app, load_config, CONFIG_PATH)
+
+
 @app.route('/')
 def index():
     """Главная страница"""
@@ -97,6 +107,7 @@ def index():
 
 
 @app.route('/api/config', methods=['GET'])
+@api_cache.cached('config')
 def get_config():
     """Получить конфигурацию"""
     config = load_config()
@@ -220,18 +231,25 @@ def update_stop_words():
 
 
 @app.route('/api/stats', methods=['GET'])
+@api_cache.cached('announcements')
 def get_stats():
     """Статистика"""
-    session = db.get_session()
+    config = load_config()
+    user_id = tenant_id(config)
+    session = tenant_db(config).get_session()
     
     try:
-        total = session.query(func.count(Announcement.id)).scalar()
-        new = session.query(func.count(Announcement.id)).filter(Announcement.status == 'new').scalar()
-        published = session.query(func.count(Announcement.id)).filter(Announcement.published_to_vk == True).scalar()
+        # Только объявления пользователя (индексы начинаются с user_id)
+        scoped = session.query(func.count(Announcement.id)).filter(Announcement.user_id == user_id)
+        total = scoped.scalar()
+        new = scoped.filter(Announcement.status == 'new').scalar()
+        published = scoped.filter(Announcement.published_to_vk == True).scalar()
         
         # По категориям
         by_category = {}
-        categories = session.query(Announcement.category, func.count(Announcement.id)).group_by(Announcement.category).all()
+        categories = session.query(Announcement.category, func.count(Announcement.id)).filter(
+            Announcement.user_id == user_id
+        ).group_by(Announcement.category).all()
         for cat, count in categories:
             by_category[cat] = count
         
@@ -246,15 +264,19 @@ def get_stats():
 
 
 @app.route('/api/announcements', methods=['GET'])
+@api_cache.cached('announcements')
 def get_announcements():
     """Список объявлений"""
-    session = db.get_session()
+    config = load_config()
+    session = tenant_db(config).get_session()
     
     try:
         limit = request.args.get('limit', 50, type=int)
         status = request.args.get('status', None)
         
-        query = session.query(Announcement).order_by(Announcement.created_at.desc())
+        query = session.query(Announcement).filter(
+            Announcement.user_id == tenant_id(config)
+        ).order_by(Announcement.created_at.desc())
         
         if status:
             query = query.filter(Announcement.status == status)
@@ -289,19 +311,6 @@ def get_logs():
         session.close()
 
 
-if __name__ == '__main__':
-    # Инициализируем БД
-    db.init_db()
-    
-    # Создаём дефолтный конфиг если нет
-    if not os.path.exists(CONFIG_PATH):
-        save_config(get_default_config())
-        print("✅ Создан config.yaml")
-    
-    print("🚀 Dashboard запущен: http://localhost:5000")
-    app.run(host='0.0.0.0', port=5000, debug=True)
-
-
 @app.route('/api/fill-groups', methods=['POST'])
 def fill_groups():
     """Наполнить группы за N дней"""
@@ -316,84 +325,65 @@ def fill_groups():
     if not config.get('city') or not config.get('sources'):
         return jsonify({'error': 'Сначала настрой город и ссылки'}), 400
     
-    # Запускаем в фоне
-    def fill_job():
+    pipeline = get_pipeline(config)
+    max_pages = days * 3  # 1 день = 3 страницы, 3 дня = 9 страниц и т.д.
+    
+    def fill_job(job):
         logger.info(f"🔄 Запуск наполнения групп за {days} дней")
-        
-        try:
-            parser = AvitoParser(config)
-            
-            total_found = 0
-            
-            # Парсим каждую активную ссылку
-            for source in config['sources']:
-                if not source.get('enabled', True):
-                    continue
-                
-                logger.info(f"🔍 Парсинг: {source['url']}")
-                
-                # Парсим больше страниц для наполнения
-                max_pages = days * 3  # 1 день = 3 страницы, 3 дня = 9 страниц и т.д.
-                raw_announcements = parser.parse_listing_page(source['url'], max_pages)
-                
-                if not raw_announcements:
-                    continue
-                
-                # Фильтрация
-                stop_words = config.get('stop_words', [])
-                filtered = parser.filter_announcements(raw_announcements, stop_words)
-                
-                # Сохранение
-                category = source.get('category', 'general')
-                stats = parser.save_to_db(filtered, category)
-                
-                total_found += stats['new']
-                logger.info(f"📊 Найдено новых: {stats['new']}")
-            
-            # Публикация
-            signatures = {}
-            for source in config['sources']:
-                category = source.get('category', 'general')
-                signature = source.get('signature', '')
-                signatures[category] = signature
-            
-            # VK
-            if config.get('vk', {}).get('access_token'):
-                vk_pub = VKPublisher(
-                    access_token=config['vk']['access_token'],
-                    group_mappings=config['vk']['groups']
-                )
-                vk_stats = vk_pub.publish_announcements(signatures)
-                logger.info(f"📊 VK публикация: {vk_stats}")
-            
-            # Telegram
-            if config.get('telegram', {}).get('bot_token'):
-                tg_pub = TelegramPublisher(
-                    bot_token=config['telegram']['bot_token'],
-                    channel_mappings=config['telegram']['channels']
-                )
-                tg_stats = tg_pub.publish_announcements(signatures)
-                logger.info(f"📊 TG публикация: {tg_stats}")
-            
-            logger.success(f"✅ Наполнение завершено! Найдено {total_found} новых объявлений")
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка наполнения: {e}", exc_info=True)
-    
-    thread = threading.Thread(target=fill_job, daemon=True)
-    thread.start()
+        stats = pipeline.run(max_pages=max_pages, job=job)
+        logger.success(f"✅ Наполнение завершено! Найдено {stats['new']} новых объявлений")
+    
+    # Низкий приоритет и пауза на время цикла main.py - наполнение не отнимает прокси у расписания
+    try:
+        job = runner.submit('fill', fill_job, key='fill', priority=PRIORITY_LOW,
+                            pages_total=pipeline.pages_total(max_pages), params={'days': days},
+                            yield_to=('cycle',))
+    except JobConflict as e:
+        return jsonify({'error': 'Наполнение уже выполняется', 'job': e.job}), 409
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
     
     return jsonify({
         'message': f'Запущено наполнение групп за {days} дней',
-        'status': 'running'
+        'status': 'queued',
+        'job_id': job.id
     })
 
 
 @app.route('/api/parser/status', methods=['GET'])
 def parser_status():
-    """Статус парсера (работает ли)"""
-    # TODO: Добавить реальную проверку через PID файл или systemd
+    """Статус парсера: последний цикл main.py и активные задачи"""
+    last_cycle = jobs.get_registry().last('cycle')
+    active = jobs.get_registry().list(active_only=True)
+    
+    if not last_cycle and not active:
+        return jsonify({
+            'status': 'unknown',
+            'message': 'Запусти парсер через: bash start-parser.sh',
+            'active_jobs': []
+        })
+    
     return jsonify({
-        'status': 'unknown',
-        'message': 'Запусти парсер через: bash start-parser.sh'
+        'status': 'running' if active else 'idle',
+        'last_cycle': last_cycle,
+        'active_jobs': active
     })
+
+
+def setup():
+    """Подготовка перед запуском (app.run и serve.py): БД и конфиг по умолчанию"""
+    # Инициализируем БД
+    db.configure(load_config().get('database'))
+    db.init_db()
+    
+    # Создаём дефолтный конфиг если нет
+    if not os.path.exists(CONFIG_PATH):
+        save_config(get_default_config())
+        print("✅ Создан config.yaml")
+
+
+if __name__ == '__main__':
+    # Для продакшена: python serve.py api (несколько воркеров, без debug)
+    setup()
+    print("🚀 Dashboard запущен: http://localhost:5000")
+    app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,50 @@
+"""
+Общие подсистемы Dashboard API - одинаковые в api.py и api_improved.py
+
+Модули подключаются через install(app, load_config): load_config - конфиг на запрос,
+из него тенант и его БД (tenancy.tenant_id, tenancy.tenant_db), поэтому смена
+конфига действует без перезапуска.
+"""
+import export
+import job_runner
+import leases
+import log_sink
+import price_history
+import price_stats
+import response_cache
+import search
+
+
+def install_features(app, load_config, config_path: str):
+    """
+    Фоновые задачи, поиск, выгрузка, цены, узлы, кеш ответов и логи - в app
+
+    Returns:
+        (runner, api_cache): пул фоновых задач и кеш ответов (api_cache.cached)
+    """
+    # Фоновые задачи (наполнение) - ограниченный пул с очередью
+    runner = job_runner.create_runner(load_config())
+    job_runner.install(app, runner)
+
+    # Поиск по объявлениям (FTS5): /api/announcements/search?q=
+    search.install(app, load_config)
+
+    # Выгрузка объявлений потоком: /api/announcements/export?format=csv|jsonl&gzip=1
+    export.install(app, load_config)
+
+    # История цен: /api/price-drops?category=&hours=24, /api/announcements/<id>/prices
+    price_history.install(app, load_config)
+
+    # Рыночные цены по категориям: /api/price-stats?category=&city=&price=
+    price_stats.install(app, load_config)
+
+    # Узлы распределённого обхода и аренды источников: /api/crawl/nodes
+    leases.install(app, load_config)
+
+    # Кеш ответов дашборда: ETag по версии данных, 304, сжатие JSON (api_cache.cached)
+    api_cache = response_cache.install(app, load_config, config_path)
+
+    # Логи процесса (задачи наполнения) - в таблицу logs для /api/logs
+    log_sink.install(load_config())
+
+    return runner, api_cache
@@ -9,9 +9,19 @@ from pathlib import Path
 from database import db
 from models import Announcement
 from sqlalchemy import func
+from loguru import logger
+import metrics
+import jobs
+from jobs import JobConflict
+from job_runner import JobQueueFull, PRIORITY_LOW
+from pipeline import get_pipeline
+from tenancy import tenant_id, tenant_db
+from api_features import install_features
 
 app = Flask(__name__, static_folder='../frontend/dist')
 CORS(app)
+metrics.install(app)
+jobs.install(app)
 
 CONFIG_PATH = "config.yaml"
 
@@ -42,7 +52,12 @@ def get_default_config():
     }
 
 
+# Фоновые задачи, поиск, выгрузка, цены, узлы, кеш ответов и логи (api_features.py)
+runner, api_cache = install_features(app, load_config, CONFIG_PATH)
+
+
 @app.route('/api/config', methods=['GET'])
+@api_cache.cached('config')
 def get_config():
     """Получить полный конфиг"""
     config = load_config()
@@ -59,6 +74,7 @@ def get_config():
 # ===== ГОРОДА =====
 
 @app.route('/api/cities', methods=['GET'])
+@api_cache.cached('config')
 def get_cities():
     """Получить все города"""
     config = load_config()
@@ -216,18 +232,25 @@ def update_stop_words():
 # ===== СТАТИСТИКА =====
 
 @app.route('/api/stats', methods=['GET'])
+@api_cache.cached('announcements')
 def get_stats():
     """Статистика"""
-    session = db.get_session()
+    config = load_config()
+    user_id = tenant_id(config)
+    session = tenant_db(config).get_session()
     
     try:
-        total = session.query(func.count(Announcement.id)).scalar()
-        new = session.query(func.count(Announcement.id)).filter(Announcement.status == 'new').scalar()
-        published = session.query(func.count(Announcement.id)).filter(Announcement.published_to_vk == True).scalar()
+        # Только объявления пользователя (индексы начинаются с user_id)
+        scoped = session.query(func.count(Announcement.id)).filter(Announcement.user_id == user_id)
+        total = scoped.scalar()
+        new = scoped.filter(Announcement.status == 'new').scalar()
+        published = scoped.filter(Announcement.published_to_vk == True).scalar()
         
         # По категориям
         by_category = {}
-        categories = session.query(Announcement.category, func.count(Announcement.id)).group_by(Announcement.category).all()
+        categories = session.query(Announcement.category, func.count(Announcement.id)).filter(
+            Announcement.user_id == user_id
+        ).group_by(Announcement.category).all()
         for cat, count in categories:
             by_category[cat] = count
         
@@ -242,16 +265,20 @@ def get_stats():
 
 
 @app.route('/api/announcements', methods=['GET'])
+@api_cache.cached('announcements')
 def get_announcements():
     """Список объявлений"""
-    session = db.get_session()
+    config = load_config()
+    session = tenant_db(config).get_session()
     
     try:
         limit = request.args.get('limit', 50, type=int)
         status = request.args.get('status', None)
         category = request.args.get('category', None)
         
-        query = session.query(Announcement).order_by(Announcement.created_at.desc())
+        query = session.query(Announcement).filter(
+            Announcement.user_id == tenant_id(config)
+        ).order_by(Announcement.created_at.desc())
         
         if status:
             query = query.filter(Announcement.status == status)
@@ -270,81 +297,52 @@ def get_announcements():
 @app.route('/api/fill-groups', methods=['POST'])
 def fill_groups():
     """Наполнить группы"""
-    import threading
-    from parser_improved import ImprovedAvitoParser
-    from publisher import VKPublisher
-    from telegram_publisher import TelegramPublisher
-    
     data = request.json
     days = data.get('days', 1)
     
     config = load_config()
+    pipeline = get_pipeline(config)
+    max_pages = days * 3
     
-    def fill_job():
-        try:
-            parser = ImprovedAvitoParser(config)
-            
-            total_found = 0
-            
-            # Парсим все активные города
-            for city in config.get('cities', []):
-                if not city.get('enabled', True):
-                    continue
-                
-                logger.info(f"🌍 Обработка: {city['name']}")
-                
-                # Парсим город
-                max_pages = days * 3
-                announcements = parser.parse_city(city, max_pages)
-                
-                if not announcements:
-                    continue
-                
-                # Фильтруем
-                stop_words = config.get('stop_words', [])
-                filtered = parser.filter_announcements(announcements, stop_words)
-                
-                # Сохраняем
-                stats = parser.save_to_db(filtered)
-                total_found += stats['new']
-            
-            # Публикуем
-            signatures = {}
-            for city in config.get('cities', []):
-                for source in city.get('sources', []):
-                    signatures[source['category']] = source.get('signature', '')
-            
-            if config.get('vk', {}).get('access_token'):
-                vk_pub = VKPublisher(
-                    access_token=config['vk']['access_token'],
-                    group_mappings=config['vk']['groups']
-                )
-                vk_pub.publish_announcements(signatures)
-            
-            if config.get('telegram', {}).get('bot_token'):
-                tg_pub = TelegramPublisher(
-                    bot_token=config['telegram']['bot_token'],
-                    channel_mappings=config['telegram']['channels']
-                )
-                tg_pub.publish_announcements(signatures)
-            
-            logger.success(f"✅ Наполнение завершено! {total_found} новых")
-            
-        except Exception as e:
-            logger.error(f"Ошибка: {e}", exc_info=True)
-    
-    thread = threading.Thread(target=fill_job, daemon=True)
-    thread.start()
-    
-    return jsonify({'message': f'Запущено наполнение за {days} дней', 'status': 'running'})
-
-
-if __name__ == '__main__':
+    def fill_job(job):
+        stats = pipeline.run(max_pages=max_pages, job=job)
+        logger.success(f"✅ Наполнение завершено! {stats['new']} новых")
+    
+    try:
+        job = runner.submit('fill', fill_job, key='fill', priority=PRIORITY_LOW,
+                            pages_total=pipeline.pages_total(max_pages), params={'days': days},
+                            yield_to=('cycle',))
+    except JobConflict as e:
+        return jsonify({'error': 'Наполнение уже выполняется', 'job': e.job}), 409
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    
+    return jsonify({'message': f'Запущено наполнение за {days} дней', 'status': 'queued', 'job_id': job.id})
+
+
+@app.route('/api/parser/status', methods=['GET'])
+def parser_status():
+    """Статус парсера: последний цикл и активные задачи"""
+    active = jobs.get_registry().list(active_only=True)
+    return jsonify({
+        'status': 'running' if active else 'idle',
+        'last_cycle': jobs.get_registry().last('cycle'),
+        'active_jobs': active
+    })
+
+
+def setup():
+    """Подготовка перед запуском (app.run и serve.py): БД и конфиг по умолчанию"""
+    db.configure(load_config().get('database'))
     db.init_db()
     
     if not os.path.exists(CONFIG_PATH):
         save_config(get_default_config())
         print("✅ Создан config.yaml")
-    
+
+
+if __name__ == '__main__':
+    # Для продакшена: python serve.py api_improved (несколько воркеров, без debug)
+    setup()
     print("🚀 API запущен: http://0.0.0.0:5000")
     app.run(host='0.0.0.0', port=5000, debug=True)
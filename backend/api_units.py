@@ -6,54 +6,48 @@
 
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
-import sqlite3
+import units_db
 import yaml
 import os
+import json
 from datetime import datetime
+import jobs
+from jobs import JobConflict
+import job_runner
+from job_runner import JobQueueFull, PRIORITY_LOW
+from rules import RuleError, compile_rules
 
 app = Flask(__name__)
 CORS(app)
+jobs.install(app)
 
 DB_PATH = '../data/avito_parser.db'
 CONFIG_PATH = 'config.yaml'
 
-# Инициализация БД
+
+def load_config():
+    """Загрузка конфига (токены VK/TG, прокси, стоп-слова)"""
+    if os.path.exists(CONFIG_PATH):
+        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+            return yaml.safe_load(f) or {}
+    return {}
+
+
+# Фоновые задачи (наполнение единиц) - ограниченный пул с очередью
+runner = job_runner.create_runner(load_config())
+job_runner.install(app, runner)
+
+# Соединение с БД единиц на запрос (из пула, возвращается в teardown)
+get_conn = units_db.install(app, lambda: DB_PATH)
+
+
+# Инициализация БД - при запуске сервера, не при импорте (схему всё равно создаёт
+# первое соединение пула, а импорт модуля - например воркером - не должен трогать файл БД)
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # Таблица единиц
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS units (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            city_slug TEXT NOT NULL,
-            vk_group_id TEXT,
-            telegram_channel_id TEXT,
-            is_enabled INTEGER DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Таблица ссылок единицы
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS unit_sources (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            unit_id INTEGER,
-            category TEXT NOT NULL,
-            url_path TEXT NOT NULL,
-            signature TEXT,
-            is_enabled INTEGER DEFAULT 1,
-            FOREIGN KEY (unit_id) REFERENCES units(id) ON DELETE CASCADE
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    with units_db.get_pool(DB_PATH).connection():
+        pass  # Схема и индексы создаются при первом соединении пула
     print("✅ База данных инициализирована")
 
-init_db()
-
 # Категории по умолчанию
 DEFAULT_SOURCES = [
     {'category': 'avtomobili', 'url_path': 'avtomobili', 'signature': '🚗 Авто'},
@@ -77,20 +71,8 @@ def static_files(path):
 # API: Получить все единицы
 @app.route('/api/units', methods=['GET'])
 def get_units():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    
-    c.execute('SELECT * FROM units ORDER BY created_at DESC')
-    units = [dict(row) for row in c.fetchall()]
-    
-    # Добавляем ссылки к каждой единице
-    for unit in units:
-        c.execute('SELECT * FROM unit_sources WHERE unit_id = ?', (unit['id'],))
-        unit['sources'] = [dict(row) for row in c.fetchall()]
-    
-    conn.close()
-    return jsonify(units)
+    # Единицы и их ссылки - одним запросом
+    return jsonify(units_db.fetch_units(get_conn()))
 
 # API: Создать единицу
 @app.route('/api/units', methods=['POST'])
@@ -100,30 +82,32 @@ def create_unit():
     city_slug = data.get('city_slug')
     vk_group_id = data.get('vk_group_id', '')
     telegram_channel_id = data.get('telegram_channel_id', '')
+    rules = data.get('rules') or {}
     
     if not name or not city_slug:
         return jsonify({'error': 'Заполни название и город'}), 400
-    
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # Создаём единицу
-    c.execute('''
-        INSERT INTO units (name, city_slug, vk_group_id, telegram_channel_id)
-        VALUES (?, ?, ?, ?)
-    ''', (name, city_slug, vk_group_id, telegram_channel_id))
-    
-    unit_id = c.lastrowid
-    
-    # Добавляем ссылки по умолчанию
-    for src in DEFAULT_SOURCES:
-        c.execute('''
+    try:
+        compile_rules(rules)
+    except RuleError as e:
+        return jsonify({'error': f'Ошибка в правилах: {e}'}), 400
+    
+    conn = get_conn()
+    
+    with conn:
+        # Создаём единицу
+        c = conn.execute('''
+            INSERT INTO units (name, city_slug, vk_group_id, telegram_channel_id, rules)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (name, city_slug, vk_group_id, telegram_channel_id,
+              json.dumps(rules, ensure_ascii=False) if rules else None))
+        
+        unit_id = c.lastrowid
+        
+        # Добавляем ссылки по умолчанию
+        conn.executemany('''
             INSERT INTO unit_sources (unit_id, category, url_path, signature, is_enabled)
             VALUES (?, ?, ?, ?, 0)
-        ''', (unit_id, src['category'], src['url_path'], src['signature']))
-    
-    conn.commit()
-    conn.close()
+        ''', [(unit_id, src['category'], src['url_path'], src['signature']) for src in DEFAULT_SOURCES])
     
     return jsonify({'success': True, 'id': unit_id, 'message': 'Единица создана'})
 
@@ -133,50 +117,55 @@ def update_sources(unit_id):
     data = request.json
     sources = data.get('sources', [])
     
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    conn = get_conn()
     
     # Обновляем is_enabled для каждой ссылки
-    for src in sources:
-        c.execute('''
+    with conn:
+        conn.executemany('''
             UPDATE unit_sources 
             SET is_enabled = ?
             WHERE id = ? AND unit_id = ?
-        ''', (1 if src.get('is_enabled') else 0, src['id'], unit_id))
-    
-    conn.commit()
-    conn.close()
+        ''', [(1 if src.get('is_enabled') else 0, src['id'], unit_id) for src in sources])
     
     return jsonify({'success': True})
 
+# API: Правила отбора единицы (rules.py) - только проверенные сохраняются
+@app.route('/api/units/<int:unit_id>/rules', methods=['PUT'])
+def update_rules(unit_id):
+    rules = request.json or {}
+    try:
+        compile_rules(rules)
+    except RuleError as e:
+        return jsonify({'error': f'Ошибка в правилах: {e}'}), 400
+    
+    conn = get_conn()
+    
+    with conn:
+        c = conn.execute('UPDATE units SET rules = ? WHERE id = ?',
+                         (json.dumps(rules, ensure_ascii=False) if rules else None, unit_id))
+    
+    if not c.rowcount:
+        return jsonify({'error': 'Единица не найдена'}), 404
+    return jsonify({'success': True, 'rules': rules})
+
 # API: Включить/выключить единицу
 @app.route('/api/units/<int:unit_id>/toggle', methods=['POST'])
 def toggle_unit(unit_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    conn = get_conn()
     
-    c.execute('SELECT is_enabled FROM units WHERE id = ?', (unit_id,))
-    row = c.fetchone()
+    with conn:
+        conn.execute('UPDATE units SET is_enabled = 1 - is_enabled WHERE id = ?', (unit_id,))
     
-    if row:
-        new_state = 0 if row[0] else 1
-        c.execute('UPDATE units SET is_enabled = ? WHERE id = ?', (new_state, unit_id))
-        conn.commit()
-    
-    conn.close()
     return jsonify({'success': True})
 
 # API: Удалить единицу
 @app.route('/api/units/<int:unit_id>', methods=['DELETE'])
 def delete_unit(unit_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    c.execute('DELETE FROM units WHERE id = ?', (unit_id,))
-    c.execute('DELETE FROM unit_sources WHERE unit_id = ?', (unit_id,))
+    conn = get_conn()
     
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute('DELETE FROM unit_sources WHERE unit_id = ?', (unit_id,))
+        conn.execute('DELETE FROM units WHERE id = ?', (unit_id,))
     
     return jsonify({'success': True})
 
@@ -185,26 +174,39 @@ def delete_unit(unit_id):
 def fill_unit(unit_id):
     data = request.json
     days = data.get('days', 1)
-    
-    # TODO: Запустить парсер для этой единицы
-    return jsonify({'success': True, 'message': f'Запущено наполнение за {days} дней'})
+    max_pages = days * 3
+    
+    # Парсер и публикаторы - при первом наполнении, не при импорте API
+    from pipeline import get_pipeline
+    from unit_crawler import UnitCrawler
+    crawler = UnitCrawler(get_pipeline(load_config()), DB_PATH)
+    pages_total = crawler.pages_total([unit_id], max_pages)
+    if not pages_total:
+        return jsonify({'error': 'Единица выключена или у неё нет включённых ссылок'}), 400
+    
+    def fill_job(job):
+        crawler.run([unit_id], max_pages=max_pages, job=job)
+    
+    try:
+        job = runner.submit('fill', fill_job, key=f'unit-fill:{unit_id}', priority=PRIORITY_LOW,
+                            pages_total=pages_total, params={'unit_id': unit_id, 'days': days},
+                            yield_to=('cycle',))
+    except JobConflict as e:
+        return jsonify({'error': 'Наполнение этой единицы уже выполняется', 'job': e.job}), 409
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    
+    return jsonify({'success': True, 'message': f'Запущено наполнение за {days} дней', 'job_id': job.id})
 
 # API: Статистика
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    c.execute('SELECT COUNT(*) FROM ads')
-    total = c.fetchone()[0]
-    
-    c.execute('SELECT COUNT(*) FROM ads WHERE is_published = 0')
-    new = c.fetchone()[0]
-    
-    c.execute('SELECT COUNT(*) FROM ads WHERE is_published = 1')
-    published = c.fetchone()[0]
-    
-    conn.close()
+    total, new, published = get_conn().execute('''
+        SELECT COUNT(*),
+               COALESCE(SUM(is_published = 0), 0),
+               COALESCE(SUM(is_published = 1), 0)
+        FROM ads
+    ''').fetchone()
     
     return jsonify({
         'total': total,
@@ -221,6 +223,13 @@ def get_config():
         return jsonify(config)
     return jsonify({})
 
+def setup():
+    """Подготовка перед запуском (app.run и serve.py)"""
+    init_db()
+
+
 if __name__ == '__main__':
+    # Для продакшена: python serve.py api_units (несколько воркеров, без debug)
+    setup()
     print("🚀 Dashboard запущен: http://localhost:5000")
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,3 @@
+"""
+Бенчмарки парсеров - записанные страницы Авито и локальный мок-сервер
+"""
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк поиска похожих фото: multi-index hashing против перебора
+
+Хеши синтетические (Pillow не нужен): случайные 64 бита плюс группы "одного фото"
+с несколькими перевёрнутыми битами - как пережатые копии у перекупов.
+
+Запуск (из backend/):
+    python -m bench.bench_image_hash                    # 1 000 000 хешей
+    python -m bench.bench_image_hash --hashes 200000 --radius 8
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+def perturb(rnd: random.Random, value: int, bits: int) -> int:
+    for bit in rnd.sample(range(64), bits):
+        value ^= 1 << bit
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк индекса перцептивных хешей")
+    parser.add_argument("--hashes", type=int, default=1000000)
+    parser.add_argument("--radius", type=int, default=6)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    from image_hash import HashIndex, distance
+
+    rnd = random.Random(42)
+    originals = [rnd.getrandbits(64) for _ in range(args.hashes // 10)]
+    values = list(originals)
+    while len(values) < args.hashes:
+        # Копии одного фото: 0..radius бит различия
+        values.append(perturb(rnd, rnd.choice(originals), rnd.randint(0, args.radius)))
+
+    index = HashIndex()
+    start = time.perf_counter()
+    for key, value in enumerate(values):
+        index.add(key, value)
+    print(f"Хешей: {len(values)}, построение индекса: {time.perf_counter() - start:.1f} c")
+
+    queries = [perturb(rnd, rnd.choice(originals), rnd.randint(0, args.radius)) for _ in range(args.queries)]
+    queries += [rnd.getrandbits(64) for _ in range(args.queries)]  # Новые фото - без совпадений
+
+    timings, found = [], 0
+    for query in queries:
+        start = time.perf_counter()
+        found += len(index.search(query, args.radius))
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    print(f"MIH, radius {args.radius}: p50 {statistics.median(timings):.3f} мс, "
+          f"p99 {timings[int(len(timings) * 0.99) - 1]:.3f} мс, найдено в среднем {found / len(queries):.1f}")
+
+    # Проверка полноты и скорость перебора на части запросов
+    sample = queries[:20]
+    start = time.perf_counter()
+    for query in sample:
+        expected = {key for key, value in enumerate(values) if distance(query, value) <= args.radius}
+        assert expected == {key for key, _ in index.search(query, args.radius)}, "MIH потерял совпадения"
+    print(f"Перебор: {(time.perf_counter() - start) * 1000 / len(sample):.1f} мс на запрос (результаты совпали)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Время импорта точек входа (python -X importtime) - проверка на регресс запуска
+
+Каждая точка входа импортируется в отдельном процессе (из временного каталога, чтобы
+не трогать data/), время - медиана нескольких запусков. Проверка падает (код 1), если
+точка входа при импорте тянет тяжёлую подсистему, которая должна грузиться при первом
+использовании (парсер, vk_api, telegram, bs4, ...), создаёт файлы (БД, таблицы - только
+при первом использовании или в setup()) или не укладывается в бюджет.
+
+Запуск (из backend/):
+    python -m bench.bench_import
+    python -m bench.bench_import --runs 5 --budget-scale 1.5
+"""
+import argparse
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Точка входа -> бюджет, мс: медиана замеров на 1 CPU + ~40% на шум (другая машина - --budget-scale).
+# api_units и job_runner не грузят SQLAlchemy при импорте (реестр задач - jobs.get_registry())
+ENTRY_POINTS = {
+    'main': 750,
+    'api': 950,
+    'api_improved': 950,
+    'api_units': 400,
+    'job_runner': 160,
+}
+
+# Не должны загружаться при импорте ни одной точки входа
+LAZY_MODULES = [
+    'parser', 'parser_improved', 'publisher', 'telegram_publisher', 'enrichment', 'image_hash',
+    'retention', 'unit_crawler',
+    'vk_api', 'telegram', 'bs4', 'lxml', 'PIL', 'numpy', 'zstandard', 'psycopg2', 'psycopg',
+]
+# Модули, которые нужны конкретной точке входа ({точка входа: {модуль, ...}})
+ALLOWED: Dict[str, set] = {}
+
+_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def import_profile(module: str, workdir: str) -> Tuple[float, Dict[str, int]]:
+    """(время импорта модуля, мс; {загруженный модуль: накопленное время, мкс})"""
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=workdir, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module}:\n{result.stderr[-2000:]}")
+
+    loaded = {}
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            loaded[match.group(4)] = int(match.group(2))
+    return loaded[module] / 1000, loaded
+
+
+def created_files(workdir: str) -> List[str]:
+    """Файлы, появившиеся в каталоге запуска (пустой каталог data/ создавался и раньше)"""
+    return [os.path.relpath(os.path.join(root, name), workdir)
+            for root, _, names in os.walk(workdir) for name in names]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время импорта точек входа")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="Множитель бюджетов")
+    parser.add_argument("--top", type=int, default=5, help="Самых тяжёлых прямых импортов в отчёте")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="avito-import-bench-")
+    failures: List[str] = []
+    try:
+        print(f"{'точка входа':<16}{'мс':>8}{'бюджет':>9}  тяжёлые импорты")
+        for module, budget in ENTRY_POINTS.items():
+            timings = []
+            for _ in range(args.runs):
+                elapsed, loaded = import_profile(module, workdir)
+                timings.append(elapsed)
+            elapsed = statistics.median(timings)
+            budget *= args.budget_scale
+
+            top_level = sorted(
+                ((name, us) for name, us in loaded.items() if '.' not in name and name != module),
+                key=lambda item: item[1], reverse=True,
+            )[:args.top]
+            heavy = ', '.join(f"{name} {us / 1000:.0f}" for name, us in top_level)
+            print(f"{module:<16}{elapsed:>8.0f}{budget:>9.0f}  {heavy}")
+
+            eager = [name for name in LAZY_MODULES if name in loaded and name not in ALLOWED.get(module, ())]
+            if eager:
+                failures.append(f"{module}: при импорте загружены {', '.join(eager)}")
+            created = created_files(workdir)
+            if created:
+                failures.append(f"{module}: при импорте созданы {', '.join(created)}")
+                shutil.rmtree(workdir, ignore_errors=True)
+                os.makedirs(workdir)
+            if elapsed > budget:
+                failures.append(f"{module}: {elapsed:.0f} мс > бюджета {budget:.0f} мс")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if failures:
+        print("\n❌ " + "\n❌ ".join(failures))
+        sys.exit(1)
+    print("\n✅ Все точки входа в бюджете, тяжёлые подсистемы не загружаются при импорте")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк статистики цен: t-digest против точных квантилей
+
+Цены синтетические, логнормальные (как цены объявлений категории). Проверяются:
+пересборка скетча пачкой, поток add() как при сохранении, ошибка процентиля и
+квантилей относительно отсортированного массива, время процентиля одной цены.
+
+Запуск (из backend/):
+    python -m bench.bench_price_stats                   # 1 000 000 цен
+    python -m bench.bench_price_stats --prices 200000 --compression 200
+"""
+import argparse
+import bisect
+import os
+import random
+import statistics
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк квантильных скетчей цен")
+    parser.add_argument("--prices", type=int, default=1000000)
+    parser.add_argument("--compression", type=float, default=100)
+    parser.add_argument("--queries", type=int, default=10000)
+    args = parser.parse_args()
+
+    import price_stats
+    from price_stats import TDigest, QUANTILES
+
+    rnd = random.Random(42)
+    prices = [round(rnd.lognormvariate(13, 0.8), -3) for _ in range(args.prices)]
+    exact = sorted(prices)
+    print(f"Цен: {len(prices)}, NumPy: {'да' if price_stats._np() else 'нет'}")
+
+    start = time.perf_counter()
+    built = TDigest.from_values(prices, args.compression)
+    print(f"Пересборка пачкой: {time.perf_counter() - start:.2f} c, центроидов {len(built.means)}")
+
+    start = time.perf_counter()
+    streamed = TDigest(args.compression)
+    for price in prices:
+        streamed.add(price)
+    streamed.quantile(0.5)
+    elapsed = time.perf_counter() - start
+    print(f"Поток add(): {elapsed / len(prices) * 1e6:.2f} мкс на цену, центроидов {len(streamed.means)}")
+
+    for name, digest in (('пачка', built), ('поток', streamed)):
+        errors = []
+        for q in QUANTILES:
+            true = exact[int(q * (len(exact) - 1))]
+            errors.append(abs(digest.quantile(q) - true) / true * 100)
+        print(f"  {name}: ошибка квантилей p10..p90 - макс {max(errors):.2f}% цены")
+
+    queries = [rnd.choice(prices) * rnd.uniform(0.5, 1.5) for _ in range(args.queries)]
+    timings, errors = [], []
+    for price in queries:
+        t = time.perf_counter()
+        percentile = built.cdf(price) * 100
+        timings.append((time.perf_counter() - t) * 1e6)
+        errors.append(abs(percentile - bisect.bisect_right(exact, price) / len(exact) * 100))
+    print(f"Процентиль цены: p50 {statistics.median(timings):.1f} мкс, "
+          f"ошибка в среднем {statistics.mean(errors):.2f} п.п., макс {max(errors):.2f} п.п.")
+
+    start = time.perf_counter()
+    for price in queries[:20]:
+        sum(1 for value in prices if value <= price)
+    print(f"Для сравнения - проход по всем ценам: {(time.perf_counter() - start) / 20 * 1000:.0f} мс на цену")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк кеша ответов API: опрос дашборда без кеша, из памяти и через 304
+
+БД временная (SQLite), объявления синтетические. Один "опрос" - /api/stats и
+/api/announcements?limit=100, как делает дашборд. Сравниваются: кеш выключен,
+тело из памяти (другой клиент, тот же ETag), If-None-Match -> 304; печатается
+и размер ответа без сжатия и в gzip.
+
+Запуск (из backend/):
+    python -m bench.bench_response_cache                  # 20 000 объявлений
+    python -m bench.bench_response_cache --ads 100000 --polls 500
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+POLL = ('/api/stats', '/api/announcements?limit=100')
+
+
+def poll(client, headers_for) -> float:
+    start = time.perf_counter()
+    for path in POLL:
+        response = client.get(path, headers=headers_for(path))
+        assert response.status_code in (200, 304), f"{path}: {response.status_code}"
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк кеша ответов API")
+    parser.add_argument("--ads", type=int, default=20000)
+    parser.add_argument("--polls", type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_api_cache_")
+    os.chdir(workdir)  # БД по умолчанию - ../data относительно текущего каталога
+    os.makedirs("run", exist_ok=True)
+    os.chdir("run")
+
+    from loguru import logger
+    logger.remove()
+
+    import api
+    from models import Announcement
+
+    api.db.init_db()
+    session = api.db.get_session()
+    categories = ['flats', 'cars', 'jobs', 'electronics', 'services']
+    api.db.insert(session, Announcement, [{
+        'user_id': 0, 'avito_id': str(i), 'title': f"Объявление {i} " + "описание " * 5,
+        'description': "текст объявления " * 20, 'price': 1000 + i, 'url': f"https://www.avito.ru/x/{i}",
+        'category': categories[i % len(categories)], 'city': 'Воркута', 'status': 'new',
+    } for i in range(args.ads)], conflict=('user_id', 'avito_id'))
+    session.commit()
+    session.close()
+
+    client = api.app.test_client()
+    cache = api.api_cache
+    etags = {path: client.get(path).headers.get('ETag') for path in POLL}
+    sizes = {path: (len(client.get(path).data),
+                    len(client.get(path, headers={'Accept-Encoding': 'gzip'}).data)) for path in POLL}
+
+    cache.enabled = False
+    plain = [poll(client, lambda path: {}) for _ in range(args.polls)]
+    cache.enabled = True
+    hits = [poll(client, lambda path: {'Accept-Encoding': 'gzip'}) for _ in range(args.polls)]
+    not_modified = [poll(client, lambda path: {'If-None-Match': etags[path]}) for _ in range(args.polls)]
+
+    print(f"Объявлений: {args.ads}, опросов: {args.polls} ({' + '.join(POLL)})")
+    for path, (raw, packed) in sizes.items():
+        print(f"  {path}: {raw / 1024:.1f} КБ, gzip {packed / 1024:.1f} КБ")
+    for name, timings in (('без кеша', plain), ('тело из памяти', hits), ('304 по ETag', not_modified)):
+        print(f"{name:>15}: p50 {statistics.median(timings):.2f} мс, max {max(timings):.2f} мс на опрос")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк правил отбора: раздача страницы объявлений по единицам со своими правилами
+
+Единицы получают случайные наборы (цена, ключевые слова, тип продавца, адрес);
+часть единиц делит одинаковые наборы, как бывает с шаблонами. Сравнивается
+rules.route (признаки один раз на объявление, набор компилируется один раз) с
+проверкой каждого объявления по словарю правил без компиляции.
+
+Запуск (из backend/):
+    python -m bench.bench_rules                     # 2000 единиц, страница 50
+    python -m bench.bench_rules --units 5000 --page 100
+"""
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+WORDS = ["лада", "тойота", "киа", "зимняя резина", "битый", "на запчасти", "торг", "гараж",
+         "однушка", "студия", "ремонт", "срочно", "обмен", "кредит", "дизель", "автомат"]
+PLACES = ["центр", "ул. Ленина", "пос. Северный", "Воргашор", "Комсомольский"]
+
+
+def random_rules(rnd: random.Random) -> dict:
+    spec = {}
+    if rnd.random() < 0.8:
+        low = rnd.choice([0, 1000, 50000, 200000])
+        spec['price'] = {'min': low, 'max': low * rnd.randint(5, 50) or 100000}
+    if rnd.random() < 0.5:
+        spec['include'] = rnd.sample(WORDS, rnd.randint(1, 3))
+    if rnd.random() < 0.7:
+        spec['exclude'] = rnd.sample(WORDS, rnd.randint(1, 4)) + ["re:\\bна запчаст"]
+    if rnd.random() < 0.5:
+        spec['author_types'] = ['private']
+    if rnd.random() < 0.3:
+        spec['location'] = rnd.sample(PLACES, 2)
+    return spec
+
+
+def random_ad(rnd: random.Random, i: int) -> dict:
+    return {
+        'avito_id': str(i),
+        'title': ' '.join(rnd.sample(WORDS, 2)).capitalize(),
+        'description': ' '.join(rnd.choice(WORDS) for _ in range(30)),
+        'price': rnd.choice([None, rnd.randint(500, 3000000)]),
+        'author_type': rnd.choice(['private', 'private', 'business']),
+        'location': rnd.choice(PLACES),
+        'city': 'Воркута',
+        'url': f"https://www.avito.ru/vorkuta/{i}",
+    }
+
+
+def interpreted(spec: dict, ad: dict) -> bool:
+    """Те же правила по словарю, без компиляции - для сравнения"""
+    text = f"{ad.get('title') or ''} {ad.get('description') or ''}".lower()
+    price = ad.get('price') or None
+    if 'price' in spec:
+        if price is None or not spec['price']['min'] <= price <= spec['price']['max']:
+            return False
+    if 'include' in spec and not any(word in text for word in spec['include']):
+        return False
+    if 'exclude' in spec:
+        for word in spec['exclude']:
+            if word.startswith('re:'):
+                if re.search(word[3:], text, re.I):
+                    return False
+            elif word in text:
+                return False
+    if 'author_types' in spec and ad.get('author_type') not in spec['author_types']:
+        return False
+    if 'location' in spec:
+        place = f"{ad.get('location') or ''} {ad.get('city') or ''}".lower()
+        if not any(word.lower() in place for word in spec['location']):
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк правил отбора единиц")
+    parser.add_argument("--units", type=int, default=2000)
+    parser.add_argument("--templates", type=int, default=400, help="Различных наборов правил")
+    parser.add_argument("--page", type=int, default=50, help="Объявлений на странице")
+    parser.add_argument("--pages", type=int, default=50)
+    args = parser.parse_args()
+
+    from rules import compile_rules, route
+
+    rnd = random.Random(42)
+    templates = [random_rules(rnd) for _ in range(args.templates)]
+    specs = {unit_id: rnd.choice(templates) for unit_id in range(args.units)}
+    pages = [[random_ad(rnd, p * args.page + i) for i in range(args.page)] for p in range(args.pages)]
+
+    start = time.perf_counter()
+    rule_sets = {unit_id: compile_rules(spec) for unit_id, spec in specs.items()}
+    print(f"Единиц: {args.units}, наборов: {args.templates}, "
+          f"компиляция: {(time.perf_counter() - start) * 1000:.1f} мс")
+
+    timings, linked = [], 0
+    for page in pages:
+        start = time.perf_counter()
+        selected = route(page, rule_sets)
+        timings.append((time.perf_counter() - start) * 1000)
+        linked += sum(len(ads) for ads in selected.values())
+    per_check = statistics.median(timings) * 1e6 / (args.page * args.templates)
+    print(f"route: страница {args.page} объявлений -> {args.units} единиц: "
+          f"p50 {statistics.median(timings):.2f} мс, max {max(timings):.2f} мс, "
+          f"{per_check:.0f} нс на объявление x набор, в ленты {linked / len(pages):.0f} на страницу")
+
+    sample = pages[:5]
+    elapsed = 0.0
+    for page in sample:
+        start = time.perf_counter()
+        expected = {unit_id: [ad for ad in page if interpreted(spec, ad)] for unit_id, spec in specs.items()}
+        elapsed += time.perf_counter() - start
+        assert expected == route(page, rule_sets), "Результаты route и словаря правил разошлись"
+    print(f"Словарь правил на каждую единицу: {elapsed * 1000 / len(sample):.1f} мс на страницу (результаты совпали)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк поиска: FTS5 + bm25 против LIKE по большому числу объявлений
+
+Запуск (из backend/):
+    python -m bench.bench_search                     # 200 000 объявлений
+    python -m bench.bench_search --rows 2000000 --requests 20
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+WORDS = {
+    'avtomobili': ['автомобиль', 'седан', 'хэтчбек', 'дизель', 'бензин', 'пробег', 'резина', 'зимняя',
+                   'лада', 'тойота', 'киа', 'хендай', 'рено', 'шевроле', 'коробка', 'автомат'],
+    'kvartiry': ['квартира', 'студия', 'однокомнатная', 'двухкомнатная', 'ремонт', 'балкон', 'этаж',
+                 'центр', 'ипотека', 'собственник', 'кирпичный', 'панельный', 'лифт', 'парковка'],
+    'telefony': ['телефон', 'смартфон', 'айфон', 'самсунг', 'сяоми', 'зарядка', 'чехол', 'экран',
+                 'память', 'гарантия', 'коробка', 'новый', 'царапины', 'аккумулятор'],
+}
+CITIES = ['Воркута', 'Ёлкино', 'Инта', 'Ухта', 'Сыктывкар', 'Печора', 'Усинск']
+QUERIES = ['кирпичная квартира', 'айфон гарантия', 'зимняя резина', 'елкино студия', 'тойота автомат дизель']
+
+
+def seed(db_path: str, rows: int):
+    """Объявления пачками напрямую (триггеры FTS наполняют индекс по ходу)"""
+    from database import Database
+    import search
+
+    database = Database(db_path)
+    database.init_db()
+    search.ensure_index(database)
+    database.close()
+
+    rnd = random.Random(42)
+    # Общая лексика объявлений: тысячи слов, частые встречаются чаще (Ципф)
+    syllables = ['ка', 'ро', 'ми', 'на', 'ле', 'ст', 'во', 'ти', 'да', 'пе', 'ру', 'зо', 'ны', 'ша']
+    vocab = list({''.join(rnd.choice(syllables) for _ in range(rnd.randint(2, 4))) for _ in range(5000)})
+    weights = [1 / (rank + 1) for rank in range(len(vocab))]
+    conn = sqlite3.connect(db_path)
+    batch = []
+    for i in range(rows):
+        category = rnd.choice(list(WORDS))
+        words = WORDS[category]
+        title = ' '.join(rnd.sample(words, 3)).capitalize()
+        description = ' '.join(rnd.choices(vocab, weights, k=25) + rnd.sample(words, 4))
+        batch.append((0, str(i), title, description, rnd.randint(1000, 10 ** 7), category,
+                      rnd.choice(CITIES), 'new'))
+        if len(batch) == 10000:
+            conn.executemany(
+                "INSERT INTO announcements (user_id, avito_id, title, description, price, category, location, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)", batch)
+            conn.commit()
+            batch = []
+    if batch:
+        conn.executemany(
+            "INSERT INTO announcements (user_id, avito_id, title, description, price, category, location, status, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)", batch)
+        conn.commit()
+    conn.execute(f"INSERT INTO {search.FTS_TABLE}({search.FTS_TABLE}) VALUES ('optimize')")
+    conn.commit()
+    conn.close()
+
+
+def like_search(conn: sqlite3.Connection, query: str, limit: int = 20):
+    """Как искали раньше: LIKE по заголовку и описанию"""
+    words = query.split()
+    where = ' AND '.join("(title LIKE ? OR description LIKE ?)" for _ in words)
+    params = [p for w in words for p in (f"%{w[:-1]}%", f"%{w[:-1]}%")]
+    return conn.execute(f"SELECT id, title FROM announcements WHERE user_id = 0 AND {where} "
+                        f"ORDER BY created_at DESC LIMIT {limit}", params).fetchall()
+
+
+def measure(fn: Callable[[], object], requests: int) -> Dict[str, float]:
+    fn()  # прогрев
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        'p50_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(timings[max(0, int(len(timings) * 0.95) - 1)], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк полнотекстового поиска")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--requests", type=int, default=10)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="avito-search-bench-")
+    try:
+        from database import Database
+        import search
+
+        db_path = os.path.join(workdir, "data", "search.db")
+        start = time.perf_counter()
+        seed(db_path, args.rows)
+        print(f"Объявлений: {args.rows}, вставка с индексом: {time.perf_counter() - start:.1f} c")
+
+        database = Database(db_path)
+        conn = sqlite3.connect(db_path)
+
+        print(f"{'запрос':<26}{'найдено':>9}{'FTS p50':>10}{'FTS p95':>10}{'LIKE p50':>11}")
+        for query in QUERIES:
+            found = len(search.search(database, 0, query)['results'])
+            fts = measure(lambda: search.search(database, 0, query), args.requests)
+            like = measure(lambda: like_search(conn, query), max(1, args.requests // 5))
+            print(f"{query:<26}{found:>9}{fts['p50_ms']:>10}{fts['p95_ms']:>10}{like['p50_ms']:>11}")
+
+        conn.close()
+        database.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
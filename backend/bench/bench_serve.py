@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный бенчмарк Dashboard API: `python api.py` (debug-сервер) против serve.py
+
+Каталог и БД временные, объявления синтетические. Каждый сервер запускается
+отдельным процессом в этом каталоге; клиенты - отдельные процессы, каждый в
+цикле опрашивает /api/stats, /api/announcements?limit=50 и /api/config (как
+дашборд, без If-None-Match) новым соединением на запрос, --duration секунд.
+Печатаются запросы в секунду, p50/p99 задержки и ошибки.
+
+api.py слушает порт 5000 (так написан), serve.py - --port.
+
+Запуск (из backend/):
+    python -m bench.bench_serve                        # 16 клиентов, 10 c
+    python -m bench.bench_serve --clients 32 --workers 4 --duration 20
+    python -m bench.bench_serve --no-cache             # api_cache.enabled: false
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+PATHS = ('/api/stats', '/api/announcements?limit=50', '/api/config')
+
+
+def prepare(workdir: str, ads: int, cache: bool):
+    """config.yaml и БД с объявлениями в workdir (БД по умолчанию - data/ относительно cwd)"""
+    import yaml
+
+    os.chdir(workdir)
+    from loguru import logger
+    logger.remove()
+
+    import api
+    from models import Announcement
+
+    config = api.get_default_config()
+    config['api_cache'] = {'enabled': cache}
+    config['logging'] = {'database': {'enabled': False}}
+    with open(os.path.join(workdir, 'config.yaml'), 'w', encoding='utf-8') as f:
+        yaml.dump(config, f, allow_unicode=True)
+
+    api.db.init_db()
+    session = api.db.get_session()
+    categories = ['flats', 'cars', 'jobs', 'electronics', 'services']
+    api.db.insert(session, Announcement, [{
+        'user_id': 0, 'avito_id': str(i), 'title': f"Объявление {i}", 'description': "текст объявления " * 20,
+        'price': 1000 + i, 'url': f"https://www.avito.ru/x/{i}", 'category': categories[i % len(categories)],
+        'city': 'Воркута', 'status': 'new',
+    } for i in range(ads)], conflict=('user_id', 'avito_id'))
+    session.commit()
+    session.close()
+
+
+def wait_ready(port: int, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/api/stats')
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Сервер на порту {port} не ответил за {timeout:.0f} c")
+
+
+def client(args) -> tuple:
+    """Один клиент: запросы по кругу до конца окна; (задержки в мс, ошибки)"""
+    port, duration, offset = args
+    timings, errors = [], 0
+    deadline = time.monotonic() + duration
+    i = offset
+    while time.monotonic() < deadline:
+        path = PATHS[i % len(PATHS)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            conn.close()
+            if response.status != 200:
+                errors += 1
+                continue
+        except OSError:
+            errors += 1
+            continue
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, errors
+
+
+def load(port: int, clients: int, duration: float):
+    with multiprocessing.get_context('spawn').Pool(clients) as pool:
+        results = pool.map(client, [(port, duration, n) for n in range(clients)])
+    timings = sorted(t for result in results for t in result[0])
+    errors = sum(result[1] for result in results)
+    return timings, errors
+
+
+def run(name: str, command: list, port: int, workdir: str, clients: int, duration: float):
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR)
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL, start_new_session=True)
+    try:
+        wait_ready(port)
+        timings, errors = load(port, clients, duration)
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(10)
+
+    if not timings:
+        print(f"{name:>28}: нет успешных ответов, ошибок {errors}")
+        return
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f"{name:>28}: {len(timings) / duration:7.0f} запр/с, p50 {statistics.median(timings):6.1f} мс, "
+          f"p99 {p99:6.1f} мс, ошибок {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк Dashboard API")
+    parser.add_argument("--ads", type=int, default=20000)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=max(2, min(os.cpu_count() or 1, 8)))
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--no-cache", action="store_true", help="Без кеша ответов (response_cache)")
+    parser.add_argument("--skip-dev", action="store_true", help="Не запускать api.py (порт 5000 занят)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_serve_")
+    prepare(workdir, args.ads, cache=not args.no_cache)
+    print(f"Объявлений: {args.ads}, клиентов: {args.clients}, {args.duration:.0f} c на сервер, "
+          f"кеш ответов: {'нет' if args.no_cache else 'да'}, CPU: {os.cpu_count()}")
+
+    if not args.skip_dev:
+        run("python api.py (debug)", [sys.executable, os.path.join(BACKEND_DIR, 'api.py')], 5000,
+            workdir, args.clients, args.duration)
+    serve = [sys.executable, os.path.join(BACKEND_DIR, 'serve.py'), 'api', '--bind', f"127.0.0.1:{args.port}",
+             '--threads', str(args.threads)]
+    run("serve.py, 1 воркер", serve + ['--workers', '1'], args.port, workdir, args.clients, args.duration)
+    run(f"serve.py, {args.workers} воркеров", serve + ['--workers', str(args.workers)], args.port,
+        workdir, args.clients, args.duration)
+
+
+if __name__ == "__main__":
+    main()
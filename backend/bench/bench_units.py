@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк API единиц: GET /api/units на большом числе единиц
+
+Запуск (из backend/):
+    python -m bench.bench_units                 # 1000 единиц x 7 ссылок
+    python -m bench.bench_units --units 5000 --requests 20
+
+Сравнивает текущую реализацию (пул соединений + один JOIN) с прежней
+(новое соединение на запрос + SELECT ссылок на каждую единицу, без индекса).
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+def seed(db_path: str, units: int):
+    """Заполнить БД единицами с набором ссылок по умолчанию"""
+    import units_db
+    from api_units import DEFAULT_SOURCES
+
+    with units_db.get_pool(db_path).connection() as conn:
+        with conn:
+            conn.executemany(
+                "INSERT INTO units (name, city_slug, vk_group_id, telegram_channel_id) VALUES (?, ?, ?, ?)",
+                [(f"Единица {i}", f"city{i % 50}", str(100000 + i), f"@unit{i}") for i in range(units)],
+            )
+            unit_ids = [row[0] for row in conn.execute("SELECT id FROM units")]
+            conn.executemany(
+                "INSERT INTO unit_sources (unit_id, category, url_path, signature, is_enabled) VALUES (?, ?, ?, ?, ?)",
+                [(unit_id, src['category'], src['url_path'], src['signature'], unit_id % 2)
+                 for unit_id in unit_ids for src in DEFAULT_SOURCES],
+            )
+
+
+def legacy_get_units(db_path: str) -> List[Dict]:
+    """Прежний get_units: соединение на запрос и N+1 запросов"""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute('SELECT * FROM units ORDER BY created_at DESC')
+    units = [dict(row) for row in c.fetchall()]
+    for unit in units:
+        c.execute('SELECT * FROM unit_sources WHERE unit_id = ?', (unit['id'],))
+        unit['sources'] = [dict(row) for row in c.fetchall()]
+    conn.close()
+    return units
+
+
+def measure(fn: Callable[[], object], requests: int) -> Dict[str, float]:
+    fn()  # прогрев
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        'p50_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(timings[max(0, int(len(timings) * 0.95) - 1)], 2),
+        'max_ms': round(timings[-1], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк API единиц")
+    parser.add_argument("--units", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=30)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="avito-units-bench-")
+    os.chdir(workdir)  # api_units пишет служебные таблицы в data/ относительно cwd
+
+    try:
+        db_path = os.path.join(workdir, "units.db")
+        legacy_path = os.path.join(workdir, "units_legacy.db")
+
+        import api_units
+        api_units.DB_PATH = db_path
+        seed(db_path, args.units)
+
+        # Копия без индекса - как было до пула и индексов
+        import units_db
+        with units_db.get_pool(db_path).connection() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        shutil.copy(db_path, legacy_path)
+        conn = sqlite3.connect(legacy_path)
+        conn.execute("DROP INDEX idx_unit_sources_unit_id")
+        conn.execute("DROP INDEX idx_units_created_at")
+        conn.close()
+
+        client = api_units.app.test_client()
+        count = len(client.get('/api/units').get_json())
+        print(f"Единиц: {count}, ссылок: {count * len(api_units.DEFAULT_SOURCES)}")
+
+        def pooled_fetch():
+            with units_db.get_pool(db_path).connection() as pooled:
+                return units_db.fetch_units(pooled)
+
+        results = {
+            'legacy (N+1, без индекса)': measure(lambda: legacy_get_units(legacy_path), args.requests),
+            'units_db.fetch_units': measure(pooled_fetch, args.requests),
+            'GET /api/units': measure(lambda: client.get('/api/units'), args.requests),
+        }
+
+        print(f"{'вариант':<28}{'p50, мс':>10}{'p95, мс':>10}{'max, мс':>10}")
+        for name, r in results.items():
+            print(f"{name:<28}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['max_ms']:>10}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
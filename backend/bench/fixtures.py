@@ -0,0 +1,124 @@
+"""
+Корпус страниц листинга: записанные страницы Авито + синтетические страницы той же вёрстки
+"""
+import os
+import random
+import re
+from typing import Dict, Optional, Tuple
+
+import requests
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Имя файла: <город>__<категория с / -> _>__p<страница>.html
+FIXTURE_RE = re.compile(r"^(?P<city>[\w-]+)__(?P<category>[\w-]+)__p(?P<page>\d+)\.html$")
+
+CAPTCHA_PAGE = """<!DOCTYPE html>
+<html><head><title>Доступ ограничен</title></head>
+<body>
+<div class="firewall-container">
+  <h2 class="firewall-title">Доступ ограничен: проблема с IP</h2>
+  <form class="form-captcha" method="post"><img src="/captcha.png"><input name="captcha"></form>
+</div>
+</body></html>
+"""
+
+ITEM_TEMPLATE = """
+<div data-marker="item" data-item-id="{avito_id}" id="i{avito_id}" class="iva-item-root iva-item-list">
+  <div class="iva-item-slider"><img data-marker="item-photo" itemprop="image" src="https://00.img.avito.st/image/1/{avito_id}.jpg" alt="{title}"></div>
+  <div class="iva-item-body">
+    <h3><a data-marker="item-title" itemprop="url" href="/{city}/{category}/{slug}_{avito_id}" title="{title}">{title}</a></h3>
+    <p class="price-root"><meta itemprop="price" content="{price}"><span data-marker="item-price" class="price-text">{price_text} ₽</span></p>
+    <div data-marker="item-description" class="iva-item-description">{description}</div>
+    <div class="geo-root"><span class="geo-address">{location}</span></div>
+    {seller}
+  </div>
+</div>
+"""
+
+RECORD_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+    "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
+}
+
+TITLES = [
+    "Lada Granta 2019", "Toyota Camry 2.5 AT", "Квартира 2-к, 54 м², 3/5 эт.",
+    "Велосипед горный", "Холодильник Indesit", "Ноутбук Lenovo IdeaPad",
+    "Шины зимние R16", "iPhone 12 128GB", "Диван угловой", "Гараж 24 м²",
+]
+WORDS = ("отличное состояние торг один хозяин без дтп срочно обмен возможен "
+         "полный комплект документы в порядке зимняя резина гаражное хранение").split()
+
+
+def fixture_name(city: str, category: str, page: int) -> str:
+    return f"{city}__{category.replace('/', '_')}__p{page}.html"
+
+
+def generate_listing(city: str, category: str, page: int, items: int = 50, seed: int = 0) -> str:
+    """Синтетическая страница листинга в вёрстке Авито (детерминированная)"""
+    rnd = random.Random(f"{seed}:{city}:{category}:{page}")
+    blocks = []
+
+    for i in range(items):
+        avito_id = 3_000_000_000 + page * 1000 + i
+        price = rnd.randrange(500, 3_000_000, 500)
+        title = rnd.choice(TITLES)
+        seller = '<div class="iva-item-shop">Автосалон</div>' if rnd.random() < 0.1 else ""
+        blocks.append(ITEM_TEMPLATE.format(
+            avito_id=avito_id,
+            city=city,
+            category=category,
+            slug=f"item_{i}",
+            title=title,
+            price=price,
+            price_text=f"{price:,}".replace(",", " "),
+            description=" ".join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 30))),
+            location=city.capitalize(),
+            seller=seller,
+        ))
+
+    return (
+        "<!DOCTYPE html><html><head><meta charset='utf-8'><title>Объявления</title>"
+        "<script>window.__config = {captchaEnabled: true};</script></head><body>"
+        f"<div data-marker='catalog-serp'>{''.join(blocks)}</div>"
+        "</body></html>"
+    )
+
+
+def load_corpus(fixtures_dir: str = FIXTURES_DIR) -> Dict[Tuple[str, str, int], str]:
+    """Записанные страницы: {(город, категория, страница): html}"""
+    corpus = {}
+    if not os.path.isdir(fixtures_dir):
+        return corpus
+
+    for name in sorted(os.listdir(fixtures_dir)):
+        match = FIXTURE_RE.match(name)
+        if not match:
+            continue
+        with open(os.path.join(fixtures_dir, name), "r", encoding="utf-8") as f:
+            corpus[(match["city"], match["category"], int(match["page"]))] = f.read()
+
+    return corpus
+
+
+def record(city: str, category: str, pages: int, fixtures_dir: str = FIXTURES_DIR,
+           proxy: Optional[str] = None) -> int:
+    """Записать живые страницы Авито в корпус. Returns: сколько записано"""
+    os.makedirs(fixtures_dir, exist_ok=True)
+    session = requests.Session()
+    session.headers.update(RECORD_HEADERS)
+    proxies = {"http": proxy, "https": proxy} if proxy else None
+
+    saved = 0
+    for page in range(1, pages + 1):
+        response = session.get(f"https://www.avito.ru/{city}/{category}?p={page}", proxies=proxies, timeout=30)
+        if response.status_code != 200 or 'data-marker="item"' not in response.text:
+            print(f"⚠️ Страница {page}: HTTP {response.status_code}, не листинг - пропускаем")
+            continue
+
+        with open(os.path.join(fixtures_dir, fixture_name(city, category, page)), "w", encoding="utf-8") as f:
+            f.write(response.text)
+        saved += 1
+
+    return saved
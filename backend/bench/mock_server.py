@@ -0,0 +1,159 @@
+"""
+Локальный мок Авито: отдаёт страницы корпуса и умеет вносить сбои
+(задержку, 429, капчу, обрыв соединения как у упавшего прокси)
+"""
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from bench.fixtures import CAPTCHA_PAGE, generate_listing
+
+EMPTY_PAGE = "<!DOCTYPE html><html><body><div data-marker='catalog-serp'></div></body></html>"
+
+
+class Faults:
+    """Настройки сбоев (доли запросов 0..1, задержка в мс)"""
+
+    def __init__(self, latency_ms: float = 0, rate_429: float = 0, rate_captcha: float = 0,
+                 rate_drop: float = 0, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.rate_429 = rate_429
+        self.rate_captcha = rate_captcha
+        self.rate_drop = rate_drop
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def roll(self) -> str:
+        """Что сделать с запросом: ok, 429, captcha, drop"""
+        with self.lock:
+            value = self.random.random()
+        for outcome, rate in (("drop", self.rate_drop), ("429", self.rate_429), ("captcha", self.rate_captcha)):
+            if value < rate:
+                return outcome
+            value -= rate
+        return "ok"
+
+
+class MockAvitoServer:
+    """HTTP-сервер на 127.0.0.1: /<город>/<категория>?p=N"""
+
+    def __init__(self, corpus: Dict[Tuple[str, str, int], str] = None, faults: Faults = None,
+                 pages: int = 3, items_per_page: int = 50, port: int = 0):
+        """
+        Args:
+            corpus: Записанные страницы {(город, категория, страница): html}
+            faults: Сбои
+            pages: Сколько страниц у синтетического листинга (если нет в корпусе)
+            items_per_page: Объявлений на синтетической странице
+        """
+        self.corpus = corpus or {}
+        self.faults = faults or Faults()
+        self.pages = pages
+        self.items_per_page = items_per_page
+        self.stats = {"ok": 0, "429": 0, "captcha": 0, "drop": 0, "empty": 0, "bytes": 0}
+        self._lock = threading.Lock()
+        self._generated = {}
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockAvitoServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-avito", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_stats(self):
+        with self._lock:
+            for key in self.stats:
+                self.stats[key] = 0
+
+    def _count(self, key: str, size: int = 0):
+        with self._lock:
+            self.stats[key] += 1
+            self.stats["bytes"] += size
+
+    def page(self, city: str, category: str, page: int) -> str:
+        """HTML страницы: из корпуса, иначе синтетическая, за пределами - пустая"""
+        key = (city, category, page)
+        if key in self.corpus:
+            return self.corpus[key]
+
+        if any(c == city and cat == category for c, cat, _ in self.corpus) or page > self.pages:
+            return EMPTY_PAGE
+
+        if key not in self._generated:
+            self._generated[key] = generate_listing(city, category, page, self.items_per_page)
+        return self._generated[key]
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                segments = [s for s in parts.path.split("/") if s]
+                if len(segments) < 2:
+                    self._send(404, "not found")
+                    return
+
+                if server.faults.latency_ms:
+                    time.sleep(server.faults.latency_ms / 1000)
+
+                outcome = server.faults.roll()
+                if outcome == "drop":
+                    # Как упавший прокси: соединение рвётся без ответа
+                    server._count("drop")
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    self.close_connection = True
+                    return
+                if outcome == "429":
+                    server._count("429")
+                    self._send(429, "Too Many Requests")
+                    return
+                if outcome == "captcha":
+                    server._count("captcha")
+                    self._send(200, CAPTCHA_PAGE)
+                    return
+
+                city = segments[0]
+                category = "_".join(segments[1:])
+                page = int(parse_qs(parts.query).get("p", ["1"])[0])
+
+                body = server.page(city, category, page)
+                server._count("empty" if body == EMPTY_PAGE else "ok", len(body.encode()))
+                self._send(200, body)
+
+            def _send(self, status: int, body: str):
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
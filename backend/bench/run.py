@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк парсеров на локальном мок-сервере
+
+Запуск (из backend/):
+    python -m bench.run                       # все парсеры, результат в bench/results/<commit>.json
+    python -m bench.run --latency 50 --rate-429 0.05 --rate-captcha 0.02 --rate-drop 0.02
+    python -m bench.run --compare bench/results/a1b2c3d.json bench/results/e4f5a6b.json
+    python -m bench.run --record vorkuta avtomobili --pages 3   # записать живые страницы в корпус
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "bench", "results")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from bench.fixtures import load_corpus, record
+from bench.mock_server import Faults, MockAvitoServer
+
+SOURCES = [("vorkuta", "avtomobili"), ("vorkuta", "kvartiry")]
+PARSERS = ("AvitoParser", "ImprovedAvitoParser", "AvitoLightweightParser")
+METRICS = ("pages_per_s", "ads_per_s", "cpu_s", "rss_mb")
+
+
+def current_rss_mb() -> float:
+    """Текущий RSS процесса (МБ)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Не Linux: пиковый RSS (на macOS в байтах, на Linux в КБ)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def make_runner(name: str, base_url: str, max_pages: int, http_cache: bool) -> Callable[[str, str], List[Dict]]:
+    """Функция (город, категория) -> объявления для класса парсера, без задержек между страницами"""
+    config = {
+        "parser": {
+            "page_delay": 0,
+            "page_delay_range": [0, 0],
+            "http_cache": http_cache,
+            "timeout": 10,
+        },
+        "proxies": [],
+    }
+
+    if name == "AvitoParser":
+        from parser import AvitoParser
+        parser = AvitoParser(config)
+        return lambda city, category: parser.parse_listing_page(f"{base_url}/{city}/{category}", max_pages)
+
+    if name == "ImprovedAvitoParser":
+        from parser_improved import ImprovedAvitoParser
+        parser = ImprovedAvitoParser(config)
+        return lambda city, category: parser.parse_listing_page(
+            f"{base_url}/{city}/{category}", max_pages, category, city
+        )
+
+    if name == "AvitoLightweightParser":
+        from http_cache import create_cache
+        from parser_lightweight import AvitoLightweightParser
+        parser = AvitoLightweightParser(base_url=base_url, page_delay=(0, 0), cache=create_cache(config))
+        return lambda city, category: parser.parse_listing(city, category, max_pages)
+
+    raise ValueError(f"Неизвестный парсер: {name}")
+
+
+def bench_parser(name: str, server: MockAvitoServer, rounds: int, max_pages: int, http_cache: bool) -> Dict:
+    """Прогнать один парсер по всем источникам rounds раз"""
+    run = make_runner(name, server.base_url, max_pages, http_cache)
+
+    # Прогрев (импорты, соединения) не считаем
+    run(*SOURCES[0])
+    server.reset_stats()
+
+    ads = 0
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+
+    for _ in range(rounds):
+        for city, category in SOURCES:
+            ads += len(run(city, category))
+
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    stats = dict(server.stats)
+    pages = sum(stats[k] for k in ("ok", "empty", "429", "captcha", "drop"))
+
+    return {
+        "pages": pages,
+        "ads": ads,
+        "wall_s": round(wall, 3),
+        "cpu_s": round(cpu, 3),
+        "pages_per_s": round(pages / wall, 2) if wall else None,
+        "ads_per_s": round(ads / wall, 1) if wall else None,
+        "rss_mb": round(current_rss_mb(), 1),
+        "server": stats,
+    }
+
+
+def run_benchmarks(args) -> Dict:
+    faults = Faults(
+        latency_ms=args.latency,
+        rate_429=args.rate_429,
+        rate_captcha=args.rate_captcha,
+        rate_drop=args.rate_drop,
+        seed=args.seed,
+    )
+    report = {
+        "commit": git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("compare", "record", "output")},
+        "parsers": {},
+    }
+
+    # Парсеры пишут сессии/кеш в data/ относительно cwd - уводим во временную папку
+    workdir = tempfile.mkdtemp(prefix="avito-bench-")
+    os.chdir(workdir)
+
+    with MockAvitoServer(load_corpus(), faults, pages=args.pages, items_per_page=args.items) as server:
+        for name in args.parsers:
+            print(f"⏱️ {name}...")
+            result = bench_parser(name, server, args.rounds, args.pages, args.http_cache)
+            report["parsers"][name] = result
+            print(f"   {result['pages_per_s']} стр/с, {result['ads_per_s']} объявл/с, "
+                  f"CPU {result['cpu_s']} с, RSS {result['rss_mb']} МБ")
+
+    return report
+
+
+def compare(base_path: str, new_path: str):
+    """Сравнить два результата (например, двух коммитов)"""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    print(f"{base['commit']} → {new['commit']}")
+    print(f"{'парсер':<24}{'метрика':<14}{'было':>10}{'стало':>10}{'Δ %':>9}")
+
+    for name in sorted(set(base["parsers"]) | set(new["parsers"])):
+        before = base["parsers"].get(name, {})
+        after = new["parsers"].get(name, {})
+        for metric in METRICS:
+            a, b = before.get(metric), after.get(metric)
+            delta = f"{(b - a) / a * 100:+.1f}" if a and b is not None else "-"
+            print(f"{name:<24}{metric:<14}{a if a is not None else '-':>10}{b if b is not None else '-':>10}{delta:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк парсеров Авито")
+    parser.add_argument("--parsers", nargs="+", default=list(PARSERS), choices=PARSERS)
+    parser.add_argument("--rounds", type=int, default=5, help="Проходов по всем источникам")
+    parser.add_argument("--pages", type=int, default=3, help="Страниц на источник")
+    parser.add_argument("--items", type=int, default=50, help="Объявлений на синтетической странице")
+    parser.add_argument("--latency", type=float, default=0, help="Задержка ответа, мс")
+    parser.add_argument("--rate-429", type=float, default=0)
+    parser.add_argument("--rate-captcha", type=float, default=0)
+    parser.add_argument("--rate-drop", type=float, default=0, help="Доля оборванных соединений (сбой прокси)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--http-cache", action="store_true", help="Включить HTTP кеш листингов")
+    parser.add_argument("--output", help="Куда сохранить JSON (по умолчанию bench/results/<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"))
+    parser.add_argument("--record", nargs=2, metavar=("CITY", "CATEGORY"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    if args.record:
+        saved = record(*args.record, pages=args.pages)
+        print(f"✅ Записано страниц: {saved}")
+        return
+
+    output = os.path.abspath(args.output) if args.output else None
+    report = run_benchmarks(args)
+
+    output = output or os.path.join(RESULTS_DIR, f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ Результат: {output}")
+
+
+if __name__ == "__main__":
+    main()
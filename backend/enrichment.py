@@ -0,0 +1,263 @@
+"""
+Обогащение объявлений карточками - полное описание и все фото со страницы объявления
+
+Листинг даёт обрывок описания и одну миниатюру. Карточки грузятся только для
+объявлений, которые прошли дешёвые фильтры и ещё не сохранены (и не в архиве), с
+ограниченной параллельностью и своим бюджетом запросов на проход. Результат
+кешируется на диске по avito_id с TTL: повторные проходы и соседние единицы не
+запрашивают ту же карточку снова.
+
+Настройки (config.yaml):
+    enrichment:
+      enabled: false
+      workers: 4               # Параллельных загрузок карточек
+      budget: 60               # Карточек за проход (остальные - в следующем)
+      ttl_hours: 72            # Сколько верить закешированной карточке
+      proxies: []              # Свои прокси (по умолчанию - общие proxies)
+      timeout: 15
+      delay: 1.0               # Пауза между запросами одного потока (сек)
+      cache_dir: data/detail_cache
+"""
+import hashlib
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import requests
+from bs4 import BeautifulSoup
+from loguru import logger
+from models import Announcement
+from tenancy import tenant_id, tenant_db
+from retention import archived_ids
+from fetch_orchestrator import ThreadSessions, detect_challenge
+from metrics import ENRICH_TOTAL, FETCH_SECONDS, FETCH_ERRORS, proxy_label
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'ru-RU,ru;q=0.9',
+}
+
+MAX_IMAGES = 10
+
+
+class DetailCache:
+    """Дисковый кеш карточек: avito_id -> {'fetched_at', 'data'} (None в data - объявление снято)"""
+
+    def __init__(self, cache_dir: str = "data/detail_cache", ttl_hours: float = 72):
+        self.cache_dir = cache_dir
+        self.ttl = ttl_hours * 3600
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, avito_id: str) -> str:
+        key = hashlib.sha1(str(avito_id).encode()).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], f"{avito_id}.json")
+
+    def get(self, avito_id: str) -> Optional[Dict]:
+        """Свежая запись (или None - нет / истёк TTL)"""
+        try:
+            with open(self._path(avito_id), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get('fetched_at', 0) > self.ttl:
+            return None
+        return entry
+
+    def put(self, avito_id: str, data: Optional[Dict]):
+        path = self._path(avito_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Пишем через временный файл, чтобы не оставить битую запись
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'fetched_at': time.time(), 'data': data}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Не удалось записать карточку {avito_id} в кеш: {e}")
+
+
+def parse_detail(html: str) -> Dict:
+    """Страница объявления -> description, image_urls, location (что нашлось)"""
+    soup = BeautifulSoup(html, 'html.parser')
+    result = {}
+
+    desc_elem = (soup.find(attrs={'data-marker': 'item-view/item-description'})
+                 or soup.find(attrs={'itemprop': 'description'}))
+    if desc_elem:
+        result['description'] = desc_elem.get_text('\n', strip=True)
+
+    images = []
+    for elem in soup.find_all(attrs={'data-marker': re.compile(r'^image-(frame|preview)')}):
+        url = elem.get('data-url') or (elem.find('img') or {}).get('src')
+        if url and url not in images:
+            images.append(url)
+    if not images:
+        images = [meta['content'] for meta in soup.find_all('meta', {'property': 'og:image'}) if meta.get('content')]
+    if images:
+        result['image_urls'] = images[:MAX_IMAGES]
+
+    address_elem = (soup.find(attrs={'data-marker': 'item-view/item-address'})
+                    or soup.find(attrs={'itemprop': 'address'}))
+    if address_elem:
+        result['location'] = address_elem.get_text(' ', strip=True)
+
+    return result
+
+
+class DetailEnricher:
+    """Догрузка карточек для новых объявлений (пул потоков, бюджет, кеш)"""
+
+    def __init__(self, config: Dict, database=None):
+        settings = config.get('enrichment') or {}
+        self.user_id = tenant_id(config)
+        self.db = database or tenant_db(config)
+        self.workers = max(int(settings.get('workers', 4)), 1)
+        self.budget = int(settings.get('budget', 60))
+        self.timeout = settings.get('timeout', 15)
+        self.delay = float(settings.get('delay', 1.0))
+        self.cache = DetailCache(settings.get('cache_dir', 'data/detail_cache'), settings.get('ttl_hours', 72))
+
+        proxies = settings.get('proxies') or config.get('proxies') or []
+        self._proxies = itertools.cycle(proxies) if proxies else None
+        self._proxy_lock = threading.Lock()
+        self._http = ThreadSessions(HEADERS)
+
+    def enrich(self, announcements: List[Dict], job=None) -> List[Dict]:
+        """
+        Дополнить новые объявления данными карточек (на месте)
+
+        Карточка сверх бюджета или с ошибкой - объявление остаётся как есть.
+        Returns:
+            те же объявления, без снятых с публикации
+        """
+        fresh = self._new(announcements)
+        if not fresh:
+            return announcements
+
+        pending = []
+        details: Dict[str, Optional[Dict]] = {}
+        for ann in fresh:
+            entry = self.cache.get(ann['avito_id'])
+            if entry is not None:
+                details[ann['avito_id']] = entry['data']
+                ENRICH_TOTAL.labels(result='cached').inc()
+            elif ann.get('url'):
+                pending.append(ann)
+
+        skipped = pending[self.budget:]
+        pending = pending[:self.budget]
+        if skipped:
+            ENRICH_TOTAL.labels(result='skipped').inc(len(skipped))
+            logger.info(f"🃏 Карточки: бюджет {self.budget}, {len(skipped)} отложено до следующего прохода")
+
+        if pending and not (job and job.cancelled):
+            if job:
+                job.progress(current_source=f"карточки ({len(pending)})")
+            blocked = threading.Event()
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(pending)),
+                                    thread_name_prefix="enrich") as executor:
+                for ann, outcome in zip(pending, executor.map(lambda a: self._fetch(a, blocked, job), pending)):
+                    if outcome is not False:
+                        details[ann['avito_id']] = outcome
+
+        gone = set()
+        for ann in fresh:
+            if ann['avito_id'] not in details:
+                continue
+            data = details[ann['avito_id']]
+            if data is None:
+                gone.add(ann['avito_id'])
+            else:
+                _merge(ann, data)
+
+        logger.info(f"🃏 Карточки: новых {len(fresh)}, дополнено {len(details) - len(gone)}, снято {len(gone)}")
+        return [ann for ann in announcements if ann['avito_id'] not in gone]
+
+    def _new(self, announcements: List[Dict]) -> List[Dict]:
+        """Объявления, которых ещё нет в БД и в архиве"""
+        avito_ids = [ann['avito_id'] for ann in announcements]
+        if not avito_ids:
+            return []
+        session = self.db.get_session()
+        try:
+            known = {row[0] for row in session.query(Announcement.avito_id).filter(
+                Announcement.user_id == self.user_id, Announcement.avito_id.in_(avito_ids))}
+            known |= archived_ids(session, self.user_id, [i for i in avito_ids if i not in known])
+        finally:
+            session.close()
+        return [ann for ann in announcements if ann['avito_id'] not in known]
+
+    def _fetch(self, ann: Dict, blocked: threading.Event, job=None):
+        """
+        Карточка в кеш и результат
+
+        Returns:
+            dict - данные, None - объявление снято (404/410), False - не получилось
+        """
+        if blocked.is_set() or (job and job.cancelled):
+            ENRICH_TOTAL.labels(result='skipped').inc()
+            return False
+
+        proxy = self._next_proxy()
+        try:
+            with FETCH_SECONDS.labels(proxy=proxy_label(proxy)).time():
+                response = self._http.session().get(
+                    ann['url'], timeout=self.timeout,
+                    proxies={'http': proxy, 'https': proxy} if proxy else None)
+        except requests.RequestException as e:
+            FETCH_ERRORS.labels(proxy=proxy_label(proxy)).inc()
+            ENRICH_TOTAL.labels(result='failed').inc()
+            logger.debug(f"Карточка {ann['avito_id']}: {e}")
+            return False
+        finally:
+            if self.delay:
+                time.sleep(self.delay)
+
+        if response.status_code in (404, 410):
+            self.cache.put(ann['avito_id'], None)
+            ENRICH_TOTAL.labels(result='gone').inc()
+            return None
+
+        challenge = detect_challenge(response.status_code, response.url or ann['url'], response.text)
+        if challenge or response.status_code != 200:
+            if challenge and not blocked.is_set():
+                # Остальные карточки этого прохода не жжём о ту же проверку
+                blocked.set()
+                logger.warning(f"🃏 Карточки: проверка ({challenge}) через {proxy_label(proxy)}, остаток прохода отложен")
+            FETCH_ERRORS.labels(proxy=proxy_label(proxy)).inc()
+            ENRICH_TOTAL.labels(result='failed').inc()
+            return False
+
+        data = parse_detail(response.text)
+        self.cache.put(ann['avito_id'], data)
+        ENRICH_TOTAL.labels(result='fetched').inc()
+        return data
+
+    def _next_proxy(self) -> Optional[str]:
+        if not self._proxies:
+            return None
+        with self._proxy_lock:
+            return next(self._proxies)
+
+
+def _merge(ann: Dict, data: Dict):
+    """Данные карточки поверх листинга: описание - если длиннее, фото - из карточки (миниатюра листинга - то же первое фото), адрес - если не было"""
+    if len(data.get('description') or '') > len(ann.get('description') or ''):
+        ann['description'] = data['description']
+    if data.get('image_urls'):
+        ann['image_urls'] = data['image_urls']
+    if data.get('location') and not ann.get('location'):
+        ann['location'] = data['location']
+
+
+def create_enricher(config: Dict, database=None) -> Optional[DetailEnricher]:
+    """Обогащение по настройкам enrichment (или None если отключено)"""
+    if not (config.get('enrichment') or {}).get('enabled'):
+        return None
+    return DetailEnricher(config, database)
@@ -0,0 +1,166 @@
+"""
+Выгрузка объявлений потоком - CSV или JSONL, при желании в gzip
+
+Строки читаются страницами по id (keyset: WHERE id > последний ORDER BY id LIMIT n)
+и сразу отдаются клиенту, поэтому память не зависит от размера выгрузки, а каждая
+страница - короткий запрос, который не держит БД открытой транзакцией.
+
+API:
+    GET /api/announcements/export?format=csv|jsonl&gzip=1
+        &city=vorkuta&category=auto&status=published&from=2026-01-01&to=2026-02-01
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from typing import Dict, Iterator, List, Optional
+from sqlalchemy import select
+from models import Announcement
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+COLUMNS = [
+    'id', 'avito_id', 'title', 'description', 'price', 'last_price', 'price_percentile', 'category', 'city',
+    'location', 'url', 'image_urls', 'author_type', 'status', 'published_to_vk', 'vk_post_id', 'created_at',
+]
+
+PAGE_SIZE = 1000
+
+
+def iter_rows(database, user_id: int, filters: Dict, page_size: int = PAGE_SIZE) -> Iterator[Dict]:
+    """Объявления пользователя по фильтрам (city, category, status, from, to) страницами по id"""
+    table = Announcement.__table__
+    # user_id + 0: индексы (user_id, ...) отсортированы не по id, и SQLite сортировал бы
+    # все совпадения на каждой странице; так идём по первичному ключу от last_id
+    query = select(*[table.c[name] for name in COLUMNS]).where(table.c.user_id + 0 == user_id)
+    for name in ('city', 'category', 'status'):
+        if filters.get(name):
+            query = query.where(table.c[name] == filters[name])
+    if filters.get('from'):
+        query = query.where(table.c.created_at >= filters['from'])
+    if filters.get('to'):
+        query = query.where(table.c.created_at < filters['to'])
+
+    last_id = 0
+    while True:
+        with database.engine.connect() as conn:
+            page = conn.execute(
+                query.where(table.c.id > last_id).order_by(table.c.id).limit(page_size)
+            ).mappings().all()
+        if not page:
+            return
+        for row in page:
+            yield row
+        last_id = page[-1]['id']
+        if len(page) < page_size:
+            return
+
+
+def iter_csv(rows: Iterator[Dict]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    count = 0
+    for row in rows:
+        writer.writerow([_csv_value(row[name]) for name in COLUMNS])
+        count += 1
+        if count % PAGE_SIZE == 0:
+            yield _drain(buffer)
+    yield _drain(buffer)
+
+
+def iter_jsonl(rows: Iterator[Dict]) -> Iterator[str]:
+    chunk: List[str] = []
+    for row in rows:
+        chunk.append(json.dumps(dict(row), ensure_ascii=False, default=json_default))
+        if len(chunk) == PAGE_SIZE:
+            yield '\n'.join(chunk) + '\n'
+            chunk = []
+    if chunk:
+        yield '\n'.join(chunk) + '\n'
+
+
+def iter_gzip(chunks: Iterator[str]) -> Iterator[bytes]:
+    """Сжатие потоком: на выходе обычный .gz файл"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 - заголовок gzip
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def parse_date(value: Optional[str]) -> Optional[datetime]:
+    """2026-01-31 или 2026-01-31T12:00:00 (ValueError на мусоре)"""
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
+
+
+def _drain(buffer: io.StringIO) -> str:
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+
+def _csv_value(value):
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def json_default(value):
+    """json.dumps(default=...): даты - ISO 8601 (и в архивах retention)"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} не сериализуется в JSON")
+
+
+# ===== FLASK =====
+
+def install(app, load_config, prefix: str = "/api/announcements/export"):
+    """GET {prefix}?format=csv|jsonl&gzip=1&city=&category=&status=&from=&to= - выгрузка потоком"""
+    from flask import Response, jsonify, request
+    from tenancy import tenant_id, tenant_db
+
+    @app.route(prefix, methods=['GET'])
+    def export_announcements():
+        fmt = request.args.get('format', 'csv')
+        if fmt not in FORMATS:
+            return jsonify({'error': f"format: {', '.join(FORMATS)}"}), 400
+
+        try:
+            filters = {
+                'city': request.args.get('city'),
+                'category': request.args.get('category'),
+                'status': request.args.get('status'),
+                'from': parse_date(request.args.get('from')),
+                'to': parse_date(request.args.get('to')),
+            }
+        except ValueError:
+            return jsonify({'error': 'from/to в формате YYYY-MM-DD'}), 400
+
+        config = load_config()
+        rows = iter_rows(tenant_db(config), tenant_id(config), filters)
+        body = iter_csv(rows) if fmt == 'csv' else iter_jsonl(rows)
+
+        filename = f"announcements-{datetime.now():%Y%m%d-%H%M}.{fmt}"
+        mimetype = f"{FORMATS[fmt]}; charset=utf-8"
+        if request.args.get('gzip') in ('1', 'true'):
+            body = iter_gzip(body)
+            filename += '.gz'
+            mimetype = 'application/gzip'
+
+        return Response(body, content_type=mimetype, headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'X-Accel-Buffering': 'no',  # nginx: не копить ответ целиком
+        })
+
+    return export_announcements
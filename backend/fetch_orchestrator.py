@@ -0,0 +1,272 @@
+"""
+Оркестратор загрузки страниц: дешёвый HTTP, при капче - эскалация в браузер и возврат обратно
+"""
+import threading
+from typing import Callable, Dict, Optional
+
+import requests
+from loguru import logger
+
+from http_cache import ResponseCache
+from metrics import FETCH_SECONDS, FETCH_ERRORS, proxy_label
+from session_store import SessionStore, identity_for
+
+# Признаки страницы-проверки (ищем только если на странице нет объявлений)
+CHALLENGE_URL_MARKERS = ("captcha", "/blocked", "firewall")
+CHALLENGE_HTML_MARKERS = (
+    "firewall-container",
+    "firewall-title",
+    'data-marker="captcha"',
+    'name="captcha"',
+    "g-recaptcha",
+    "h-captcha",
+    "smartcaptcha",
+    "доступ ограничен: проблема с ip",
+)
+LISTING_MARKER = 'data-marker="item"'
+
+PATHS = ("http", "browser")
+
+
+def detect_challenge(status_code: int, url: str, html: str) -> Optional[str]:
+    """
+    Определить страницу-проверку (капчу / блокировку)
+
+    Returns:
+        Причина ('http_429', 'redirect', 'challenge_page') или None для нормальной страницы
+    """
+    if status_code in (403, 429):
+        return f"http_{status_code}"
+
+    if any(marker in url.lower() for marker in CHALLENGE_URL_MARKERS):
+        return "redirect"
+
+    # Обычный листинг может содержать слова "captcha"/"проверка" в скриптах и тексте
+    if LISTING_MARKER in html:
+        return None
+
+    html_lower = html.lower()
+    if any(marker in html_lower for marker in CHALLENGE_HTML_MARKERS):
+        return "challenge_page"
+
+    return None
+
+
+class ThreadSessions:
+    """Своя requests.Session на поток пула загрузок (Session не потокобезопасна)"""
+
+    def __init__(self, headers: Dict = None):
+        self.headers = headers
+        self._local = threading.local()
+
+    def session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            if self.headers:
+                session.headers.update(self.headers)
+        return session
+
+
+class FetchResult:
+    """Результат загрузки страницы"""
+
+    def __init__(self, url: str, path: str, status: int = 0, html: str = "",
+                 response=None, unchanged: bool = False, challenge: Optional[str] = None,
+                 error: Optional[str] = None, region: str = "default"):
+        self.url = url
+        self.path = path  # http или browser
+        self.status = status
+        self.html = html
+        self.response = response
+        self.unchanged = unchanged
+        self.challenge = challenge
+        self.error = error
+        self.region = region  # регион прокси для ключа HTTP кеша
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200 and not self.challenge and not self.error
+
+    @property
+    def blocked(self) -> bool:
+        return bool(self.challenge)
+
+
+class FetchOrchestrator:
+    """
+    Сначала HTTP (requests, сессия по прокси). Если источник/прокси упёрся в капчу -
+    только эта пара уходит в браузерный пул, после решения капчи cookies передаются
+    в HTTP-сессию и пара возвращается на HTTP
+    """
+
+    def __init__(self, session_store: SessionStore = None, browser_pool=None,
+                 captcha_solver: Callable = None, cache: ResponseCache = None,
+                 proxy_regions: Dict[str, str] = None, headers: Dict[str, str] = None,
+                 timeout: int = 15):
+        """
+        Args:
+            session_store: Хранилище сессий (общее с браузером)
+            browser_pool: BrowserPool для эскалации (None - без браузера)
+            captcha_solver: async (page, slot) -> bool, решение капчи в браузере
+            cache: HTTP кеш листингов
+            proxy_regions: {proxy_url: регион} для ключа кеша
+            headers: Заголовки HTTP-сессий
+        """
+        self.session_store = session_store or SessionStore()
+        self.browser_pool = browser_pool
+        self.captcha_solver = captcha_solver
+        self.cache = cache
+        self.proxy_regions = proxy_regions or {}
+        self.headers = headers or {}
+        self.timeout = timeout
+
+        self.sessions: Dict[str, requests.Session] = {}
+        self.escalated = set()  # {(source_key, identity)}
+        self._lock = threading.Lock()
+        self.stats = {path: {'ok': 0, 'blocked': 0, 'error': 0} for path in PATHS}
+
+    def fetch(self, url: str, source_key: str, proxy: Optional[str] = None) -> FetchResult:
+        """Загрузить страницу источника через подходящий путь"""
+        identity = identity_for(proxy)
+        key = (source_key, identity)
+
+        if key not in self.escalated:
+            result = self._fetch_http(url, proxy, identity)
+            if not result.blocked:
+                return result
+
+            self.session_store.mark_captcha(identity)
+            if not self.browser_pool:
+                logger.warning(f"Проверка ({result.challenge}) на {source_key} через {identity}, браузер не настроен")
+                return result
+
+            logger.warning(f"Проверка ({result.challenge}) на {source_key} через {identity}, переключаемся на браузер")
+            with self._lock:
+                self.escalated.add(key)
+
+        result = self.browser_pool.run(self._fetch_browser(url, proxy, identity))
+        self._record(result)
+
+        if result.ok:
+            # Сессия прогрета - возвращаемся на HTTP с новыми cookies
+            self._reset_http_session(identity)
+            with self._lock:
+                self.escalated.discard(key)
+            logger.info(f"{source_key} через {identity}: проверка пройдена, возвращаемся на HTTP")
+
+        return result
+
+    def commit(self, result: FetchResult):
+        """Запомнить страницу в HTTP кеше (вызывать после успешного парсинга)"""
+        if self.cache and result.path == "http" and result.response is not None:
+            self.cache.store(result.url, result.response, result.region)
+
+    # ===== HTTP =====
+
+    def _get_session(self, identity: str) -> requests.Session:
+        with self._lock:
+            if identity not in self.sessions:
+                session = requests.Session()
+                session.headers.update(self.headers)
+                self.session_store.load_into_requests(session, identity)
+                self.sessions[identity] = session
+            return self.sessions[identity]
+
+    def _reset_http_session(self, identity: str):
+        """Пересоздать HTTP-сессию из хранилища (после браузера)"""
+        with self._lock:
+            self.sessions.pop(identity, None)
+
+    def save_sessions(self):
+        """Сохранить cookies HTTP-сессий"""
+        with self._lock:
+            sessions = list(self.sessions.items())
+        for identity, session in sessions:
+            self.session_store.save_from_requests(session, identity)
+
+    def _fetch_http(self, url: str, proxy: Optional[str], identity: str) -> FetchResult:
+        session = self._get_session(identity)
+        request_kwargs = {
+            "proxies": {"http": proxy, "https": proxy} if proxy else None,
+            "timeout": self.timeout,
+        }
+        region = self.proxy_regions.get(proxy, "default") if proxy else "default"
+
+        try:
+            with FETCH_SECONDS.labels(proxy=proxy_label(proxy)).time():
+                if self.cache:
+                    response, unchanged = self.cache.fetch(session, url, region, **request_kwargs)
+                else:
+                    response, unchanged = session.get(url, **request_kwargs), False
+        except requests.RequestException as e:
+            FETCH_ERRORS.labels(proxy=proxy_label(proxy)).inc()
+            result = FetchResult(url, "http", error=str(e))
+            self._record(result)
+            return result
+
+        if unchanged:
+            result = FetchResult(url, "http", status=200, response=response, unchanged=True, region=region)
+        else:
+            result = FetchResult(
+                url, "http",
+                status=response.status_code,
+                html=response.text,
+                response=response,
+                challenge=detect_challenge(response.status_code, response.url or url, response.text),
+                region=region,
+            )
+
+        self._record(result)
+        return result
+
+    # ===== БРАУЗЕР =====
+
+    async def _fetch_browser(self, url: str, proxy: Optional[str], identity: str) -> FetchResult:
+        async with self.browser_pool.lease(proxy) as slot:
+            page = await slot.context.new_page()
+            try:
+                response = await page.goto(url, wait_until="domcontentloaded", timeout=30000)
+                status = response.status if response else 0
+                html = await page.content()
+                challenge = detect_challenge(status, page.url, html)
+
+                if challenge and self.captcha_solver:
+                    if await self.captcha_solver(page, slot):
+                        response = await page.goto(url, wait_until="domcontentloaded", timeout=30000)
+                        status = response.status if response else 0
+                        html = await page.content()
+                        challenge = detect_challenge(status, page.url, html)
+
+                if not challenge:
+                    await self.browser_pool.save_cookies(slot)
+
+                return FetchResult(url, "browser", status=status, html=html, challenge=challenge)
+
+            except Exception as e:
+                return FetchResult(url, "browser", error=str(e))
+            finally:
+                await page.close()
+
+    # ===== СТАТИСТИКА =====
+
+    def _record(self, result: FetchResult):
+        if result.blocked:
+            outcome = 'blocked'
+        elif result.error or result.status != 200:
+            outcome = 'error'
+        else:
+            outcome = 'ok'
+
+        with self._lock:
+            self.stats[result.path][outcome] += 1
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """Успешность по путям: {'http': {'ok', 'blocked', 'error', 'success_rate'}, 'browser': {...}}"""
+        with self._lock:
+            report = {}
+            for path, counts in self.stats.items():
+                total = sum(counts.values())
+                report[path] = dict(counts, success_rate=round(counts['ok'] / total, 3) if total else None)
+            report['escalated'] = len(self.escalated)
+            return report
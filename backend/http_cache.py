@@ -0,0 +1,120 @@
+"""
+HTTP кеш листингов - условные запросы (ETag / Last-Modified) и пропуск неизменённых страниц
+"""
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Optional, Tuple
+from loguru import logger
+from metrics import HTTP_CACHE_TOTAL, HTTP_CACHE_BYTES_SAVED
+
+
+class ResponseCache:
+    """Дисковый кеш ответов: ключ = URL + регион прокси, хранит ETag, Last-Modified и хеш тела"""
+
+    def __init__(self, cache_dir: str = "data/http_cache"):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'bytes_saved': 0}
+
+    def _path(self, url: str, region: Optional[str]) -> str:
+        """Путь к файлу записи кеша"""
+        key = hashlib.sha256(f"{region or 'default'}|{url}".encode()).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def lookup(self, url: str, region: Optional[str] = None) -> Optional[Dict]:
+        """Получить запись кеша (или None)"""
+        try:
+            with open(self._path(url, region), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def conditional_headers(self, entry: Optional[Dict]) -> Dict[str, str]:
+        """Заголовки If-None-Match / If-Modified-Since для записи"""
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def fetch(self, session, url: str, region: Optional[str] = None, **kwargs) -> Tuple[object, bool]:
+        """
+        Условный GET через requests.Session
+
+        Returns:
+            (response, unchanged) - unchanged=True если страница не изменилась
+            и её можно не парсить (304 или тот же хеш тела)
+        """
+        entry = self.lookup(url, region)
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        headers.update(self.conditional_headers(entry))
+
+        response = session.get(url, headers=headers, **kwargs)
+
+        unchanged = False
+        if entry and response.status_code == 304:
+            unchanged = True
+            with self._lock:
+                self.stats['not_modified'] += 1
+                self.stats['bytes_saved'] += entry.get('size', 0)
+            HTTP_CACHE_BYTES_SAVED.inc(entry.get('size', 0))
+        elif entry and response.status_code == 200:
+            unchanged = self._body_hash(response.content) == entry.get('body_hash')
+
+        with self._lock:
+            self.stats['hits' if unchanged else 'misses'] += 1
+        HTTP_CACHE_TOTAL.labels(result='hit' if unchanged else 'miss').inc()
+
+        if unchanged:
+            logger.debug(f"Кеш: страница не изменилась - {url}")
+
+        return response, unchanged
+
+    def store(self, url: str, response, region: Optional[str] = None):
+        """Сохранить метаданные ответа (вызывать после успешного парсинга)"""
+        if response.status_code != 200:
+            return
+
+        entry = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'body_hash': self._body_hash(response.content),
+            'size': len(response.content),
+        }
+
+        path = self._path(url, region)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Пишем через временный файл, чтобы не оставить битую запись
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Не удалось записать кеш для {url}: {e}")
+
+    def get_stats(self) -> Dict[str, int]:
+        """Счётчики попаданий/промахов и сэкономленных байт"""
+        with self._lock:
+            return dict(self.stats)
+
+    @staticmethod
+    def _body_hash(content: bytes) -> str:
+        return hashlib.sha1(content).hexdigest()
+
+
+def create_cache(config: dict) -> Optional[ResponseCache]:
+    """Создать кеш по настройкам parser.http_cache (или None если отключён)"""
+    parser_config = config.get('parser', {})
+    if not parser_config.get('http_cache', True):
+        return None
+    return ResponseCache(parser_config.get('http_cache_dir', 'data/http_cache'))
@@ -0,0 +1,326 @@
+"""
+Перцептивные хеши фото - повторно выложенные объявления и перекупы со стоковыми фото
+
+Для новых объявлений скачивается миниатюра первой картинки (она уже маленькая, JPEG
+декодируется сразу в уменьшенном масштабе) и считается dHash - 64 бита, которые почти
+не меняются от пережатия, ресайза и мелких правок. Похожие фото - хеши на расстоянии
+Хэмминга не больше radius.
+
+Поиск - multi-index hashing в памяти: хеш режется на 4 куска по 16 бит, у похожих
+хешей хотя бы один кусок отличается не больше чем на radius // 4 бит, поэтому
+проверяются только корзины этих кусков (десятки кандидатов при миллионе фото).
+
+- одно похожее фото у другого объявления - повтор, статус duplicate
+- похожее фото у dealer_min и больше объявлений - продавец-перекуп: все они
+  author_type=business, ещё не опубликованные - filtered
+
+Нужен Pillow (pip install Pillow), без него этап выключен.
+
+Настройки (config.yaml):
+    image_hash:
+      enabled: false
+      radius: 6                # Бит различия, до которых фото считаются одинаковыми
+      dealer_min: 3            # Объявлений с одним фото - перекуп
+      workers: 4
+      budget: 200              # Миниатюр за проход
+      timeout: 10
+"""
+import io
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import combinations
+from typing import Dict, Iterable, List, Optional, Tuple
+import requests
+from loguru import logger
+from models import Announcement, ImageHash
+from tenancy import tenant_id, tenant_db
+from fetch_orchestrator import ThreadSessions
+from metrics import IMAGE_HASH_TOTAL
+
+try:
+    from PIL import Image
+except ImportError:  # Опционально - без Pillow хеши не считаются
+    Image = None
+
+HASH_SIZE = 8  # 8x8 сравнений = 64 бита
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+_UINT64 = 1 << 64
+
+# get_index перечитывает строки не старше прочитанных на это время: created_at - время
+# начала транзакции (PostgreSQL), закоммиченная позже строка может оказаться раньше
+OVERLAP = timedelta(minutes=5)
+
+
+def dhash(image) -> int:
+    """dHash: яркость соседних пикселей по строкам уменьшенного 9x8 серого изображения"""
+    image.draft('L', (HASH_SIZE * 4, HASH_SIZE * 4))  # JPEG: декодировать сразу уменьшенным
+    pixels = list(image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR).getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def to_signed(value: int) -> int:
+    """64 бита -> BigInteger со знаком (для БД)"""
+    return value - _UINT64 if value >= _UINT64 >> 1 else value
+
+
+def to_unsigned(value: int) -> int:
+    return value % _UINT64
+
+
+def distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class HashIndex:
+    """Multi-index hashing: 4 таблицы {кусок 16 бит: [(ключ, хеш)]}"""
+
+    def __init__(self):
+        self.tables: List[Dict[int, List[Tuple[int, int]]]] = [defaultdict(list) for _ in range(CHUNKS)]
+        self.size = 0
+        self.read_until: Optional[datetime] = None  # Наибольший created_at, прочитанный из БД
+        self._keys: Dict[int, int] = {}
+        self._masks: Dict[int, List[int]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, key: int, value: int):
+        with self._lock:
+            if key in self._keys:
+                return  # Своя строка, дочитанная из БД после записи
+            self._keys[key] = value
+            for i, table in enumerate(self.tables):
+                table[(value >> (i * CHUNK_BITS)) & CHUNK_MASK].append((key, value))
+            self.size += 1
+
+    def remove(self, keys: Iterable[int]) -> int:
+        """Убрать ключи (объявления удалены из БД)"""
+        removed = 0
+        with self._lock:
+            for key in keys:
+                value = self._keys.pop(key, None)
+                if value is None:
+                    continue
+                for i, table in enumerate(self.tables):
+                    chunk = (value >> (i * CHUNK_BITS)) & CHUNK_MASK
+                    table[chunk] = [item for item in table[chunk] if item[0] != key]
+                    if not table[chunk]:
+                        del table[chunk]
+                removed += 1
+            self.size -= removed
+        return removed
+
+    def search(self, value: int, radius: int) -> List[Tuple[int, int]]:
+        """[(ключ, расстояние)] всех хешей не дальше radius, ближайшие первыми"""
+        found = {}
+        masks = self._flip_masks(radius // CHUNKS)
+        with self._lock:
+            for i, table in enumerate(self.tables):
+                chunk = (value >> (i * CHUNK_BITS)) & CHUNK_MASK
+                for mask in masks:
+                    bucket = table.get(chunk ^ mask)
+                    if bucket:
+                        for key, other in bucket:
+                            dist = (value ^ other).bit_count()
+                            if dist <= radius:
+                                found[key] = dist
+        return sorted(found.items(), key=lambda item: item[1])
+
+    def _flip_masks(self, bits: int) -> List[int]:
+        """Все маски куска, меняющие не больше bits бит"""
+        if bits not in self._masks:
+            masks = [0]
+            for n in range(1, bits + 1):
+                masks += [sum(1 << b for b in combo) for combo in combinations(range(CHUNK_BITS), n)]
+            self._masks[bits] = masks
+        return self._masks[bits]
+
+
+_indexes: Dict[Tuple[int, int], HashIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(database, user_id: int) -> HashIndex:
+    """
+    Индекс хешей пользователя - перед каждым поиском
+
+    Первый вызов в процессе загружает image_hashes целиком, следующие дочитывают строки,
+    записанные после прочитанных (по created_at с запасом OVERLAP, повторы отсекает
+    add): их записали другие процессы и узлы, в том числе для старых объявлений,
+    захешированных позже (не уложились в budget, ошибка сети).
+    """
+    key = (id(database), user_id)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        loading = index is None
+        if loading:
+            index = _indexes[key] = HashIndex()
+        session = database.get_session()
+        try:
+            rows = session.query(ImageHash.announcement_id, ImageHash.hash, ImageHash.created_at).filter(
+                ImageHash.user_id == user_id, ImageHash.hash.isnot(None))
+            if index.read_until:
+                rows = rows.filter(ImageHash.created_at >= index.read_until - OVERLAP)
+            size = index.size
+            for announcement_id, value, created_at in rows.yield_per(10000):
+                index.add(announcement_id, to_unsigned(value))
+                if created_at and (index.read_until is None or created_at > index.read_until):
+                    index.read_until = created_at
+        finally:
+            session.close()
+        if loading:
+            logger.info(f"🖼️ Индекс фото загружен: {index.size}")
+        elif index.size > size:
+            logger.debug(f"🖼️ Индекс фото: +{index.size - size} из БД")
+        return index
+
+
+def reset_index(database, user_id: int):
+    """Выбросить индекс из памяти (перечитается из БД при следующем обращении)"""
+    with _indexes_lock:
+        _indexes.pop((id(database), user_id), None)
+
+
+def forget(database, announcement_ids: List[int]) -> int:
+    """Убрать удалённые объявления из индексов БД в памяти (retention)"""
+    with _indexes_lock:
+        indexes = [index for (db_id, _), index in _indexes.items() if db_id == id(database)]
+    return sum(index.remove(announcement_ids) for index in indexes)
+
+
+class ImageHasher:
+    """Хеши первых фото новых объявлений и пометка повторов/перекупов"""
+
+    def __init__(self, config: Dict, database=None):
+        settings = config.get('image_hash') or {}
+        self.user_id = tenant_id(config)
+        self.db = database or tenant_db(config)
+        self.radius = int(settings.get('radius', 6))
+        self.dealer_min = int(settings.get('dealer_min', 3))
+        self.workers = max(int(settings.get('workers', 4)), 1)
+        self.budget = int(settings.get('budget', 200))
+        self.timeout = settings.get('timeout', 10)
+        self._http = ThreadSessions()
+
+        ImageHash.__table__.create(bind=self.db.engine, checkfirst=True)
+
+    def process(self, job=None) -> Dict[str, int]:
+        """Один проход по новым объявлениям без хеша (в порядке id)"""
+        stats = {'hashed': 0, 'image_duplicates': 0, 'dealers': 0}
+        session = self.db.get_session()
+        try:
+            pending = (
+                session.query(Announcement.id, Announcement.image_urls)
+                .outerjoin(ImageHash, ImageHash.announcement_id == Announcement.id)
+                .filter(Announcement.user_id == self.user_id, Announcement.status == 'new',
+                        ImageHash.announcement_id.is_(None))
+                .order_by(Announcement.id)
+                .limit(self.budget)
+                .all()
+            )
+            if not pending or (job and job.cancelled):
+                return stats
+            # Транзакция не ждёт скачивания миниатюр: created_at новых строк - время вставки
+            session.commit()
+
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(pending)),
+                                    thread_name_prefix="imghash") as executor:
+                hashes = list(executor.map(lambda row: self._hash(row[1]), pending))
+
+            index = get_index(self.db, self.user_id)
+            rows = []
+            duplicates, dealers = [], set()
+            for (announcement_id, _), value in zip(pending, hashes):
+                if value is False:
+                    continue  # Сеть - попробуем в следующем проходе
+                row = {'announcement_id': announcement_id, 'user_id': self.user_id, 'hash': None, 'matches': 0}
+                rows.append(row)
+                if value is None:
+                    continue
+
+                matches = [key for key, _ in index.search(value, self.radius) if key != announcement_id]
+                index.add(announcement_id, value)
+                row.update(hash=to_signed(value), matches=len(matches))
+                stats['hashed'] += 1
+
+                if len(matches) + 1 >= self.dealer_min:
+                    dealers.update(matches)
+                    dealers.add(announcement_id)
+                    IMAGE_HASH_TOTAL.labels(result='dealer').inc()
+                elif matches:
+                    duplicates.append(announcement_id)
+                    IMAGE_HASH_TOTAL.labels(result='duplicate').inc()
+
+            # Повтор, который потом оказался в группе перекупа, - перекуп
+            duplicates = [i for i in duplicates if i not in dealers]
+            self.db.insert(session, ImageHash, rows, conflict=('announcement_id',))
+            if duplicates:
+                session.query(Announcement).filter(
+                    Announcement.id.in_(duplicates), Announcement.status == 'new',
+                ).update({'status': 'duplicate'}, synchronize_session=False)
+            if dealers:
+                session.query(Announcement).filter(Announcement.id.in_(dealers)).update(
+                    {'author_type': 'business'}, synchronize_session=False)
+                session.query(Announcement).filter(
+                    Announcement.id.in_(dealers), Announcement.status == 'new',
+                ).update({'status': 'filtered'}, synchronize_session=False)
+            session.commit()
+
+            stats['image_duplicates'] = len(duplicates)
+            stats['dealers'] = len(dealers)
+            if duplicates or dealers:
+                logger.info(f"🖼️ Фото: повторов {len(duplicates)}, объявлений перекупов {len(dealers)}")
+            return stats
+
+        except Exception as e:
+            session.rollback()
+            # В памяти могли остаться хеши незаписанных строк
+            reset_index(self.db, self.user_id)
+            logger.error(f"Ошибка хеширования фото: {e}")
+            return stats
+        finally:
+            session.close()
+
+    def _hash(self, image_urls) -> Optional[int]:
+        """
+        dHash первой картинки
+
+        Returns:
+            int - хеш, None - картинки нет или не читается, False - ошибка сети
+        """
+        if not image_urls:
+            IMAGE_HASH_TOTAL.labels(result='no_image').inc()
+            return None
+        try:
+            response = self._http.session().get(image_urls[0], timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logger.debug(f"Фото {image_urls[0]}: {e}")
+            IMAGE_HASH_TOTAL.labels(result='failed').inc()
+            return False
+        try:
+            value = dhash(Image.open(io.BytesIO(response.content)))
+        except Exception as e:
+            logger.debug(f"Фото {image_urls[0]} не читается: {e}")
+            IMAGE_HASH_TOTAL.labels(result='no_image').inc()
+            return None
+        IMAGE_HASH_TOTAL.labels(result='hashed').inc()
+        return value
+
+
+def create_hasher(config: Dict, database=None) -> Optional[ImageHasher]:
+    """Хеширование фото по настройкам image_hash (или None если отключено / нет Pillow)"""
+    if not (config.get('image_hash') or {}).get('enabled'):
+        return None
+    if Image is None:
+        logger.warning("Pillow не установлен - проверка фото (image_hash) отключена")
+        return None
+    return ImageHasher(config, database)
@@ -0,0 +1,190 @@
+"""
+Исполнитель фоновых задач - ограниченный пул потоков, очередь с приоритетами, отмена
+"""
+import itertools
+import os
+import queue
+import threading
+import time
+import weakref
+from typing import Callable, Dict, Optional, Tuple
+from loguru import logger
+from jobs import JobHandle, JobRegistry, get_registry
+
+# Меньше - раньше
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10
+
+
+# Исполнители процесса - для сброса потоков после fork
+_runners: "weakref.WeakSet[JobRunner]" = weakref.WeakSet()
+
+
+class JobQueueFull(Exception):
+    """Очередь задач переполнена"""
+
+
+class JobRunner:
+    """Очередь задач с фиксированным числом воркеров (потоки стартуют при первой задаче)"""
+
+    def __init__(self, workers: int = 1, max_queued: int = 10, registry: JobRegistry = None,
+                 heartbeat: float = 60.0):
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self._registry = registry
+        # Раз в heartbeat секунд задачи в очереди отмечаются живыми (выполняющиеся - сами)
+        self.heartbeat = heartbeat
+
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._handles: Dict[int, JobHandle] = {}
+        self._running: set = set()
+        self._threads = []
+        self._heartbeat_thread = None
+        self._lock = threading.Lock()
+        _runners.add(self)
+
+    @property
+    def registry(self) -> JobRegistry:
+        """Реестр задач (общий - при первой задаче, не при создании исполнителя)"""
+        return self._registry or get_registry()
+
+    def submit(self, kind: str, fn: Callable[[JobHandle], object], key: str = None,
+               priority: int = PRIORITY_NORMAL, pages_total: int = 0, params: Dict = None,
+               yield_to: Tuple[str, ...] = ()) -> JobHandle:
+        """
+        Поставить задачу в очередь
+
+        fn(job) выполняется в воркере; отмену проверяет через job.checkpoint().
+
+        Raises:
+            JobConflict: задача с таким ключом уже в очереди или выполняется
+            JobQueueFull: в очереди max_queued задач
+        """
+        with self._lock:
+            if len(self._handles) - len(self._running) >= self.max_queued:
+                raise JobQueueFull(f"В очереди уже {self.max_queued} задач")
+
+            job = self.registry.start(kind, key, pages_total, params, state="queued", yield_to=yield_to)
+            self._handles[job.id] = job
+            self._queue.put((priority, next(self._seq), job, fn))
+            self._ensure_workers()
+
+        logger.info(f"📥 Задача {job.id} ({kind}) в очереди, приоритет {priority}")
+        return job
+
+    def cancel(self, job_id: int) -> bool:
+        """
+        Отменить задачу: из очереди - сразу, выполняющуюся - на ближайшей контрольной точке
+
+        Задачу другого процесса (воркер serve.py, main.py) - флагом в БД.
+        """
+        with self._lock:
+            job = self._handles.get(job_id)
+            if not job:
+                if not self.registry.request_cancel(job_id):
+                    return False
+                logger.info(f"⏹️ Запрошена отмена задачи {job_id} другого процесса")
+                return True
+            job.cancel()
+            if job_id not in self._running:
+                # Ещё в очереди - освобождаем ключ сразу, воркер её пропустит
+                self._handles.pop(job_id)
+                job.finish("cancelled")
+        logger.info(f"⏹️ Запрошена отмена задачи {job_id}")
+        return True
+
+    def get(self, job_id: int) -> Optional[JobHandle]:
+        return self._handles.get(job_id)
+
+    def _after_fork(self):
+        """В дочернем процессе: потоки и очередь родителя не унаследованы"""
+        self._queue = queue.PriorityQueue()
+        self._handles = {}
+        self._running = set()
+        self._threads = []
+        self._heartbeat_thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker, name=f"job-worker-{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        if self._heartbeat_thread is None:
+            self._heartbeat_thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+            self._heartbeat_thread.start()
+
+    def _heartbeat(self):
+        """Ожидающие в очереди за долгой задачей не должны выглядеть зависшими (STALE_AFTER)"""
+        while True:
+            time.sleep(self.heartbeat)
+            with self._lock:
+                queued = [job_id for job_id in self._handles if job_id not in self._running]
+            self.registry.touch(queued)
+
+    def _worker(self):
+        while True:
+            _, _, job, fn = self._queue.get()
+            if job.cancelled:
+                continue  # Отменена в очереди - cancel() уже записал итог
+
+            row = self.registry.get(job.id)
+            if row is None or row['state'] != "queued":
+                with self._lock:
+                    self._handles.pop(job.id, None)
+                logger.warning(f"⚠️ Задача {job.id} ({job.kind}) уже {row and row['state']}, не запускается")
+                continue
+            if row['cancel_requested']:
+                with self._lock:
+                    self._handles.pop(job.id, None)
+                job.finish("cancelled")  # Отменили через другой процесс, пока ждала в очереди
+                continue
+
+            with self._lock:
+                if job.cancelled:
+                    continue
+                self._running.add(job.id)
+
+            self.registry.update(job.id, state="running")
+            try:
+                fn(job)
+                job.finish("cancelled" if job.cancelled else "done")
+            except Exception as e:
+                job.fail(str(e))
+                logger.error(f"❌ Задача {job.id} ({job.kind}) упала: {e}", exc_info=True)
+            finally:
+                with self._lock:
+                    self._running.discard(job.id)
+                    self._handles.pop(job.id, None)
+
+
+def _after_fork():
+    for runner in list(_runners):
+        runner._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def create_runner(config: dict) -> JobRunner:
+    """Исполнитель по настройкам jobs.workers / jobs.max_queued"""
+    jobs_config = config.get('jobs', {})
+    return JobRunner(
+        workers=jobs_config.get('workers', 1),
+        max_queued=jobs_config.get('max_queued', 10),
+    )
+
+
+def install(app, runner: JobRunner, prefix: str = "/api/jobs"):
+    """POST {prefix}/<id>/cancel - отмена задачи (своей - сразу, другого процесса - через БД)"""
+    from flask import jsonify
+
+    def cancel_job(job_id):
+        if not runner.cancel(job_id):
+            return jsonify({'error': 'Задача не найдена или уже завершена'}), 404
+        return jsonify({'message': 'Отмена запрошена', 'job_id': job_id})
+
+    app.add_url_rule(f"{prefix}/<int:job_id>/cancel", "job_cancel", cancel_job, methods=['POST'])
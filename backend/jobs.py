@@ -0,0 +1,408 @@
+"""
+Реестр задач парсинга - состояние, прогресс и защита от параллельных дубликатов
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from loguru import logger
+
+# Задача без обновлений дольше этого считается зависшей (процесс упал)
+STALE_AFTER = timedelta(minutes=15)
+
+
+class JobConflict(Exception):
+    """Задача с таким ключом уже выполняется"""
+
+    def __init__(self, job: Dict):
+        self.job = job
+        super().__init__(f"Задача {job['key']} уже выполняется (id={job['id']})")
+
+
+class JobHandle:
+    """Ссылка на выполняющуюся задачу: прогресс, отмена, уступка более важным задачам"""
+
+    def __init__(self, registry: "JobRegistry", job_id: int, kind: str = None, yield_to: Tuple[str, ...] = ()):
+        self.registry = registry
+        self.id = job_id
+        self.kind = kind
+        # Виды задач, которым эта уступает (например, наполнение ждёт, пока идёт цикл)
+        self.yield_to = tuple(yield_to)
+        self._cancel = threading.Event()
+        self._beat = 0.0
+
+    def progress(self, current_source: str = None, pages: int = 0, ads_new: int = 0, pages_total: int = None):
+        """Отметить прогресс: текущий источник, +страницы, +новые объявления"""
+        self.registry.update(self.id, current_source=current_source, pages=pages,
+                             ads_new=ads_new, pages_total=pages_total)
+
+    def heartbeat(self, every: float = 30.0):
+        """Задача жива (долгий шаг без прогресса - публикация): в БД не чаще раза в every секунд"""
+        now = time.monotonic()
+        if now - self._beat >= every:
+            self._beat = now
+            self.registry.update(self.id)
+
+    def finish(self, state: str = "done", error: str = None):
+        self.registry.finish(self.id, state, error)
+
+    def fail(self, error: str):
+        self.finish("failed", error)
+
+    # ===== ОТМЕНА =====
+
+    def cancel(self):
+        """Запросить отмену (задача остановится на ближайшей контрольной точке)"""
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def sleep(self, seconds: float, poll: float = 5.0) -> bool:
+        """Пауза, прерываемая отменой (и из другого процесса - раз в poll секунд). False - задачу отменили"""
+        deadline = time.monotonic() + seconds
+        while not self._poll_cancel():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return True
+            self._cancel.wait(min(poll, remaining))
+        return False
+
+    def _poll_cancel(self) -> bool:
+        """Отменена ли задача - здесь или через другой процесс (флаг в БД)"""
+        if not self.cancelled and self.registry.cancel_requested(self.id):
+            self._cancel.set()
+        return self.cancelled
+
+    def checkpoint(self, poll: float = 5.0) -> bool:
+        """
+        Контрольная точка между страницами/источниками
+
+        Ждёт, пока выполняются задачи из yield_to (в любом процессе).
+
+        Returns:
+            False если задачу отменили - нужно остановиться
+        """
+        waiting = False
+        while not self._poll_cancel() and self._blocked_by():
+            if not waiting:
+                waiting = True
+                logger.info(f"⏸️ Задача {self.id} ({self.kind}) ждёт: выполняется {', '.join(self.yield_to)}")
+            self.registry.update(self.id)  # heartbeat, чтобы не посчитали зависшей
+            self._cancel.wait(poll)
+        return not self.cancelled
+
+    def _blocked_by(self) -> bool:
+        # Задача упавшего процесса (нет обновлений дольше STALE_AFTER) не держит остальных
+        for kind in self.yield_to:
+            self.registry._expire_stale(kind=kind)
+        return any(
+            job['id'] != self.id
+            for kind in self.yield_to
+            for job in self.registry.list(active_only=True, kind=kind, limit=5)
+            if job['state'] == "running"
+        )
+
+
+# SQLAlchemy и модели - при создании первого реестра: API при импорте нужны только
+# JobHandle, JobConflict и install(), реестр - при первой задаче (get_registry())
+Job = IntegrityError = _db = None
+
+
+def _load_models():
+    global Job, IntegrityError, _db
+    if Job is None:
+        from sqlalchemy.exc import IntegrityError
+        from database import db as _db
+        from models import Job
+
+
+class JobRegistry:
+    """Задачи в таблице jobs - общая для main.py и Dashboard API"""
+
+    def __init__(self, database=None):
+        _load_models()
+        self.db = database or _db
+        Job.__table__.create(bind=self.db.engine, checkfirst=True)
+
+    def start(self, kind: str, key: str = None, pages_total: int = 0, params: Dict = None,
+              state: str = "running", yield_to: Tuple[str, ...] = ()) -> JobHandle:
+        """
+        Зарегистрировать задачу
+
+        Raises:
+            JobConflict: если задача с таким ключом уже активна
+        """
+        key = key or kind
+        now = datetime.now()
+        self._expire_stale(key)
+
+        session = self.db.get_session()
+        try:
+            job = Job(
+                kind=kind,
+                key=key,
+                state=state,
+                params=params,
+                pages_total=pages_total,
+                pages_done=0,
+                ads_new=0,
+                pid=os.getpid(),
+                created_at=now,
+                started_at=now if state == "running" else None,
+                updated_at=now,
+            )
+            session.add(job)
+            session.commit()
+            return JobHandle(self, job.id, kind, yield_to)
+        except IntegrityError:
+            session.rollback()
+            active = self.active(key)
+            raise JobConflict(active or {'id': None, 'key': key})
+        finally:
+            session.close()
+
+    def update(self, job_id: int, current_source: str = None, pages: int = 0, ads_new: int = 0,
+               pages_total: int = None, state: str = None):
+        """Обновить прогресс задачи"""
+        session = self.db.get_session()
+        try:
+            job = session.get(Job, job_id)
+            if not job:
+                return
+            if current_source is not None:
+                job.current_source = current_source
+            if pages_total is not None:
+                job.pages_total = pages_total
+            if state and job.state in Job.ACTIVE_STATES:
+                job.state = state
+                if state == "running" and not job.started_at:
+                    job.started_at = datetime.now()
+            job.pages_done = (job.pages_done or 0) + pages
+            job.ads_new = (job.ads_new or 0) + ads_new
+            job.updated_at = datetime.now()
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Ошибка обновления задачи {job_id}: {e}")
+        finally:
+            session.close()
+
+    def finish(self, job_id: int, state: str = "done", error: str = None):
+        """Завершить задачу (уже завершённую - например, помеченную зависшей - не трогает)"""
+        session = self.db.get_session()
+        try:
+            job = session.get(Job, job_id)
+            if not job:
+                return
+            if job.state not in Job.ACTIVE_STATES:
+                logger.warning(f"Задача {job_id} уже {job.state}, итог {state} не записан")
+                return
+            job.state = state
+            job.error = error
+            job.current_source = None
+            job.finished_at = job.updated_at = datetime.now()
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Ошибка завершения задачи {job_id}: {e}")
+        finally:
+            session.close()
+
+    def request_cancel(self, job_id: int) -> bool:
+        """
+        Отмена задачи другого процесса: флаг в БД, задача увидит его на контрольной точке
+
+        Returns:
+            False если задача не найдена или уже завершена
+        """
+        session = self.db.get_session()
+        try:
+            updated = session.query(Job).filter(
+                Job.id == job_id,
+                Job.state.in_(Job.ACTIVE_STATES),
+            ).update({Job.cancel_requested: True, Job.updated_at: datetime.now()}, synchronize_session=False)
+            session.commit()
+            return updated > 0
+        finally:
+            session.close()
+
+    def touch(self, job_ids: List[int]):
+        """Задачи живы (очередь исполнителя): сдвинуть updated_at, чтобы не посчитали зависшими"""
+        if not job_ids:
+            return
+        session = self.db.get_session()
+        try:
+            session.query(Job).filter(
+                Job.id.in_(job_ids),
+                Job.state.in_(Job.ACTIVE_STATES),
+            ).update({Job.updated_at: datetime.now()}, synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Ошибка обновления задач в очереди: {e}")
+        finally:
+            session.close()
+
+    def cancel_requested(self, job_id: int) -> bool:
+        session = self.db.get_session()
+        try:
+            return bool(session.query(Job.cancel_requested).filter(Job.id == job_id).scalar())
+        finally:
+            session.close()
+
+    def _expire_stale(self, key: str = None, kind: str = None):
+        """Пометить упавшими активные задачи ключа или вида без обновлений (процесс умер)"""
+        session = self.db.get_session()
+        try:
+            query = session.query(Job).filter(
+                Job.state.in_(Job.ACTIVE_STATES),
+                Job.updated_at < datetime.now() - STALE_AFTER,
+            )
+            if key:
+                query = query.filter(Job.key == key)
+            if kind:
+                query = query.filter(Job.kind == kind)
+            stale = query.all()
+            for job in stale:
+                job.state = "failed"
+                job.error = "Нет обновлений, процесс завершился"
+                job.finished_at = datetime.now()
+                logger.warning(f"Задача {job.id} ({job.key}) зависла, помечена как failed")
+            session.commit()
+        finally:
+            session.close()
+
+    def expire_keys(self, keys: List[str], error: str) -> int:
+        """Пометить упавшими активные задачи с этими ключами (их процесс известно мёртв)"""
+        if not keys:
+            return 0
+        session = self.db.get_session()
+        try:
+            now = datetime.now()
+            expired = session.query(Job).filter(
+                Job.key.in_(keys),
+                Job.state.in_(Job.ACTIVE_STATES),
+            ).update({Job.state: "failed", Job.error: error, Job.finished_at: now, Job.updated_at: now},
+                     synchronize_session=False)
+            session.commit()
+            return expired
+        finally:
+            session.close()
+
+    # ===== ЧТЕНИЕ =====
+
+    def get(self, job_id: int) -> Optional[Dict]:
+        session = self.db.get_session()
+        try:
+            job = session.get(Job, job_id)
+            return job.to_dict() if job else None
+        finally:
+            session.close()
+
+    def active(self, key: str = None) -> Optional[Dict]:
+        """Активная задача с ключом (или None)"""
+        jobs = self.list(active_only=True, key=key, limit=1)
+        return jobs[0] if jobs else None
+
+    def last(self, kind: str) -> Optional[Dict]:
+        """Последняя задача вида"""
+        jobs = self.list(kind=kind, limit=1)
+        return jobs[0] if jobs else None
+
+    def list(self, active_only: bool = False, kind: str = None, key: str = None, limit: int = 20) -> List[Dict]:
+        session = self.db.get_session()
+        try:
+            query = session.query(Job)
+            if active_only:
+                query = query.filter(Job.state.in_(Job.ACTIVE_STATES))
+            if kind:
+                query = query.filter(Job.kind == kind)
+            if key:
+                query = query.filter(Job.key == key)
+            return [job.to_dict() for job in query.order_by(Job.id.desc()).limit(limit).all()]
+        finally:
+            session.close()
+
+    def version(self) -> Optional[str]:
+        """Метка изменений (для SSE: отправляем, только если что-то поменялось)"""
+        session = self.db.get_session()
+        try:
+            row = session.query(Job.id, Job.updated_at).order_by(Job.updated_at.desc(), Job.id.desc()).first()
+            return f"{row[0]}:{row[1].isoformat()}" if row else None
+        finally:
+            session.close()
+
+
+_registry: Optional[JobRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> JobRegistry:
+    """Общий реестр - создаётся (и создаёт таблицу jobs) при первом обращении, не при импорте"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = JobRegistry()
+    return _registry
+
+
+# ===== HTTP API =====
+
+def install(app, registry: JobRegistry = None, prefix: str = "/api/jobs", poll_interval: float = 1.0,
+            heartbeat: float = 15.0):
+    """
+    Эндпоинты задач во Flask-приложении:
+        GET {prefix}          - список (active=1 - только активные), для дешёвого опроса
+        GET {prefix}/<id>     - одна задача
+        GET {prefix}/stream   - Server-Sent Events: событие при каждом изменении
+    """
+    import json
+    from flask import Response, jsonify, request
+
+    def current():
+        return registry or get_registry()
+
+    def jobs_list():
+        active_only = request.args.get('active', '0') in ('1', 'true')
+        limit = min(request.args.get('limit', 20, type=int), 200)
+        return jsonify(current().list(active_only=active_only, kind=request.args.get('kind'), limit=limit))
+
+    def job_detail(job_id):
+        job = current().get(job_id)
+        if not job:
+            return jsonify({'error': 'Задача не найдена'}), 404
+        return jsonify(job)
+
+    def jobs_stream():
+        reg = current()
+
+        def events():
+            last_version = None
+            last_sent = time.monotonic()
+            # Подсказка браузеру, через сколько переподключаться
+            yield f"retry: {int(poll_interval * 3000)}\n\n"
+            while True:
+                version = reg.version()
+                if version != last_version:
+                    last_version = version
+                    last_sent = time.monotonic()
+                    payload = json.dumps(reg.list(limit=10), ensure_ascii=False)
+                    yield f"event: jobs\ndata: {payload}\n\n"
+                elif time.monotonic() - last_sent >= heartbeat:
+                    # Комментарий держит соединение живым через прокси
+                    last_sent = time.monotonic()
+                    yield ": ping\n\n"
+                time.sleep(poll_interval)
+
+        return Response(events(), mimetype="text/event-stream", headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
+
+    app.add_url_rule(prefix, "jobs_list", jobs_list)
+    app.add_url_rule(f"{prefix}/stream", "jobs_stream", jobs_stream)
+    app.add_url_rule(f"{prefix}/<int:job_id>", "job_detail", job_detail)
@@ -0,0 +1,389 @@
+"""
+Распределённый обход - аренда источников узлами через общую БД
+
+Несколько main.py (узлы, у каждого свои прокси) работают с одной БД. Источник
+(город/раздел) обходит только узел, который его арендовал:
+
+- аренда - условный UPDATE строки source_leases (свободна, истекла или уже моя),
+  атомарный и в SQLite, и в PostgreSQL; других сервисов не нужно
+- узел раз в heartbeat_seconds отмечается в crawl_nodes и продлевает свои аренды на
+  lease_seconds; упал - аренды истекают и их забирают другие узлы, а без heartbeat
+  дольше node_timeout он выпадает из распределения
+- доля узла - ceil(источников * capacity / сумма capacity живых узлов); capacity по
+  умолчанию - число прокси узла. Берутся источники, обойдённые раньше всех и не позже
+  чем recrawl_after назад, поэтому узлы со сдвинутыми циклами не обходят одно и то же
+- задачи цикла на один узел (публикация, единицы) - аренды task:* (acquire/complete)
+
+Часы узлов должны быть синхронизированы (NTP): время аренд - UTC, расхождение должно
+быть много меньше lease_seconds.
+
+Настройки (config.yaml):
+    distributed:
+      enabled: false
+      node_id: ""              # По умолчанию hostname
+      capacity: 0              # Вес узла; 0 - по числу прокси (минимум 1)
+      lease_seconds: 300
+      heartbeat_seconds: 30
+      node_timeout: 120        # Нет heartbeat дольше - узел считается упавшим
+      recrawl_after: 0         # Секунд до повторного обхода источника; 0 - parser.interval / 2
+"""
+import math
+import os
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+from loguru import logger
+from sqlalchemy import update
+from models import CrawlNode, SourceLease
+from metrics import LEASE_TOTAL
+
+
+def _now() -> datetime:
+    """UTC без часового пояса (как log_sink)"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def source_key(source: Dict) -> str:
+    """Ключ источника: путь URL (vorkuta/kvartiry), с query, если есть"""
+    url = urlparse(source['url'])
+    path = url.path.strip('/')
+    return f"{path}?{url.query}" if url.query else path
+
+
+class LeaseManager:
+    """Аренды источников одного узла: захват, продление heartbeat'ом, завершение"""
+
+    def __init__(self, database, user_id: int = 0, node_id: str = None, capacity: int = 1,
+                 lease_seconds: float = 300, heartbeat_seconds: float = 30, node_timeout: float = 120,
+                 recrawl_after: float = 150):
+        self.db = database
+        self.user_id = user_id
+        self.node_id = node_id or socket.gethostname()
+        self.capacity = max(1, int(capacity))
+        self.lease = timedelta(seconds=lease_seconds)
+        self.heartbeat_seconds = heartbeat_seconds
+        self.node_timeout = timedelta(seconds=node_timeout)
+        self.recrawl_after = timedelta(seconds=recrawl_after)
+
+        self._held: set = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        CrawlNode.__table__.create(bind=self.db.engine, checkfirst=True)
+        SourceLease.__table__.create(bind=self.db.engine, checkfirst=True)
+
+    # ===== УЗЕЛ =====
+
+    def start(self):
+        """Зарегистрировать узел и запустить heartbeat"""
+        self.register()
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="lease-heartbeat", daemon=True)
+            self._thread.start()
+        logger.info(f"🛰️ Узел {self.node_id} (вес {self.capacity}) в распределённом обходе")
+
+    def stop(self):
+        """Отпустить аренды и выйти из распределения (доли пересчитаются сразу)"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.heartbeat_seconds)
+            self._thread = None
+        self.release_all()
+        self._update_node(state="stopped")
+
+    def register(self):
+        now = _now()
+        session = self.db.get_session()
+        try:
+            self.db.insert(session, CrawlNode, [{
+                'user_id': self.user_id,
+                'node_id': self.node_id,
+                'capacity': self.capacity,
+                'hostname': socket.gethostname(),
+                'pid': os.getpid(),
+                'state': 'active',
+                'started_at': now,
+                'heartbeat_at': now,
+            }], conflict=('user_id', 'node_id'),
+                update=('capacity', 'hostname', 'pid', 'state', 'started_at', 'heartbeat_at'))
+            session.commit()
+        finally:
+            session.close()
+
+    def _run(self):
+        while not self._stop.wait(self.heartbeat_seconds):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"Ошибка heartbeat узла {self.node_id}: {e}")
+
+    def heartbeat(self):
+        """Отметка узла и продление его аренд; аренды, которые забрали, - забываются"""
+        self._update_node(state="active")
+        self.reap()
+        with self._lock:
+            held = set(self._held)
+        if not held:
+            return
+
+        now = _now()
+        session = self.db.get_session()
+        try:
+            session.execute(
+                update(SourceLease)
+                .where(SourceLease.user_id == self.user_id, SourceLease.node_id == self.node_id)
+                .values(expires_at=now + self.lease)
+            )
+            still = {key for (key,) in session.query(SourceLease.source_key).filter(
+                SourceLease.user_id == self.user_id, SourceLease.node_id == self.node_id)}
+            session.commit()
+        finally:
+            session.close()
+
+        with self._lock:
+            lost = (held - still) & self._held  # Завершённые за это время - не потеряны
+            self._held -= lost
+        if lost:
+            LEASE_TOTAL.labels(result='lost').inc(len(lost))
+            logger.warning(f"⚠️ Узел {self.node_id} потерял аренды (истекли, забраны): {', '.join(sorted(lost))}")
+
+    @property
+    def cycle_key(self) -> str:
+        """Ключ задачи цикла узла в таблице jobs"""
+        return f"cycle:{self.node_id}"
+
+    def reap(self):
+        """
+        Циклы упавших узлов (нет heartbeat дольше node_timeout) - в failed
+
+        Иначе их running-строка держала бы наполнения (yield_to cycle) на всех узлах,
+        пока не сработает STALE_AFTER.
+        """
+        import jobs
+
+        alive = {node['node_id'] for node in self.nodes()}
+        dead = [f"cycle:{node['node_id']}" for node in self.nodes(alive_only=False) if node['node_id'] not in alive]
+        expired = jobs.get_registry().expire_keys(dead, "Узел перестал отвечать (heartbeat)") if dead else 0
+        if expired:
+            logger.warning(f"⚠️ Циклы упавших узлов помечены failed: {expired}")
+
+    def _update_node(self, state: str):
+        session = self.db.get_session()
+        try:
+            updated = session.query(CrawlNode).filter(
+                CrawlNode.user_id == self.user_id, CrawlNode.node_id == self.node_id,
+            ).update({CrawlNode.heartbeat_at: _now(), CrawlNode.state: state}, synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
+        if not updated and state == "active":
+            self.register()  # Строку удалили вручную - регистрируемся заново
+
+    def nodes(self, alive_only: bool = True) -> List[Dict]:
+        return _nodes(self.db, self.user_id, self.node_timeout if alive_only else None)
+
+    def share(self, total: int) -> int:
+        """Сколько из total источников берёт этот узел (по весу среди живых узлов)"""
+        nodes = self.nodes()
+        capacity = sum(node['capacity'] for node in nodes if node['node_id'] != self.node_id) + self.capacity
+        return min(total, math.ceil(total * self.capacity / capacity))
+
+    # ===== АРЕНДЫ =====
+
+    def claim(self, sources: List[Dict]) -> List[Dict]:
+        """
+        Арендовать долю источников к обходу (давно не обходившиеся - первыми)
+
+        Returns:
+            Арендованные источники этого узла (включая уже арендованные им)
+        """
+        by_key = {source_key(source): source for source in sources}
+        if not by_key:
+            return []
+        rows = self._rows(list(by_key))
+
+        now = _now()
+        due_before = now - self.recrawl_after
+        mine = [key for key, row in rows.items() if row['node_id'] == self.node_id]
+        candidates = sorted(
+            (row for key, row in rows.items()
+             if row['node_id'] != self.node_id
+             and (row['node_id'] is None or row['expires_at'] is None or row['expires_at'] < now)
+             and (row['crawled_at'] is None or row['crawled_at'] < due_before)),
+            key=lambda row: (row['crawled_at'] or datetime.min, row['source_key']),
+        )
+
+        want = self.share(len(by_key)) - len(mine)
+        claimed = list(mine)
+        for row in candidates:
+            if want <= 0:
+                break
+            if not self._acquire(row['source_key'], now):
+                LEASE_TOTAL.labels(result='busy').inc()
+                continue  # Другой узел успел раньше
+            if row['node_id'] is not None:
+                LEASE_TOTAL.labels(result='taken_over').inc()
+                logger.warning(f"♻️ {row['source_key']}: аренда узла {row['node_id']} истекла, забрана")
+            claimed.append(row['source_key'])
+            want -= 1
+
+        with self._lock:
+            self._held.update(claimed)
+        if claimed:
+            logger.info(f"🛰️ Узел {self.node_id}: источников {len(claimed)} из {len(by_key)}")
+        claimed = set(claimed)
+        return [source for key, source in by_key.items() if key in claimed]
+
+    def acquire(self, key: str) -> bool:
+        """Аренда задачи/источника по ключу (без учёта доли и recrawl_after)"""
+        self._rows([key])
+        if not self._acquire(key, _now()):
+            return False
+        with self._lock:
+            self._held.add(key)
+        return True
+
+    def holds(self, source) -> bool:
+        key = source if isinstance(source, str) else source_key(source)
+        with self._lock:
+            return key in self._held
+
+    def complete(self, source):
+        """Обход завершён: отметить crawled_at и освободить"""
+        key = source if isinstance(source, str) else source_key(source)
+        self._release(key, crawled_at=_now(), crawled_by=self.node_id, failures=0)
+        LEASE_TOTAL.labels(result='completed').inc()
+
+    def release(self, source, failed: bool = False):
+        """Освободить без отметки обхода (отмена, ошибка) - источник возьмёт любой узел"""
+        key = source if isinstance(source, str) else source_key(source)
+        values = {'failures': SourceLease.failures + 1} if failed else {}
+        self._release(key, **values)
+        LEASE_TOTAL.labels(result='released').inc()
+
+    def release_all(self):
+        with self._lock:
+            held = list(self._held)
+        for key in held:
+            self.release(key)
+
+    def _acquire(self, key: str, now: datetime) -> bool:
+        """Условный UPDATE: свободна, истекла или уже моя - атомарно в любой БД"""
+        session = self.db.get_session()
+        try:
+            result = session.execute(
+                update(SourceLease)
+                .where(
+                    SourceLease.user_id == self.user_id,
+                    SourceLease.source_key == key,
+                    (SourceLease.node_id.is_(None)) | (SourceLease.expires_at < now)
+                    | (SourceLease.node_id == self.node_id),
+                )
+                .values(node_id=self.node_id, acquired_at=now, expires_at=now + self.lease)
+            )
+            session.commit()
+        finally:
+            session.close()
+        if result.rowcount:
+            LEASE_TOTAL.labels(result='acquired').inc()
+        return result.rowcount > 0
+
+    def _release(self, key: str, **values):
+        with self._lock:
+            self._held.discard(key)
+        session = self.db.get_session()
+        try:
+            session.execute(
+                update(SourceLease)
+                .where(SourceLease.user_id == self.user_id, SourceLease.source_key == key,
+                       SourceLease.node_id == self.node_id)
+                .values(node_id=None, expires_at=None, **values)
+            )
+            session.commit()
+        finally:
+            session.close()
+
+    def _rows(self, keys: List[str]) -> Dict[str, Dict]:
+        """Строки аренд по ключам (недостающие создаются свободными)"""
+        session = self.db.get_session()
+        try:
+            self.db.insert(session, SourceLease, [
+                {'user_id': self.user_id, 'source_key': key, 'failures': 0} for key in keys
+            ], conflict=('user_id', 'source_key'))
+            session.commit()
+            rows = session.query(SourceLease).filter(
+                SourceLease.user_id == self.user_id, SourceLease.source_key.in_(keys)).all()
+            return {
+                row.source_key: {'source_key': row.source_key, 'node_id': row.node_id,
+                                 'expires_at': row.expires_at, 'crawled_at': row.crawled_at}
+                for row in rows
+            }
+        finally:
+            session.close()
+
+
+def _nodes(database, user_id: int, alive_within: Optional[timedelta]) -> List[Dict]:
+    session = database.get_session()
+    try:
+        query = session.query(CrawlNode).filter(CrawlNode.user_id == user_id)
+        if alive_within is not None:
+            query = query.filter(CrawlNode.state == 'active', CrawlNode.heartbeat_at >= _now() - alive_within)
+        return [node.to_dict() for node in query.order_by(CrawlNode.node_id).all()]
+    finally:
+        session.close()
+
+
+def create_manager(config: Dict, database=None) -> Optional[LeaseManager]:
+    """Аренды узла по настройкам distributed (None - обход без распределения)"""
+    from tenancy import tenant_id, tenant_db
+
+    settings = config.get('distributed') or {}
+    if not settings.get('enabled'):
+        return None
+    interval = (config.get('parser') or {}).get('interval', 300)
+    return LeaseManager(
+        database or tenant_db(config),
+        tenant_id(config),
+        node_id=settings.get('node_id') or None,
+        capacity=int(settings.get('capacity') or len(config.get('proxies') or []) or 1),
+        lease_seconds=float(settings.get('lease_seconds', 300)),
+        heartbeat_seconds=float(settings.get('heartbeat_seconds', 30)),
+        node_timeout=float(settings.get('node_timeout', 120)),
+        recrawl_after=float(settings.get('recrawl_after') or interval / 2),
+    )
+
+
+# ===== FLASK =====
+
+def install(app, load_config, prefix: str = "/api/crawl"):
+    """GET {prefix}/nodes - узлы (alive - есть свежий heartbeat) и аренды источников"""
+    from flask import jsonify
+    from tenancy import tenant_id, tenant_db
+
+    @app.route(f"{prefix}/nodes", methods=['GET'])
+    def crawl_nodes():
+        config = load_config()
+        settings = config.get('distributed') or {}
+        database, user_id = tenant_db(config), tenant_id(config)
+        timeout = timedelta(seconds=float(settings.get('node_timeout', 120)))
+
+        CrawlNode.__table__.create(bind=database.engine, checkfirst=True)
+        SourceLease.__table__.create(bind=database.engine, checkfirst=True)
+        alive = {node['node_id'] for node in _nodes(database, user_id, timeout)}
+        nodes = _nodes(database, user_id, None)
+        for node in nodes:
+            node['alive'] = node['node_id'] in alive
+
+        session = database.get_session()
+        try:
+            leases = [row.to_dict() for row in session.query(SourceLease).filter(
+                SourceLease.user_id == user_id).order_by(SourceLease.source_key).all()]
+        finally:
+            session.close()
+        return jsonify({'enabled': bool(settings.get('enabled')), 'nodes': nodes, 'leases': leases})
+
+    return crawl_nodes
@@ -0,0 +1,253 @@
+"""
+Запись логов в таблицу logs (для /api/logs) - в фоне и пачками
+
+Sink loguru только решает, оставить ли запись, и кладёт её в ограниченную очередь;
+поток-писатель вставляет записи в БД пачками. Поэтому логирование на каждое
+объявление в горячих циклах стоит постановки в очередь, а не INSERT на строку.
+
+- sample: доля записей уровня, которая пишется в БД (DEBUG: 0 - не писать)
+- rate_limit: записей в секунду с одной строки кода (ниже WARNING); лишние не пишутся,
+  вместо них - одна сводка "пропущено N" на строку кода за интервал записи
+- max_queue: потолок очереди; при переполнении записи отбрасываются и считаются
+
+Настройки (config.yaml):
+    logging:
+      database:
+        enabled: true
+        level: INFO
+        batch_size: 200
+        flush_interval: 1.0    # Секунд между записями пачек
+        max_queue: 10000
+        rate_limit: 5
+        sample:
+          DEBUG: 0.0
+          INFO: 1.0
+"""
+import atexit
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from loguru import logger
+from sqlalchemy import insert
+from models import Log
+
+MAX_MESSAGE = 2000
+
+# Модуль -> service в таблице logs
+SERVICES = {
+    'parser': 'parser',
+    'parser_improved': 'parser',
+    'parser_lightweight': 'parser',
+    'parser_with_captcha': 'parser',
+    'pipeline': 'parser',
+    'unit_crawler': 'parser',
+    'enrichment': 'parser',
+    'image_hash': 'parser',
+    'publisher': 'publisher',
+    'telegram_publisher': 'publisher',
+    'session_store': 'proxy',
+    'fetch_orchestrator': 'proxy',
+    'browser_pool': 'proxy',
+}
+
+_RATE_LIMITED_BELOW = 30  # WARNING и выше пишутся всегда
+
+
+class DatabaseLogSink:
+    """Sink loguru: отбор записей в вызывающем потоке, INSERT пачками в фоновом"""
+
+    def __init__(self, database, batch_size: int = 200, flush_interval: float = 1.0,
+                 max_queue: int = 10000, rate_limit: float = 5, sample: Dict[str, float] = None):
+        self.db = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rate_limit = rate_limit
+        self.burst = max(rate_limit * 2, 1)
+        self.sample = {level.upper(): float(share) for level, share in (sample or {}).items()}
+
+        self.queue: "queue.Queue[Dict]" = queue.Queue(maxsize=max_queue)
+        self.stats = {'queued': 0, 'written': 0, 'sampled_out': 0, 'rate_limited': 0, 'dropped': 0, 'failed': 0}
+
+        self._buckets: Dict[tuple, List[float]] = {}  # строка кода -> [токены, время]
+        self._suppressed: Counter = Counter()
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ===== ОТБОР (поток, который логирует) =====
+
+    def __call__(self, message):
+        record = message.record
+        level = record['level']
+
+        share = self.sample.get(level.name, 1.0)
+        if share < 1.0 and self._random.random() >= share:
+            self._count('sampled_out')
+            return
+
+        site = (record['name'], record['function'], record['line'])
+        if self.rate_limit and level.no < _RATE_LIMITED_BELOW and not self._allow(site):
+            with self._lock:
+                self._suppressed[site] += 1
+                self.stats['rate_limited'] += 1
+            return
+
+        details = {'source': f"{record['name']}:{record['function']}:{record['line']}"}
+        if record['exception']:
+            exc = record['exception']
+            details['exception'] = ''.join(traceback.format_exception(exc.type, exc.value, exc.traceback))[-4000:]
+
+        row = {
+            'level': level.name,
+            'service': record['extra'].get('service') or SERVICES.get(record['name'], 'system'),
+            'message': record['message'][:MAX_MESSAGE],
+            'details': details,
+            # Как func.now() в SQLite - UTC без часового пояса
+            'created_at': record['time'].astimezone(timezone.utc).replace(tzinfo=None),
+        }
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            self._count('dropped')
+            return
+        self._count('queued')
+        self._ensure_thread()
+
+    def _allow(self, site: tuple) -> bool:
+        """Token bucket на строку кода: rate_limit в секунду, всплеск до burst"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(site)
+            if bucket is None:
+                bucket = self._buckets[site] = [self.burst, now]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate_limit)
+            bucket[1] = now
+            if bucket[0] < 1:
+                return False
+            bucket[0] -= 1
+            return True
+
+    def _count(self, key: str, count: int = 1):
+        with self._lock:
+            self.stats[key] += count
+
+    # ===== ЗАПИСЬ (фоновый поток) =====
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            rows = self._drain()
+            rows += self._summaries()
+            if rows:
+                self._write(rows)
+            if self._stop.is_set() and self.queue.empty():
+                return
+
+    def _drain(self) -> List[Dict]:
+        """Пачка: ждём первую запись до flush_interval, остальные - что уже в очереди"""
+        rows = []
+        try:
+            rows.append(self.queue.get(timeout=self.flush_interval))
+            while len(rows) < self.batch_size:
+                rows.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return rows
+
+    def _summaries(self) -> List[Dict]:
+        """Одна запись на строку кода, чьи сообщения не прошли rate_limit"""
+        with self._lock:
+            suppressed, self._suppressed = self._suppressed, Counter()
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return [
+            {
+                'level': 'INFO',
+                'service': SERVICES.get(name, 'system'),
+                'message': f"Пропущено похожих сообщений: {count}",
+                'details': {'source': f"{name}:{function}:{line}", 'suppressed': count},
+                'created_at': now,
+            }
+            for (name, function, line), count in suppressed.items()
+        ]
+
+    def _write(self, rows: List[Dict]):
+        try:
+            with self.db.engine.begin() as conn:
+                conn.execute(insert(Log.__table__), rows)
+            self._count('written', len(rows))
+        except Exception as e:
+            # Не через logger - запись снова попала бы в эту очередь
+            self._count('failed', len(rows))
+            print(f"log_sink: не удалось записать {len(rows)} логов: {e}", file=sys.stderr)
+
+    def stop(self, timeout: float = 5.0):
+        """Дописать очередь и остановить поток (atexit)"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.stats, queue_size=self.queue.qsize())
+
+    def _after_fork(self):
+        """
+        В дочернем процессе: поток-писатель родителя не унаследован, его очередь допишет родитель
+
+        Иначе в воркере serve.py (app загружен до fork) записи копились бы без писателя.
+        """
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.stats = dict.fromkeys(self.stats, 0)
+        self._suppressed = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+
+_sink: Optional[DatabaseLogSink] = None
+
+
+def install(config: Dict, database=None) -> Optional[DatabaseLogSink]:
+    """Подключить запись логов в БД по logging.database (один раз на процесс)"""
+    global _sink
+    settings = (config.get('logging') or {}).get('database') or {}
+    if _sink is not None or not settings.get('enabled', True):
+        return _sink
+
+    if database is None:
+        from database import db as database
+
+    _sink = DatabaseLogSink(
+        database,
+        batch_size=int(settings.get('batch_size', 200)),
+        flush_interval=float(settings.get('flush_interval', 1.0)),
+        max_queue=int(settings.get('max_queue', 10000)),
+        rate_limit=float(settings.get('rate_limit', 5)),
+        sample=settings.get('sample', {'DEBUG': 0.0}),
+    )
+    logger.add(_sink, level=settings.get('level', 'INFO'), filter=lambda record: record['name'] != __name__)
+    atexit.register(_sink.stop)
+    return _sink
+
+
+def _after_fork():
+    if _sink is not None:
+        _sink._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -5,13 +5,17 @@ import yaml
 import time
 import signal
 import sys
+from datetime import datetime, timedelta
 from loguru import logger
 from pathlib import Path
 
 from database import db
-from parser import AvitoParser
-from publisher import VKPublisher
-from telegram_publisher import TelegramPublisher
+from pipeline import CrawlPipeline
+import metrics
+import jobs
+import log_sink
+import leases
+from jobs import JobConflict
 
 
 class AvitoParserApp:
@@ -22,31 +26,44 @@ class AvitoParserApp:
         self._setup_logging()
         self._setup_signal_handlers()
         
-        # Инициализация БД
+        # Инициализация БД (SQLite или PostgreSQL из секции database)
+        db.configure(self.config.get('database'))
         db.init_db()
         
-        # Инициализация компонентов
-        self.parser = AvitoParser(self.config)
-        
-        # VK Publisher
-        if self.config.get('vk', {}).get('access_token'):
-            self.vk_publisher = VKPublisher(
-                access_token=self.config['vk']['access_token'],
-                group_mappings=self.config['vk']['groups']
-            )
-        else:
-            self.vk_publisher = None
-            logger.warning("VK токен не настроен, публикация в VK отключена")
-        
-        # Telegram Publisher
-        if self.config.get('telegram', {}).get('bot_token'):
-            self.tg_publisher = TelegramPublisher(
-                bot_token=self.config['telegram']['bot_token'],
-                channel_mappings=self.config['telegram']['channels']
-            )
-        else:
-            self.tg_publisher = None
-            logger.warning("Telegram бот не настроен, публикация в TG отключена")
+        # Логи в таблицу logs (/api/logs) - в фоне, пачками
+        log_sink.install(self.config)
+        
+        # Метрики Prometheus (/metrics на отдельном порту)
+        metrics_port = self.config.get('metrics', {}).get('port')
+        if metrics_port:
+            metrics.start_http_server(int(metrics_port))
+            logger.info(f"📈 Метрики: http://0.0.0.0:{metrics_port}/metrics")
+        
+        # Парсер и публикаторы (общий конвейер с Dashboard API); парсер, vk_api и
+        # telegram загружаются при первом использовании, а не при старте
+        self.pipeline = CrawlPipeline(self.config)
+        
+        # Единицы (api_units): общие ссылки грузятся один раз на цикл
+        self.unit_crawler = None
+        if self.config.get('units', {}).get('enabled'):
+            from unit_crawler import UnitCrawler
+            self.unit_crawler = UnitCrawler(self.pipeline)
+        
+        # Архивация старых объявлений и логов (раз в retention.interval_hours)
+        self.retention = None
+        if self.config.get('retention', {}).get('enabled'):
+            from retention import RetentionManager
+            self.retention = RetentionManager(self.config)
+        
+        # Статистика цен: пересборка скетчей по объявлениям (раз в price_stats.rebuild_hours)
+        import price_stats
+        self.price_stats = price_stats.get_stats(self.config)
+        self.current_job = None
+        
+        # Несколько узлов на одну БД: источники делятся арендами (distributed.enabled)
+        self.leases = leases.create_manager(self.config)
+        if self.leases:
+            self.leases.start()
         
         logger.info("✅ Приложение инициализировано")
     
@@ -91,6 +108,9 @@ class AvitoParserApp:
         """Обработка Ctrl+C и завершения"""
         logger.warning(f"Получен сигнал {signum}, завершаем работу...")
         self.running = False
+        # Текущий цикл остановится на ближайшей странице
+        if self.current_job:
+            self.current_job.cancel()
     
     def run_cycle(self):
         """Один цикл парсинга и публикации"""
@@ -98,56 +118,92 @@ class AvitoParserApp:
         logger.info("🚀 Запуск цикла парсинга")
         logger.info("=" * 60)
         
+        # Второй экземпляр main.py не должен парсить параллельно (узлы - каждый свой цикл)
+        key = self.leases.cycle_key if self.leases else 'cycle'
         try:
-            # Парсим каждую активную ссылку
-            for source in self.config['sources']:
-                if not source.get('enabled', True):
-                    logger.info(f"⏭️ Пропущена (отключена): {source['url']}")
-                    continue
-                
-                logger.info(f"🔍 Парсинг: {source['url']}")
-                
-                # Парсинг
-                max_pages = self.config['parser'].get('max_pages', 3)
-                raw_announcements = self.parser.parse_listing_page(source['url'], max_pages)
-                
-                if not raw_announcements:
-                    logger.warning("Не найдено объявлений")
-                    continue
-                
-                # Фильтрация
-                stop_words = self.config.get('stop_words', [])
-                filtered_announcements = self.parser.filter_announcements(raw_announcements, stop_words)
-                
-                # Сохранение в БД
-                category = source.get('category', 'general')
-                stats = self.parser.save_to_db(filtered_announcements, category)
-                
-                logger.info(f"📊 Статистика: {stats}")
-            
-            # Собираем подписи для категорий
-            signatures = {}
-            for source in self.config['sources']:
-                category = source.get('category', 'general')
-                signature = source.get('signature', '')
-                signatures[category] = signature
-            
-            # Публикация в VK
-            if self.vk_publisher:
-                logger.info("📤 Публикация в VK...")
-                vk_stats = self.vk_publisher.publish_announcements(signatures)
-                logger.info(f"📊 VK: {vk_stats}")
-            
-            # Публикация в Telegram
-            if self.tg_publisher:
-                logger.info("📤 Публикация в Telegram...")
-                tg_stats = self.tg_publisher.publish_announcements(signatures)
-                logger.info(f"📊 Telegram: {tg_stats}")
-            
-            logger.success("✅ Цикл завершён успешно")
+            pages_total = self.pipeline.pages_total()
+            if self.unit_crawler:
+                pages_total += self.unit_crawler.pages_total()
+            job = jobs.get_registry().start('cycle', key=key, pages_total=pages_total)
+        except JobConflict as e:
+            logger.warning(f"⏭️ Цикл пропущен: {e}")
+            return
+        
+        self.current_job = job
+        try:
+            stats = self.pipeline.run(job=job, leases=self.leases)
+            if self.unit_crawler and not job.cancelled:
+                stats['units'] = self.run_units(job)
+            if job.cancelled:
+                job.finish("cancelled")
+            else:
+                job.finish()
+                logger.success(f"✅ Цикл завершён успешно: {stats}")
             
         except Exception as e:
+            job.fail(str(e))
             logger.error(f"❌ Ошибка в цикле: {e}", exc_info=True)
+        finally:
+            self.current_job = None
+    
+    def run_units(self, job):
+        """Ссылки единиц - целиком на одном узле за раз"""
+        if self.leases and not self.leases.acquire('task:units'):
+            logger.info("⏭️ Единицы обходит другой узел")
+            return {}
+        try:
+            return self.unit_crawler.run(job=job)
+        finally:
+            if self.leases:
+                self.leases.complete('task:units')
+    
+    def run_retention(self):
+        """Архивация старых данных, если с прошлого прохода прошло interval_hours"""
+        if not self.retention:
+            return
+        
+        last = jobs.get_registry().last('retention')
+        if last and datetime.fromisoformat(last['created_at']) > datetime.now() - timedelta(hours=self.retention.interval_hours):
+            return
+        
+        try:
+            job = jobs.get_registry().start('retention', key='retention')
+        except JobConflict:
+            return
+        
+        self.current_job = job
+        try:
+            self.retention.run(job=job)
+            job.finish("cancelled" if job.cancelled else "done")
+        except Exception as e:
+            job.fail(str(e))
+            logger.error(f"❌ Ошибка архивации: {e}", exc_info=True)
+        finally:
+            self.current_job = None
+    
+    def run_price_stats(self):
+        """Пересборка статистики цен, если с прошлой прошло rebuild_hours"""
+        if not self.price_stats:
+            return
+        
+        last = jobs.get_registry().last('price_stats')
+        if last and datetime.fromisoformat(last['created_at']) > datetime.now() - timedelta(hours=self.price_stats.rebuild_hours):
+            return
+        
+        try:
+            job = jobs.get_registry().start('price_stats', key='price_stats')
+        except JobConflict:
+            return
+        
+        self.current_job = job
+        try:
+            self.price_stats.rebuild()
+            job.finish("done")
+        except Exception as e:
+            job.fail(str(e))
+            logger.error(f"❌ Ошибка пересборки статистики цен: {e}", exc_info=True)
+        finally:
+            self.current_job = None
     
     def run(self):
         """Главный цикл работы"""
@@ -158,6 +214,8 @@ class AvitoParserApp:
         
         # Первый запуск сразу
         self.run_cycle()
+        self.run_retention()
+        self.run_price_stats()
         
         # Затем по расписанию
         while self.running:
@@ -172,6 +230,8 @@ class AvitoParserApp:
                 
                 if self.running:
                     self.run_cycle()
+                    self.run_retention()
+                    self.run_price_stats()
                     
             except KeyboardInterrupt:
                 logger.warning("Получен Ctrl+C, завершаем...")
@@ -181,6 +241,8 @@ class AvitoParserApp:
                 logger.info("Повторный запуск через 60 секунд...")
                 time.sleep(60)
         
+        if self.leases:
+            self.leases.stop()
         logger.info("👋 Приложение остановлено")
 
 
@@ -0,0 +1,230 @@
+"""
+Метрики в формате Prometheus - счётчики и гистограммы по этапам парсинга, БД и публикации
+"""
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics: List["_Metric"] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: "_Metric"):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus"""
+        with self._lock:
+            metrics = list(self._metrics)
+        return "".join(metric.render() for metric in metrics)
+
+
+REGISTRY = Registry()
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def labels(self, **labels):
+        """Дочерняя метрика для набора меток"""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+            return child
+
+    def _default(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name}: нужны метки {self.labelnames}")
+        return self.labels()
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            lines.extend(child.samples(self.name, dict(zip(self.labelnames, key))))
+        return "\n".join(lines) + "\n"
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name: str, labels: Dict[str, str]) -> List[str]:
+        return [f"{name}{_format_labels(labels)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    """Монотонный счётчик"""
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    @contextmanager
+    def time(self):
+        """Замер длительности блока в секундах"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self, name: str, labels: Dict[str, str]) -> List[str]:
+        lines = []
+        cumulative = 0
+        with self._lock:
+            for bound, count in zip(self.buckets, self.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(dict(labels, le=_format_value(bound)))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(dict(labels, le='+Inf'))} {self.count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(self.sum)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {self.count}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Гистограмма длительностей"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS, registry: Registry = REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+
+def proxy_label(proxy: Optional[str]) -> str:
+    """Метка прокси без логина/пароля: host:port или direct"""
+    if not proxy:
+        return "direct"
+    parts = urlsplit(proxy)
+    if not parts.hostname:
+        return proxy
+    return f"{parts.hostname}:{parts.port}" if parts.port else parts.hostname
+
+
+# ===== МЕТРИКИ =====
+
+FETCH_SECONDS = Histogram("avito_fetch_seconds", "Время загрузки страницы листинга", ("proxy",))
+FETCH_ERRORS = Counter("avito_fetch_errors_total", "Ошибки загрузки страниц", ("proxy",))
+PARSE_SECONDS = Histogram("avito_parse_page_seconds", "Время разбора одной страницы", ("parser",))
+ADS_TOTAL = Counter("avito_ads_total", "Объявления по этапам: scraped/filtered/new/duplicate/updated", ("stage",))
+HTTP_CACHE_TOTAL = Counter("avito_http_cache_total", "HTTP кеш листингов: hit/miss", ("result",))
+HTTP_CACHE_BYTES_SAVED = Counter("avito_http_cache_bytes_saved_total", "Байт не скачано благодаря 304")
+DB_COMMIT_SECONDS = Histogram("avito_db_commit_seconds", "Время коммита в БД", ("operation",))
+PUBLISH_SECONDS = Histogram("avito_publish_seconds", "Время публикации поста", ("destination",))
+PUBLISH_TOTAL = Counter("avito_publish_total", "Публикации по результату", ("destination", "result"))
+ENRICH_TOTAL = Counter("avito_enrich_total", "Карточки объявлений: cached/fetched/gone/failed/skipped", ("result",))
+IMAGE_HASH_TOTAL = Counter("avito_image_hash_total", "Хеши фото: hashed/duplicate/dealer/no_image/failed", ("result",))
+API_CACHE_TOTAL = Counter("avito_api_cache_total", "Кеш ответов API: hit/miss/not_modified", ("endpoint", "result"))
+LEASE_TOTAL = Counter("avito_lease_total", "Аренды источников: acquired/busy/taken_over/completed/released/lost", ("result",))
+
+
+# ===== ЭКСПОЗИЦИЯ =====
+
+def install(app, path: str = "/metrics"):
+    """Добавить эндпоинт метрик во Flask-приложение"""
+    from flask import Response
+
+    def metrics_endpoint():
+        return Response(REGISTRY.render(), mimetype=CONTENT_TYPE)
+
+    app.add_url_rule(path, "metrics", metrics_endpoint)
+
+
+def start_http_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Отдельный HTTP-сервер /metrics для main.py (в фоновом потоке)"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            data = REGISTRY.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
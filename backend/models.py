@@ -1,7 +1,7 @@
 """
 Database models for Avito Parser MVP
 """
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Text, JSON
+from sqlalchemy import BigInteger, Column, Integer, String, Float, Boolean, DateTime, Text, JSON, Index, text, ForeignKey, UniqueConstraint, or_
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 from datetime import datetime
@@ -16,7 +16,9 @@ class Announcement(Base):
     __tablename__ = "announcements"
 
     id = Column(Integer, primary_key=True, index=True)
-    avito_id = Column(String, unique=True, index=True, nullable=False)
+    # Тенант (пользователь): 0 - однопользовательский режим
+    user_id = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    avito_id = Column(String, nullable=False)  # Уникален в пределах пользователя
     
     # Основные данные
     title = Column(String, nullable=False)
@@ -29,24 +31,46 @@ class Announcement(Base):
     image_urls = Column(JSON)  # Список URL картинок
     author_type = Column(String)  # private или business
     location = Column(String)
+    city = Column(String, nullable=True)  # Слаг города источника (vorkuta)
     
     # Дедупликация
-    content_hash = Column(String, index=True)  # SHA256 хеш для дедупликации
+    content_hash = Column(String)  # SHA256 хеш для дедупликации
     
     # Статус
     status = Column(String, default="new")  # new, published, filtered, duplicate
     published_to_vk = Column(Boolean, default=False)
+    # Найдено только ссылками единиц (unit_crawler) - в общие группы категорий не публикуется
+    unit_only = Column(Boolean, default=False)
     vk_post_id = Column(String, nullable=True)
     
     # Timestamps
     first_seen_at = Column(DateTime, default=func.now())
     last_price = Column(Float)
+    # Место цены среди виденных в категории и городе при сохранении/смене цены, 0-100 (price_stats)
+    price_percentile = Column(Float, nullable=True)
     last_updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     created_at = Column(DateTime, default=func.now())
 
+    # Все индексы начинаются с user_id - запросы одного пользователя не сканируют чужие данные
+    __table_args__ = (
+        Index("uq_announcements_user_avito", "user_id", "avito_id", unique=True),
+        Index("ix_announcements_user_created", "user_id", "created_at"),
+        Index("ix_announcements_user_updated", "user_id", "last_updated_at"),  # Версия для кеша API
+        Index("ix_announcements_user_status_created", "user_id", "status", "created_at"),
+        Index("ix_announcements_user_vk_status", "user_id", "published_to_vk", "status"),
+        Index("ix_announcements_user_category", "user_id", "category"),
+        Index("ix_announcements_user_city", "user_id", "city"),
+        Index("ix_announcements_user_hash", "user_id", "content_hash"),
+    )
+
     def __repr__(self):
         return f"<Announcement {self.avito_id}: {self.title[:30]}...>"
 
+    @classmethod
+    def in_global_feed(cls):
+        """Условие для общих публикаторов: не только из ссылок единиц (NULL - строки до колонки)"""
+        return or_(cls.unit_only == False, cls.unit_only.is_(None))
+
     @staticmethod
     def generate_hash(avito_id: str, title: str, description: str = "") -> str:
         """Генерация хеша для дедупликации"""
@@ -57,15 +81,18 @@ class Announcement(Base):
         """Сериализация в dict"""
         return {
             "id": self.id,
+            "user_id": self.user_id,
             "avito_id": self.avito_id,
             "title": self.title,
             "description": self.description,
             "price": self.price,
+            "price_percentile": self.price_percentile,
             "category": self.category,
             "url": self.url,
             "image_urls": self.image_urls,
             "author_type": self.author_type,
             "location": self.location,
+            "city": self.city,
             "status": self.status,
             "published_to_vk": self.published_to_vk,
             "first_seen_at": self.first_seen_at.isoformat() if self.first_seen_at else None,
@@ -84,5 +111,286 @@ class Log(Base):
     details = Column(JSON, nullable=True)
     created_at = Column(DateTime, default=func.now())
 
+    __table_args__ = (
+        Index("ix_logs_created", "created_at"),  # /api/logs и retention - по времени
+    )
+
     def __repr__(self):
         return f"<Log [{self.level}] {self.service}: {self.message[:50]}...>"
+
+
+class ProxySession(Base):
+    """Сессия (cookies, User-Agent) для прокси - общая для requests и Playwright"""
+    __tablename__ = "proxy_sessions"
+
+    identity = Column(String, primary_key=True)  # session_store.identity_for: host:port[#хеш] или "direct"
+    cookies = Column(JSON)  # Список cookies в формате Playwright
+    user_agent = Column(String)
+    last_captcha_at = Column(DateTime, nullable=True)
+    captcha_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<ProxySession {self.identity}: {len(self.cookies or [])} cookies>"
+
+
+class Job(Base):
+    """Задача парсинга (цикл, наполнение) - состояние и прогресс для Dashboard"""
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)  # cycle, fill
+    key = Column(String, nullable=False)  # Одновременно активна только одна задача с таким ключом
+    state = Column(String, default="running")  # queued, running, done, failed, cancelled
+    params = Column(JSON, nullable=True)
+
+    # Прогресс
+    current_source = Column(String, nullable=True)
+    pages_done = Column(Integer, default=0)
+    pages_total = Column(Integer, default=0)
+    ads_new = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    pid = Column(Integer, nullable=True)
+    cancel_requested = Column(Boolean, default=False)  # Отмена из другого процесса (воркера API)
+
+    # Timestamps
+    created_at = Column(DateTime, default=func.now())
+    started_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Дубликаты отсекает сама БД (работает между процессами)
+        Index(
+            "uq_jobs_active_key", "key", unique=True,
+            sqlite_where=text("state IN ('queued', 'running')"),
+            postgresql_where=text("state IN ('queued', 'running')"),
+        ),
+        Index("ix_jobs_kind_created", "kind", "created_at"),
+    )
+
+    ACTIVE_STATES = ("queued", "running")
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.kind}:{self.key} [{self.state}]>"
+
+    @property
+    def eta_seconds(self):
+        """Оценка оставшегося времени по скорости обработки страниц"""
+        if self.state != "running" or not self.started_at or not self.pages_done or not self.pages_total:
+            return None
+        elapsed = (datetime.now() - self.started_at).total_seconds()
+        remaining = max(self.pages_total - self.pages_done, 0)
+        return round(elapsed / self.pages_done * remaining)
+
+    def to_dict(self):
+        """Сериализация в dict"""
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "key": self.key,
+            "state": self.state,
+            "params": self.params,
+            "current_source": self.current_source,
+            "pages_done": self.pages_done,
+            "pages_total": self.pages_total,
+            "ads_new": self.ads_new,
+            "eta_seconds": self.eta_seconds,
+            "error": self.error,
+            "cancel_requested": bool(self.cancel_requested),
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class UnitAnnouncement(Base):
+    """Объявление в ленте единицы (unit) - своя отметка публикации для каждой группы/канала"""
+    __tablename__ = "unit_announcements"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    unit_id = Column(Integer, nullable=False)  # units.id (таблица api_units)
+    announcement_id = Column(Integer, ForeignKey("announcements.id", ondelete="CASCADE"), nullable=False)
+    signature = Column(String, nullable=True)  # Подпись ссылки единицы
+
+    published_to_vk = Column(Boolean, default=False)
+    vk_post_id = Column(String, nullable=True)
+    published_to_tg = Column(Boolean, default=False)
+    tg_message_id = Column(String, nullable=True)
+
+    created_at = Column(DateTime, default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("unit_id", "announcement_id", name="uq_unit_announcement"),
+        Index("ix_unit_announcements_unpublished", "user_id", "unit_id", "published_to_vk", "published_to_tg"),
+    )
+
+    def __repr__(self):
+        return f"<UnitAnnouncement unit={self.unit_id} ann={self.announcement_id}>"
+
+
+class ArchivedAnnouncement(Base):
+    """Объявление, перенесённое в архив (retention) - avito_id остаётся виденным для дедупликации"""
+    __tablename__ = "archived_announcements"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    avito_id = Column(String, nullable=False)
+    content_hash = Column(String)
+    archive_path = Column(String)  # Файл архива относительно retention.archive_dir
+    archived_at = Column(DateTime, default=func.now())
+
+    __table_args__ = (
+        Index("uq_archived_user_avito", "user_id", "avito_id", unique=True),
+    )
+
+    def __repr__(self):
+        return f"<ArchivedAnnouncement {self.avito_id} -> {self.archive_path}>"
+
+
+class PriceChange(Base):
+    """
+    Изменение цены объявления (append-only)
+
+    Хранятся только изменения, не каждое наблюдение; цены - целые рубли, время - unix
+    секунды. Таблица без rowid, кластеризована по (announcement_id, changed_at):
+    история одного объявления читается подряд без отдельного индекса.
+    """
+    __tablename__ = "price_changes"
+
+    announcement_id = Column(Integer, ForeignKey("announcements.id", ondelete="CASCADE"), primary_key=True)
+    changed_at = Column(Integer, primary_key=True)  # Unix time
+    user_id = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    category = Column(String)  # Копия из объявления - для "снижения цен в категории"
+    price = Column(Integer, nullable=False)  # Новая цена
+    delta = Column(Integer)  # Новая - прежняя (отрицательная - снижение), None - цены раньше не было
+
+    __table_args__ = (
+        Index("ix_price_changes_user_category_time", "user_id", "category", "changed_at"),
+        {"sqlite_with_rowid": False},
+    )
+
+    def __repr__(self):
+        delta = f"{self.delta:+}" if self.delta is not None else "?"  # Цены раньше не было
+        return f"<PriceChange ann={self.announcement_id} {self.price} ({delta})>"
+
+
+class ImageHash(Base):
+    """
+    Перцептивный хеш (dHash) первой картинки объявления
+
+    64 бита в BigInteger со знаком; hash = None - картинки нет или она не читается
+    (объявление больше не проверяется). Поиск похожих - в памяти (image_hash.HashIndex).
+    """
+    __tablename__ = "image_hashes"
+
+    announcement_id = Column(Integer, ForeignKey("announcements.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    hash = Column(BigInteger)
+    matches = Column(Integer, default=0)  # Объявлений с похожим фото на момент проверки
+    created_at = Column(DateTime, default=func.now())
+
+    __table_args__ = (
+        Index("ix_image_hashes_user_hash", "user_id", "hash"),
+        Index("ix_image_hashes_user_created", "user_id", "created_at"),  # Дочитка индекса (get_index)
+    )
+
+    def __repr__(self):
+        return f"<ImageHash ann={self.announcement_id} {self.hash}>"
+
+
+class PriceSketch(Base):
+    """
+    Квантильный скетч (t-digest) цен категории в городе - price_stats.PriceStats
+
+    sketch - центроиды {means, weights, min, max}; built_at - последняя пересборка по
+    объявлениям, updated_at - последнее добавление цен при сохранении.
+    """
+    __tablename__ = "price_sketches"
+
+    user_id = Column(Integer, primary_key=True, default=0, server_default=text("0"))
+    category = Column(String, primary_key=True)  # '' - без категории
+    city = Column(String, primary_key=True)  # '' - без города
+    count = Column(Integer, nullable=False, default=0)
+    sketch = Column(JSON, nullable=False)
+    built_at = Column(Integer, nullable=False)  # Unix time
+    updated_at = Column(Integer, nullable=False)  # Unix time
+
+    def __repr__(self):
+        return f"<PriceSketch {self.category}/{self.city}: {self.count}>"
+
+
+class CrawlNode(Base):
+    """
+    Узел парсера (main.py) в распределённом обходе - leases.LeaseManager
+
+    capacity - вес узла в распределении источников (обычно по числу его прокси);
+    узел без heartbeat дольше distributed.node_timeout считается упавшим.
+    Время - UTC.
+    """
+    __tablename__ = "crawl_nodes"
+
+    user_id = Column(Integer, primary_key=True, default=0, server_default=text("0"))
+    node_id = Column(String, primary_key=True)
+    capacity = Column(Integer, nullable=False, default=1)
+    hostname = Column(String, nullable=True)
+    pid = Column(Integer, nullable=True)
+    state = Column(String, nullable=False, default="active")  # active, stopped
+    started_at = Column(DateTime, nullable=False)
+    heartbeat_at = Column(DateTime, nullable=False)
+
+    def to_dict(self):
+        """Сериализация в dict"""
+        return {
+            "node_id": self.node_id,
+            "capacity": self.capacity,
+            "hostname": self.hostname,
+            "pid": self.pid,
+            "state": self.state,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "heartbeat_at": self.heartbeat_at.isoformat() if self.heartbeat_at else None,
+        }
+
+    def __repr__(self):
+        return f"<CrawlNode {self.node_id} x{self.capacity} [{self.state}]>"
+
+
+class SourceLease(Base):
+    """
+    Аренда источника (город/раздел) узлом - только арендатор его обходит
+
+    node_id - текущий арендатор (NULL - свободен); аренда продлевается heartbeat'ом
+    узла, истёкшую забирает другой узел. crawled_at - последний завершённый обход
+    (по нему источник снова становится к обходу). Время - UTC.
+    """
+    __tablename__ = "source_leases"
+
+    user_id = Column(Integer, primary_key=True, default=0, server_default=text("0"))
+    source_key = Column(String, primary_key=True)  # vorkuta/kvartiry; task:publish - задачи цикла
+    node_id = Column(String, nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+    acquired_at = Column(DateTime, nullable=True)
+    crawled_at = Column(DateTime, nullable=True)
+    crawled_by = Column(String, nullable=True)
+    failures = Column(Integer, nullable=False, default=0)  # Обходов подряд, прерванных ошибкой
+
+    __table_args__ = (
+        Index("ix_source_leases_user_node", "user_id", "node_id"),
+    )
+
+    def to_dict(self):
+        """Сериализация в dict"""
+        return {
+            "source_key": self.source_key,
+            "node_id": self.node_id,
+            "expires_at": self.expires_at.isoformat() if self.expires_at else None,
+            "acquired_at": self.acquired_at.isoformat() if self.acquired_at else None,
+            "crawled_at": self.crawled_at.isoformat() if self.crawled_at else None,
+            "crawled_by": self.crawled_by,
+            "failures": self.failures,
+        }
+
+    def __repr__(self):
+        return f"<SourceLease {self.source_key} -> {self.node_id}>"
@@ -3,12 +3,22 @@ Avito Parser - парсинг объявлений
 """
 import requests
 from bs4 import BeautifulSoup
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
 import time
 import re
 from loguru import logger
 from models import Announcement
-from database import db
+from tenancy import tenant_id, tenant_db
+from retention import archived_ids
+from rules import compile_rules, merge as merge_rules
+import price_history
+import price_stats
+from http_cache import create_cache
+from session_store import SessionStore, DIRECT
+from metrics import FETCH_SECONDS, FETCH_ERRORS, PARSE_SECONDS, ADS_TOTAL, DB_COMMIT_SECONDS
+
+# Прежний жёсткий фильтр - только бизнес-аккаунты (цена и описание не проверяются)
+BASE_RULES = {'exclude_author_types': ['business']}
 
 
 class AvitoParser:
@@ -20,9 +30,20 @@ class AvitoParser:
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
             'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
         })
+        self.cache = create_cache(config)
+        
+        # Тенант: чьи это объявления и в какой БД они лежат
+        self.user_id = tenant_id(config)
+        self.db = tenant_db(config)
+        self.price_stats = price_stats.get_stats(config, self.db)
+        self.page_delay = config.get('parser', {}).get('page_delay', 2)
+        
+        # Cookies и User-Agent прогретой сессии (в т.ч. после капчи в браузере)
+        self.session_store = SessionStore()
+        self.session_store.load_into_requests(self.session, DIRECT)
         
-    def parse_listing_page(self, url: str, max_pages: int = 3) -> List[Dict]:
-        """Парсинг страницы списка объявлений"""
+    def parse_listing_page(self, url: str, max_pages: int = 3, on_page: Callable[[int], Optional[bool]] = None) -> List[Dict]:
+        """Парсинг страницы списка объявлений (on_page(номер) - после каждой страницы, False останавливает обход)"""
         announcements = []
         
         for page in range(1, max_pages + 1):
@@ -30,36 +51,62 @@ class AvitoParser:
             logger.info(f"Парсинг страницы {page}: {page_url}")
             
             try:
-                response = self.session.get(page_url, timeout=30)
-                response.raise_for_status()
+                with FETCH_SECONDS.labels(proxy=DIRECT).time():
+                    if self.cache:
+                        response, unchanged = self.cache.fetch(self.session, page_url, timeout=30)
+                    else:
+                        response, unchanged = self.session.get(page_url, timeout=30), False
                 
-                soup = BeautifulSoup(response.text, 'html.parser')
+                if unchanged:
+                    logger.info(f"Страница {page} не изменилась, пропускаем парсинг")
+                    if on_page and on_page(page) is False:
+                        break
+                    if page < max_pages:
+                        time.sleep(self.page_delay)
+                    continue
                 
-                # Ищем объявления (Avito меняет классы, это базовая версия)
-                items = soup.find_all('div', {'data-marker': 'item'})
+                response.raise_for_status()
+                
+                with PARSE_SECONDS.labels(parser='AvitoParser').time():
+                    soup = BeautifulSoup(response.text, 'html.parser')
+                    
+                    # Ищем объявления (Avito меняет классы, это базовая версия)
+                    items = soup.find_all('div', {'data-marker': 'item'})
+                    
+                    for item in items:
+                        try:
+                            announcement = self._parse_item(item)
+                            if announcement:
+                                announcements.append(announcement)
+                        except Exception as e:
+                            logger.error(f"Ошибка парсинга объявления: {e}")
+                            continue
                 
                 if not items:
                     logger.warning(f"Не найдено объявлений на странице {page}")
                     break
                 
-                for item in items:
-                    try:
-                        announcement = self._parse_item(item)
-                        if announcement:
-                            announcements.append(announcement)
-                    except Exception as e:
-                        logger.error(f"Ошибка парсинга объявления: {e}")
-                        continue
+                if self.cache:
+                    self.cache.store(page_url, response)
+                
+                if on_page and on_page(page) is False:
+                    break
                 
                 # Задержка между страницами
                 if page < max_pages:
-                    time.sleep(2)
+                    time.sleep(self.page_delay)
                     
             except Exception as e:
+                FETCH_ERRORS.labels(proxy=DIRECT).inc()
                 logger.error(f"Ошибка загрузки страницы {page}: {e}")
                 break
         
+        ADS_TOTAL.labels(stage='scraped').inc(len(announcements))
+        self.session_store.save_from_requests(self.session, DIRECT)
+        
         logger.info(f"Найдено {len(announcements)} объявлений")
+        if self.cache:
+            logger.debug(f"HTTP кеш: {self.cache.get_stats()}")
         return announcements
     
     def _parse_item(self, item) -> Optional[Dict]:
@@ -132,78 +179,113 @@ class AvitoParser:
         except:
             return None
     
-    def filter_announcements(self, announcements: List[Dict], stop_words: List[str]) -> List[Dict]:
-        """Фильтрация объявлений"""
-        filtered = []
-        
-        for ann in announcements:
-            # Пропускаем бизнес объявления
-            if ann.get('author_type') == 'business':
-                logger.debug(f"Пропущено (бизнес): {ann['title']}")
-                continue
-            
-            # Проверяем стоп-слова
-            text_to_check = f"{ann.get('title', '')} {ann.get('description', '')}".lower()
-            if any(word.lower() in text_to_check for word in stop_words):
-                logger.debug(f"Пропущено (стоп-слово): {ann['title']}")
-                continue
-            
-            filtered.append(ann)
+    def filter_announcements(self, announcements: List[Dict], stop_words: List[str],
+                             rules: Dict = None) -> List[Dict]:
+        """Фильтрация объявлений: бизнес, стоп-слова и правила (rules.py) из config.yaml"""
+        spec = merge_rules(BASE_RULES, rules, {'exclude': list(stop_words or [])})
+        filtered = compile_rules(spec).select(announcements)
         
+        ADS_TOTAL.labels(stage='filtered').inc(len(announcements) - len(filtered))
         logger.info(f"После фильтрации осталось {len(filtered)} объявлений")
         return filtered
     
     def save_to_db(self, announcements: List[Dict], category: str) -> Dict[str, int]:
         """Сохранение в БД с дедупликацией"""
         stats = {'new': 0, 'duplicate': 0, 'updated': 0}
-        session = db.get_session()
+        session = self.db.get_session()
         
         try:
+            # Уже сохранённые - одним запросом на пачку
+            avito_ids = [ann_data['avito_id'] for ann_data in announcements]
+            known = {
+                ann.avito_id: ann
+                for ann in session.query(Announcement).filter(
+                    Announcement.user_id == self.user_id, Announcement.avito_id.in_(avito_ids))
+            }
+            # Ушедшие в архив (retention) тоже уже виденные
+            archived = archived_ids(session, self.user_id, [i for i in avito_ids if i not in known])
+            new_rows = {}  # avito_id -> строка: повтор в той же пачке - дубль
+            price_changes = []
+            
             for ann_data in announcements:
                 avito_id = ann_data['avito_id']
-                
-                # Проверяем существует ли
-                existing = session.query(Announcement).filter_by(avito_id=avito_id).first()
+                existing = known.get(avito_id)
                 
                 if existing:
                     # Проверяем изменилась ли цена
                     new_price = ann_data.get('price')
-                    if new_price and existing.price != new_price:
-                        existing.price = new_price
+                    change = price_history.change_row(existing, new_price) if new_price else None
+                    if change:
+                        price_changes.append(change)
                         existing.last_price = existing.price
+                        existing.price = new_price
                         existing.status = 'updated'
+                        if self.price_stats:
+                            # Прежняя цена уже в скетче - новая попадёт в него при пересборке
+                            existing.price_percentile = self.price_stats.percentile(
+                                existing.category, existing.city, new_price)
                         stats['updated'] += 1
-                        logger.info(f"Обновлена цена: {existing.title} ({existing.price} → {new_price})")
+                        logger.info(f"Обновлена цена: {existing.title} ({existing.last_price} → {new_price})")
                     else:
                         stats['duplicate'] += 1
+                elif avito_id in archived or avito_id in new_rows:
+                    stats['duplicate'] += 1
                 else:
                     # Новое объявление
-                    announcement = Announcement(
-                        avito_id=avito_id,
-                        title=ann_data.get('title'),
-                        description=ann_data.get('description'),
-                        price=ann_data.get('price'),
-                        category=category,
-                        url=ann_data.get('url'),
-                        image_urls=ann_data.get('image_urls'),
-                        author_type=ann_data.get('author_type'),
-                        location=ann_data.get('location'),
-                        content_hash=Announcement.generate_hash(
+                    row = {
+                        'user_id': self.user_id,
+                        'avito_id': avito_id,
+                        'title': ann_data.get('title'),
+                        'description': ann_data.get('description'),
+                        'price': ann_data.get('price'),
+                        'category': category,
+                        'url': ann_data.get('url'),
+                        'image_urls': ann_data.get('image_urls'),
+                        'author_type': ann_data.get('author_type'),
+                        'location': ann_data.get('location'),
+                        'city': ann_data.get('city'),
+                        'content_hash': Announcement.generate_hash(
                             avito_id, 
                             ann_data.get('title', ''), 
                             ann_data.get('description', '')
                         ),
-                        status='new'
+                        'status': 'new',
+                        'unit_only': bool(ann_data.get('unit_only')),
+                    }
+                    # Место цены на рынке категории - до того, как она сама попадёт в статистику
+                    row['price_percentile'] = (
+                        self.price_stats.percentile(row['category'], row['city'], row['price'])
+                        if self.price_stats else None
                     )
-                    session.add(announcement)
-                    stats['new'] += 1
-                    logger.info(f"Новое объявление: {announcement.title}")
+                    new_rows[avito_id] = row
+                    logger.info(f"Новое объявление: {row['title']}")
+            
+            # Новые - одной пачкой; то, что успел вставить другой воркер, отсекает ON CONFLICT
+            inserted = self.db.insert(session, Announcement, list(new_rows.values()),
+                                      conflict=('user_id', 'avito_id'), returning='avito_id')
+            stats['new'] = len(inserted)
+            stats['duplicate'] += len(new_rows) - len(inserted)
+            if self.price_stats:
+                # В скетч - только вставленные: строки, проигравшие гонку, учёл другой воркер
+                for avito_id in inserted:
+                    row = new_rows[avito_id]
+                    self.price_stats.add(row['category'], row['city'], row['price'])
+            # История цен - только изменения, той же пачкой
+            price_history.record(self.db, session, price_changes)
+            if self.price_stats:
+                self.price_stats.flush(session)
+            
+            with DB_COMMIT_SECONDS.labels(operation='save_announcements').time():
+                session.commit()
             
-            session.commit()
+            for stage, count in stats.items():
+                ADS_TOTAL.labels(stage=stage).inc(count)
             logger.info(f"Статистика: новых={stats['new']}, дублей={stats['duplicate']}, обновлено={stats['updated']}")
             
         except Exception as e:
             session.rollback()
+            if self.price_stats:
+                self.price_stats.discard()  # В памяти остались цены неудавшейся пачки
             logger.error(f"Ошибка сохранения в БД: {e}")
         finally:
             session.close()
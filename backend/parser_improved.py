@@ -3,13 +3,20 @@
 """
 import requests
 from bs4 import BeautifulSoup
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
 import time
 import re
 import random
 from loguru import logger
 from models import Announcement
-from database import db
+from tenancy import tenant_id, tenant_db
+from retention import archived_ids
+from rules import DEFAULT_RULES, compile_rules, merge as merge_rules
+import price_history
+import price_stats
+from http_cache import create_cache
+from session_store import SessionStore, identity_for
+from metrics import FETCH_SECONDS, FETCH_ERRORS, PARSE_SECONDS, ADS_TOTAL, DB_COMMIT_SECONDS, proxy_label
 
 
 class ImprovedAvitoParser:
@@ -17,17 +24,45 @@ class ImprovedAvitoParser:
     
     def __init__(self, config: dict):
         self.config = config
-        self.session = requests.Session()
         self.proxies = config.get('proxies', [])
         self.proxy_index = 0
-        self._setup_session()
+        self.proxy_regions = config.get('parser', {}).get('proxy_regions', {})
+        self.cache = create_cache(config)
         
-    def _setup_session(self):
+        # Тенант: чьи это объявления и в какой БД они лежат
+        self.user_id = tenant_id(config)
+        self.db = tenant_db(config)
+        self.price_stats = price_stats.get_stats(config, self.db)
+        self.page_delay_range = config.get('parser', {}).get('page_delay_range', [1, 3])
+        
+        # Своя сессия (cookies) на каждый прокси
+        self.session_store = SessionStore()
+        self.sessions: Dict[str, requests.Session] = {}
+        self.session = self._get_session(None)
+        
+    def _get_session(self, proxies: Optional[Dict]) -> requests.Session:
+        """Сессия для прокси (cookies подгружаются из хранилища сессий)"""
+        identity = identity_for(proxies['http'] if proxies else None)
+        
+        if identity not in self.sessions:
+            session = requests.Session()
+            self._setup_session(session)
+            self.session_store.load_into_requests(session, identity)
+            self.sessions[identity] = session
+        
+        return self.sessions[identity]
+    
+    def _save_sessions(self):
+        """Сохранить cookies всех сессий"""
+        for identity, session in self.sessions.items():
+            self.session_store.save_from_requests(session, identity)
+        
+    def _setup_session(self, session: requests.Session):
         """Настройка сессии с User-Agent и таймаутами"""
         user_agent = self.config.get('parser', {}).get('user_agent') or \
             'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
         
-        self.session.headers.update({
+        session.headers.update({
             'User-Agent': user_agent,
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
             'Accept-Language': 'ru-RU,ru;q=0.9',
@@ -47,8 +82,15 @@ class ImprovedAvitoParser:
         
         return {'http': proxy, 'https': proxy}
     
-    def parse_city(self, city_data: dict, max_pages: int = 3) -> List[Dict]:
-        """Парсинг всех активных ссылок для города"""
+    def _proxy_region(self, proxies: Optional[Dict]) -> str:
+        """Регион прокси для ключа HTTP кеша (разные регионы - разная выдача)"""
+        if not proxies:
+            return 'default'
+        return self.proxy_regions.get(proxies['http'], 'default')
+    
+    def parse_city(self, city_data: dict, max_pages: int = 3,
+                   on_progress: Callable[[str, int], Optional[bool]] = None) -> List[Dict]:
+        """Парсинг всех активных ссылок для города (on_progress(источник, страница) - как on_page)"""
         city_name = city_data['name']
         url_slug = city_data['url_slug']
         announcements = []
@@ -64,7 +106,12 @@ class ImprovedAvitoParser:
             logger.info(f"🔍 {source['category']}: {url}")
             
             try:
-                items = self.parse_listing_page(url, max_pages, source['category'], city_name)
+                on_page = None
+                if on_progress:
+                    label = f"{city_name}/{source['category']}"
+                    on_page = lambda page, label=label: on_progress(label, page)
+                
+                items = self.parse_listing_page(url, max_pages, source['category'], city_name, on_page)
                 announcements.extend(items)
                 
                 # Задержка между категориями (антибан)
@@ -78,8 +125,9 @@ class ImprovedAvitoParser:
         logger.info(f"✅ Город {city_name}: найдено {len(announcements)} объявлений")
         return announcements
     
-    def parse_listing_page(self, url: str, max_pages: int = 3, category: str = "general", city: str = "") -> List[Dict]:
-        """Парсинг страницы списка объявлений с защитой от бана"""
+    def parse_listing_page(self, url: str, max_pages: int = 3, category: str = "general", city: str = "",
+                           on_page: Callable[[int], Optional[bool]] = None) -> List[Dict]:
+        """Парсинг страницы списка объявлений с защитой от бана (on_page(номер) - после каждой страницы, False останавливает обход)"""
         announcements = []
         
         for page in range(1, max_pages + 1):
@@ -88,40 +136,65 @@ class ImprovedAvitoParser:
             try:
                 # Ротация прокси и User-Agent
                 proxies = self._get_next_proxy()
+                proxy_name = proxy_label(proxies['http'] if proxies else None)
                 
                 logger.debug(f"Страница {page}/{max_pages}: {page_url}")
                 
-                response = self.session.get(
-                    page_url,
-                    timeout=self.config.get('parser', {}).get('timeout', 30),
-                    proxies=proxies,
-                    allow_redirects=True
-                )
-                response.raise_for_status()
+                request_kwargs = {
+                    'timeout': self.config.get('parser', {}).get('timeout', 30),
+                    'proxies': proxies,
+                    'allow_redirects': True,
+                }
+                region = self._proxy_region(proxies)
                 
-                soup = BeautifulSoup(response.text, 'html.parser')
+                session = self._get_session(proxies)
                 
-                # Ищем объявления (разные селекторы для разных вариантов вёрстки Авито)
-                items = soup.find_all('div', {'data-marker': 'item'})
+                with FETCH_SECONDS.labels(proxy=proxy_name).time():
+                    if self.cache:
+                        response, unchanged = self.cache.fetch(session, page_url, region, **request_kwargs)
+                    else:
+                        response, unchanged = session.get(page_url, **request_kwargs), False
+                
+                if unchanged:
+                    logger.debug(f"Страница {page} не изменилась, пропускаем парсинг")
+                    if on_page and on_page(page) is False:
+                        break
+                    time.sleep(random.uniform(*self.page_delay_range))
+                    continue
+                
+                response.raise_for_status()
+                
+                with PARSE_SECONDS.labels(parser='ImprovedAvitoParser').time():
+                    soup = BeautifulSoup(response.text, 'html.parser')
+                    
+                    # Ищем объявления (разные селекторы для разных вариантов вёрстки Авито)
+                    items = soup.find_all('div', {'data-marker': 'item'})
+                    
+                    for item in items:
+                        try:
+                            announcement = self._parse_item(item, category, city)
+                            if announcement:
+                                announcements.append(announcement)
+                        except Exception as e:
+                            logger.debug(f"Ошибка парсинга элемента: {e}")
+                            continue
                 
                 if not items:
                     logger.warning(f"Страница {page}: не найдено объявлений (возможно, Авито изменила вёрстку)")
                     break
                 
-                for item in items:
-                    try:
-                        announcement = self._parse_item(item, category, city)
-                        if announcement:
-                            announcements.append(announcement)
-                    except Exception as e:
-                        logger.debug(f"Ошибка парсинга элемента: {e}")
-                        continue
+                if self.cache:
+                    self.cache.store(page_url, response, region)
+                
+                if on_page and on_page(page) is False:
+                    break
                 
                 # Случайная задержка между страницами (антибан)
-                delay = random.uniform(1, 3)
+                delay = random.uniform(*self.page_delay_range)
                 time.sleep(delay)
                 
             except requests.exceptions.ProxyError:
+                FETCH_ERRORS.labels(proxy=proxy_name).inc()
                 logger.warning(f"Ошибка прокси на странице {page}, пробую без прокси")
                 try:
                     response = self.session.get(page_url, timeout=30)
@@ -131,9 +204,12 @@ class ImprovedAvitoParser:
                     logger.error(f"Ошибка без прокси: {e}")
                     break
             except Exception as e:
+                FETCH_ERRORS.labels(proxy=proxy_name).inc()
                 logger.error(f"Ошибка загрузки страницы {page}: {e}")
                 break
         
+        ADS_TOTAL.labels(stage='scraped').inc(len(announcements))
+        self._save_sessions()
         return announcements
     
     def _parse_item(self, item, category: str = "", city: str = "") -> Optional[Dict]:
@@ -239,93 +315,120 @@ class ImprovedAvitoParser:
         except:
             return "private"
     
-    def filter_announcements(self, announcements: List[Dict], stop_words: List[str]) -> List[Dict]:
-        """Фильтрация объявлений с улучшениями"""
-        filtered = []
-        
-        for ann in announcements:
-            # 1. Пропускаем бизнес
-            if ann.get('author_type') == 'business':
-                logger.debug(f"Фильтр: бизнес - {ann['title']}")
-                continue
-            
-            # 2. Проверяем стоп-слова (и заголовок и описание)
-            text_to_check = f"{ann.get('title', '')} {ann.get('description', '')}".lower()
-            found_stop_word = False
-            for word in stop_words:
-                if word.lower() in text_to_check:
-                    logger.debug(f"Фильтр: стоп-слово '{word}' - {ann['title']}")
-                    found_stop_word = True
-                    break
-            
-            if found_stop_word:
-                continue
-            
-            # 3. Проверяем минимальную цену (исключаем бесплатное)
-            if ann.get('price') is None or ann.get('price') == 0:
-                logger.debug(f"Фильтр: нет цены - {ann['title']}")
-                continue
-            
-            # 4. Проверяем минимальную длину описания (защита от спама)
-            if len(ann.get('description', '')) < 10:
-                logger.debug(f"Фильтр: очень короткое описание - {ann['title']}")
-                continue
-            
-            filtered.append(ann)
+    def filter_announcements(self, announcements: List[Dict], stop_words: List[str],
+                             check_description: bool = True, rules: Dict = None) -> List[Dict]:
+        """
+        Фильтрация объявлений (check_description=False - до догрузки карточек)
+
+        Args:
+            rules: правила города/общие (rules.py) поверх DEFAULT_RULES - бизнес, без цены,
+                   короткое описание; стоп-слова добавляются к exclude
+        """
+        spec = merge_rules(DEFAULT_RULES, rules, {'exclude': list(stop_words or [])})
+        if not check_description:
+            spec.pop('min_description', None)
+        filtered = compile_rules(spec).select(announcements)
         
+        ADS_TOTAL.labels(stage='filtered').inc(len(announcements) - len(filtered))
         logger.info(f"✅ После фильтрации: {len(filtered)}/{len(announcements)} объявлений")
         return filtered
     
     def save_to_db(self, announcements: List[Dict]) -> Dict[str, int]:
         """Сохранение в БД с дедупликацией"""
         stats = {'new': 0, 'duplicate': 0, 'updated': 0}
-        session = db.get_session()
+        session = self.db.get_session()
         
         try:
+            # Уже сохранённые - одним запросом на пачку
+            avito_ids = [ann_data['avito_id'] for ann_data in announcements]
+            known = {
+                ann.avito_id: ann
+                for ann in session.query(Announcement).filter(
+                    Announcement.user_id == self.user_id, Announcement.avito_id.in_(avito_ids))
+            }
+            # Ушедшие в архив (retention) тоже уже виденные
+            archived = archived_ids(session, self.user_id, [i for i in avito_ids if i not in known])
+            new_rows = {}  # avito_id -> строка: повтор в той же пачке - дубль
+            price_changes = []
+            
             for ann_data in announcements:
                 avito_id = ann_data['avito_id']
-                
-                # Проверяем существует ли
-                existing = session.query(Announcement).filter_by(avito_id=avito_id).first()
+                existing = known.get(avito_id)
                 
                 if existing:
                     # Проверяем изменилась ли цена
                     new_price = ann_data.get('price')
-                    if new_price and existing.price != new_price:
-                        existing.price = new_price
+                    change = price_history.change_row(existing, new_price) if new_price else None
+                    if change:
+                        price_changes.append(change)
                         existing.last_price = existing.price
+                        existing.price = new_price
                         existing.status = 'updated'
+                        if self.price_stats:
+                            # Прежняя цена уже в скетче - новая попадёт в него при пересборке
+                            existing.price_percentile = self.price_stats.percentile(
+                                existing.category, existing.city, new_price)
                         stats['updated'] += 1
                         logger.info(f"🔄 Обновлена цена: {existing.title}")
                     else:
                         stats['duplicate'] += 1
+                elif avito_id in archived or avito_id in new_rows:
+                    stats['duplicate'] += 1
                 else:
                     # Новое объявление
-                    announcement = Announcement(
-                        avito_id=avito_id,
-                        title=ann_data.get('title'),
-                        description=ann_data.get('description'),
-                        price=ann_data.get('price'),
-                        category=ann_data.get('category'),
-                        url=ann_data.get('url'),
-                        image_urls=ann_data.get('image_urls'),
-                        author_type=ann_data.get('author_type'),
-                        location=ann_data.get('location'),
-                        content_hash=Announcement.generate_hash(
+                    row = {
+                        'user_id': self.user_id,
+                        'avito_id': avito_id,
+                        'title': ann_data.get('title'),
+                        'description': ann_data.get('description'),
+                        'price': ann_data.get('price'),
+                        'category': ann_data.get('category'),
+                        'url': ann_data.get('url'),
+                        'image_urls': ann_data.get('image_urls'),
+                        'author_type': ann_data.get('author_type'),
+                        'location': ann_data.get('location'),
+                        'city': ann_data.get('city'),
+                        'content_hash': Announcement.generate_hash(
                             avito_id,
                             ann_data.get('title', ''),
                             ann_data.get('description', '')
                         ),
-                        status='new'
+                        'status': 'new',
+                        'unit_only': bool(ann_data.get('unit_only')),
+                    }
+                    # Место цены на рынке категории - до того, как она сама попадёт в статистику
+                    row['price_percentile'] = (
+                        self.price_stats.percentile(row['category'], row['city'], row['price'])
+                        if self.price_stats else None
                     )
-                    session.add(announcement)
-                    stats['new'] += 1
-                    logger.info(f"✨ Новое: {announcement.title}")
+                    new_rows[avito_id] = row
+                    logger.info(f"✨ Новое: {row['title']}")
+            
+            # Новые - одной пачкой; то, что успел вставить другой воркер, отсекает ON CONFLICT
+            inserted = self.db.insert(session, Announcement, list(new_rows.values()),
+                                      conflict=('user_id', 'avito_id'), returning='avito_id')
+            stats['new'] = len(inserted)
+            stats['duplicate'] += len(new_rows) - len(inserted)
+            if self.price_stats:
+                # В скетч - только вставленные: строки, проигравшие гонку, учёл другой воркер
+                for avito_id in inserted:
+                    row = new_rows[avito_id]
+                    self.price_stats.add(row['category'], row['city'], row['price'])
+            # История цен - только изменения, той же пачкой
+            price_history.record(self.db, session, price_changes)
+            if self.price_stats:
+                self.price_stats.flush(session)
+            
+            with DB_COMMIT_SECONDS.labels(operation='save_announcements').time():
+                session.commit()
             
-            session.commit()
+            for stage, count in stats.items():
+                ADS_TOTAL.labels(stage=stage).inc(count)
             
         except Exception as e:
             session.rollback()
+            if self.price_stats:
+                self.price_stats.discard()  # В памяти остались цены неудавшейся пачки
             logger.error(f"Ошибка сохранения в БД: {e}")
         finally:
             session.close()
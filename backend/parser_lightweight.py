@@ -4,27 +4,58 @@
 Облегчённый парсер Авито - берёт данные из листинга (не заходит в объявления)
 """
 
-import requests
 from bs4 import BeautifulSoup
 import time
 import random
 import re
 from typing import List, Dict, Optional
+from http_cache import ResponseCache
+from session_store import SessionStore
+from fetch_orchestrator import FetchOrchestrator
+from metrics import PARSE_SECONDS, ADS_TOTAL
+from rules import compile_rules, merge as merge_rules
+
+# Прежние проверки _is_valid: цена от 1000 (без цены - можно), заголовок и ссылка
+LIGHTWEIGHT_RULES = {'price': {'min': 1000, 'allow_missing': True}, 'required': ['title', 'url']}
+
 
 class AvitoLightweightParser:
     """Парсер листинга Авито без захода в объявления"""
     
-    def __init__(self, proxies: List[str] = None, stop_words: List[str] = None):
+    def __init__(self, proxies: List[str] = None, stop_words: List[str] = None,
+                 cache: ResponseCache = None, proxy_regions: Dict[str, str] = None,
+                 session_store: SessionStore = None, orchestrator: FetchOrchestrator = None,
+                 base_url: str = "https://www.avito.ru", page_delay: tuple = (2, 5), rules: Dict = None):
+        """
+        Args:
+            proxies: Список прокси
+            stop_words: Стоп-слова
+            cache: HTTP кеш листингов (None - без условных запросов)
+            proxy_regions: {proxy_url: регион} для ключа кеша
+            session_store: Хранилище сессий (cookies/User-Agent по прокси, общее с браузерным парсером)
+            orchestrator: Оркестратор загрузки (HTTP + эскалация в браузер при капче);
+                          по умолчанию - только HTTP
+            base_url: Адрес Авито (для бенчмарков - локальный мок-сервер)
+            page_delay: Случайная задержка между страницами (мин, макс), сек
+            rules: Правила отбора (rules.py) поверх LIGHTWEIGHT_RULES
+        """
         self.proxies = proxies or []
         self.stop_words = [w.lower() for w in (stop_words or [])]
-        self.session = requests.Session()
+        self.rules = compile_rules(merge_rules(LIGHTWEIGHT_RULES, rules, {'exclude': self.stop_words}))
+        self.base_url = base_url.rstrip("/")
+        self.page_delay = page_delay
+        self.orchestrator = orchestrator or FetchOrchestrator(
+            session_store=session_store,
+            cache=cache,
+            proxy_regions=proxy_regions,
+            headers=self._get_headers(),
+        )
         
-    def _get_proxy(self) -> Optional[Dict]:
+    def _get_proxy(self) -> Optional[str]:
         """Получить случайный прокси"""
         if not self.proxies:
             return None
-        proxy_url = random.choice(self.proxies)
-        return {"http": proxy_url, "https": proxy_url}
+        return random.choice(self.proxies)
     
     def _get_headers(self) -> Dict:
         """HTTP заголовки как у браузера"""
@@ -57,52 +88,57 @@ class AvitoLightweightParser:
         ads = []
         
         for page in range(1, max_pages + 1):
-            url = f"https://www.avito.ru/{city}/{category}?p={page}"
+            url = f"{self.base_url}/{city}/{category}?p={page}"
             
             try:
                 # Случайная задержка
                 if page > 1:
-                    time.sleep(random.uniform(2, 5))
+                    time.sleep(random.uniform(*self.page_delay))
                 
-                # Запрос
-                response = self.session.get(
-                    url,
-                    headers=self._get_headers(),
-                    proxies=self._get_proxy(),
-                    timeout=15
-                )
+                # Запрос (при капче оркестратор сам переключит этот источник/прокси на браузер)
+                result = self.orchestrator.fetch(url, f"{city}/{category}", self._get_proxy())
                 
-                if response.status_code != 200:
-                    print(f"⚠️ Страница {page}: HTTP {response.status_code}")
+                if result.unchanged:
+                    print(f"Страница {page}: без изменений, пропускаем")
                     continue
                 
-                # Проверка на капчу
-                if "captcha" in response.text.lower() or "проверка" in response.text.lower():
-                    print(f"❌ Капча на странице {page}")
+                if result.blocked:
+                    print(f"❌ Капча на странице {page} ({result.challenge})")
                     break
                 
-                # Парсинг
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                # Объявления (разные селекторы для разных версий Авито)
-                items = soup.find_all("div", {"data-marker": "item"})
+                if not result.ok:
+                    print(f"⚠️ Страница {page}: HTTP {result.status} {result.error or ''}")
+                    continue
                 
-                if not items:
-                    # Альтернативный селектор
-                    items = soup.find_all("div", class_=lambda x: x and "iva-item" in str(x))
+                # Парсинг
+                with PARSE_SECONDS.labels(parser='AvitoLightweightParser').time():
+                    soup = BeautifulSoup(result.html, 'html.parser')
+                    
+                    # Объявления (разные селекторы для разных версий Авито)
+                    items = soup.find_all("div", {"data-marker": "item"})
+                    
+                    if not items:
+                        # Альтернативный селектор
+                        items = soup.find_all("div", class_=lambda x: x and "iva-item" in str(x))
+                    
+                    page_ads = [self._extract_from_snippet(item, city) for item in items]
+                    page_ads = [ad for ad in page_ads if ad]
                 
                 print(f"Страница {page}: найдено {len(items)} объявлений")
                 
-                for item in items:
-                    ad = self._extract_from_snippet(item, city)
-                    
-                    if ad and self._is_valid(ad):
-                        ads.append(ad)
+                valid = [ad for ad in page_ads if self._is_valid(ad)]
+                ADS_TOTAL.labels(stage='scraped').inc(len(page_ads))
+                ADS_TOTAL.labels(stage='filtered').inc(len(page_ads) - len(valid))
+                ads.extend(valid)
+                
+                self.orchestrator.commit(result)
                 
             except Exception as e:
                 print(f"❌ Ошибка на странице {page}: {e}")
                 continue
         
+        self.orchestrator.save_sessions()
+        
         return ads
     
     def _extract_from_snippet(self, item_div, city: str) -> Optional[Dict]:
@@ -134,7 +170,7 @@ class AvitoLightweightParser:
                 href = title_elem.get("href")
                 if href:
                     if href.startswith("/"):
-                        ad["url"] = f"https://www.avito.ru{href}"
+                        ad["url"] = f"{self.base_url}{href}"
                     else:
                         ad["url"] = href
             
@@ -179,23 +215,8 @@ class AvitoLightweightParser:
             return None
     
     def _is_valid(self, ad: Dict) -> bool:
-        """Проверка валидности (стоп-слова, цена)"""
-        # Стоп-слова
-        if self.stop_words:
-            text = f"{ad.get('title', '')} {ad.get('description', '')}".lower()
-            for word in self.stop_words:
-                if word in text:
-                    return False
-        
-        # Минимальная цена
-        if ad.get("price") and ad["price"] < 1000:
-            return False
-        
-        # Обязательные поля
-        if not ad.get("title") or not ad.get("url"):
-            return False
-        
-        return True
+        """Проверка валидности (стоп-слова, цена, обязательные поля) - скомпилированные правила"""
+        return self.rules(ad)
 
 
 def test_parser():
@@ -212,6 +233,7 @@ def test_parser():
     
     print()
     print(f"✅ Собрано объявлений: {len(ads)}")
+    print(f"📊 Загрузка: {parser.orchestrator.get_stats()}")
     print()
     
     if ads:
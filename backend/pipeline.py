@@ -0,0 +1,381 @@
+"""
+Конвейер цикла: парсинг источников -> фильтрация -> БД -> публикация
+
+Общий для main.py (регулярный цикл) и Dashboard API (наполнение групп).
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List
+from loguru import logger
+from tenancy import tenant_id, tenant_db
+from rules import merge as merge_rules
+
+
+class CrawlPipeline:
+    """Один набор парсера и публикаторов на конфиг (VK/TG подключаются один раз)"""
+
+    def __init__(self, config: dict):
+        self.config = config
+        # Конфиг с городами (config_new.yaml) - ImprovedAvitoParser, со списком sources - AvitoParser
+        self.multi_city = bool(config.get('cities'))
+
+        parser_config = config.get('parser', {})
+        self.max_pages = parser_config.get('max_pages', 3)
+        self.source_delay = parser_config.get('delay_between_requests', 2 if self.multi_city else 0)
+
+        self._parser = None
+        self._enricher = None
+        self._image_hasher = None
+        self._vk_publisher = None
+        self._tg_publisher = None
+        self._publishers_ready = False
+
+        # Парсер и сессии не потокобезопасны - задачи на одном конвейере идут по очереди
+        self.lock = threading.Lock()
+
+    # ===== КОМПОНЕНТЫ (ленивая инициализация) =====
+
+    @property
+    def parser(self):
+        if self._parser is None:
+            if self.multi_city:
+                from parser_improved import ImprovedAvitoParser
+                self._parser = ImprovedAvitoParser(self.config)
+            else:
+                from parser import AvitoParser
+                self._parser = AvitoParser(self.config)
+        return self._parser
+
+    @property
+    def enricher(self):
+        """Догрузка карточек (enrichment.enabled) или None"""
+        if self._enricher is None and (self.config.get('enrichment') or {}).get('enabled'):
+            from enrichment import create_enricher
+            self._enricher = create_enricher(self.config)
+        return self._enricher
+
+    @property
+    def image_hasher(self):
+        """Проверка фото (image_hash.enabled) или None"""
+        if self._image_hasher is None and (self.config.get('image_hash') or {}).get('enabled'):
+            from image_hash import create_hasher
+            self._image_hasher = create_hasher(self.config)
+        return self._image_hasher
+
+    def connect_publishers(self):
+        """Подключиться к VK/TG (один раз на конвейер)"""
+        if self._publishers_ready:
+            return
+        self._publishers_ready = True
+
+        if self.config.get('vk', {}).get('access_token'):
+            from publisher import VKPublisher
+            self._vk_publisher = VKPublisher(
+                access_token=self.config['vk']['access_token'],
+                group_mappings=self.config['vk'].get('groups', {}),
+                user_id=tenant_id(self.config),
+                database=tenant_db(self.config)
+            )
+        else:
+            logger.warning("VK токен не настроен, публикация в VK отключена")
+
+        if self.config.get('telegram', {}).get('bot_token'):
+            from telegram_publisher import TelegramPublisher
+            self._tg_publisher = TelegramPublisher(
+                bot_token=self.config['telegram']['bot_token'],
+                channel_mappings=self.config['telegram'].get('channels', {}),
+                user_id=tenant_id(self.config),
+                database=tenant_db(self.config)
+            )
+        else:
+            logger.warning("Telegram бот не настроен, публикация в TG отключена")
+
+    @property
+    def vk_publisher(self):
+        self.connect_publishers()
+        return self._vk_publisher
+
+    @property
+    def tg_publisher(self):
+        self.connect_publishers()
+        return self._tg_publisher
+
+    # ===== ИСТОЧНИКИ =====
+
+    def sources(self) -> List[Dict]:
+        """Активные источники в едином виде: url, category, city, city_slug, signature"""
+        result = []
+
+        if self.multi_city:
+            for city in self.config.get('cities', []):
+                if not city.get('enabled', True):
+                    continue
+                for source in city.get('sources', []):
+                    if not source.get('enabled', True):
+                        continue
+                    result.append({
+                        'url': f"https://www.avito.ru/{city['url_slug']}/{source['url_path']}",
+                        'category': source['category'],
+                        'city': city['name'],
+                        'city_slug': city['url_slug'],
+                        'signature': source.get('signature', ''),
+                        'rules': self.rules_for(city['url_slug']),
+                    })
+        else:
+            for source in self.config.get('sources', []):
+                if not source.get('enabled', True):
+                    logger.info(f"⏭️ Пропущена (отключена): {source['url']}")
+                    continue
+                result.append({
+                    'url': source['url'],
+                    'category': source.get('category', 'general'),
+                    'city': self.config.get('city', ''),
+                    'city_slug': self.config.get('city', ''),
+                    'signature': source.get('signature', ''),
+                    'rules': self.rules_for(),
+                })
+
+        return result
+
+    def rules_for(self, city_slug: str = None) -> Dict:
+        """Правила отбора (rules.py): общие rules, поверх - rules города"""
+        city_rules = None
+        for city in self.config.get('cities', []) if city_slug else []:
+            if city.get('url_slug', '').lower() == city_slug.lower():
+                city_rules = city.get('rules')
+                break
+        return merge_rules(self.config.get('rules'), city_rules)
+
+    def signatures(self) -> Dict[str, str]:
+        """Подписи постов по категориям"""
+        signatures = {}
+        if self.multi_city:
+            for city in self.config.get('cities', []):
+                for source in city.get('sources', []):
+                    signatures[source['category']] = source.get('signature', '')
+        else:
+            for source in self.config.get('sources', []):
+                signatures[source.get('category', 'general')] = source.get('signature', '')
+        return signatures
+
+    def pages_total(self, max_pages: int = None) -> int:
+        """Сколько страниц обойдёт run() - для прогресса задачи"""
+        return len(self.sources()) * (max_pages or self.max_pages)
+
+    # ===== ЗАПУСК =====
+
+    def run(self, max_pages: int = None, job=None, publish: bool = True, leases=None) -> Dict[str, int]:
+        """
+        Полный проход: все активные источники, затем публикация
+
+        Args:
+            max_pages: страниц на источник (по умолчанию parser.max_pages)
+            job: JobHandle - прогресс и отмена (между страницами и источниками)
+            leases: LeaseManager узла (leases.py) - только арендованные источники,
+                публикация - на одном узле за раз
+        """
+        max_pages = max_pages or self.max_pages
+        totals = {'sources': 0, 'new': 0, 'duplicate': 0, 'updated': 0}
+
+        with self.lock:
+            sources = self.sources()
+            if leases:
+                sources = leases.claim(sources)
+                if job:
+                    job.progress(pages_total=len(sources) * max_pages)
+            try:
+                for i, source in enumerate(sources):
+                    if job and not job.checkpoint():
+                        break
+                    if leases and not leases.holds(source):
+                        continue  # Аренду забрали (узел не успел продлить) - обходит другой
+
+                    if i and self.source_delay:
+                        if job and not job.sleep(self.source_delay):
+                            break
+                        if not job:
+                            time.sleep(self.source_delay)
+
+                    stats = self.crawl_source(source, max_pages, job)
+                    if leases:
+                        leases.complete(source)
+                    totals['sources'] += 1
+                    for key in ('new', 'duplicate', 'updated'):
+                        totals[key] += stats.get(key, 0)
+            finally:
+                if leases:
+                    leases.release_all()  # Необойдённые (отмена, ошибка) - другим узлам
+
+            if job and job.cancelled:
+                logger.warning(f"⏹️ Задача {job.id} отменена, публикация пропущена")
+                return totals
+
+            if publish and leases and not leases.acquire('task:publish'):
+                logger.info("⏭️ Публикация идёт на другом узле")
+                publish = False
+            if publish:
+                if job:
+                    job.progress(current_source='публикация')
+                try:
+                    self.publish(job)
+                finally:
+                    if leases:
+                        leases.complete('task:publish')
+
+        return totals
+
+    def crawl_source(self, source: Dict, max_pages: int, job=None) -> Dict[str, int]:
+        """Парсинг, фильтрация и сохранение одного источника"""
+        raw = self.fetch(source, max_pages, job)
+        if not raw:
+            logger.warning("Не найдено объявлений")
+            return {}
+
+        filtered = self.prepare(raw, job, source.get('rules'))
+        stats = self.save(filtered, source['category'], source.get('city_slug'))
+        if job:
+            job.progress(ads_new=stats['new'])
+        logger.info(f"📊 Статистика: {stats}")
+        return stats
+
+    def fetch(self, source: Dict, max_pages: int, job=None) -> List[Dict]:
+        """Обход страниц источника (url, category, city) с прогрессом задачи"""
+        logger.info(f"🔍 Парсинг: {source['url']}")
+        if job:
+            job.progress(current_source=source['url'])
+
+        pages_seen = []
+
+        def on_page(page):
+            pages_seen.append(page)
+            if job:
+                job.progress(pages=1)
+                return job.checkpoint()
+
+        try:
+            if self.multi_city:
+                raw = self.parser.parse_listing_page(source['url'], max_pages, source['category'],
+                                                     source.get('city', ''), on_page)
+            else:
+                raw = self.parser.parse_listing_page(source['url'], max_pages, on_page=on_page)
+        except Exception as e:
+            logger.error(f"Ошибка при парсинге {source['url']}: {e}")
+            raw = []
+
+        # Страницы, до которых не дошли (пусто/ошибка), считаем пройденными для ETA
+        if job and not job.cancelled and len(pages_seen) < max_pages:
+            job.progress(pages=max_pages - len(pages_seen))
+
+        return raw
+
+    def filter(self, announcements: List[Dict], check_description: bool = True,
+               rules: Dict = None) -> List[Dict]:
+        """Фильтры парсера (стоп-слова, бизнес-аккаунты) и правила источника (rules_for)"""
+        stop_words = self.config.get('stop_words', [])
+        if rules is None:
+            rules = self.rules_for()
+        if self.multi_city:
+            return self.parser.filter_announcements(announcements, stop_words, check_description, rules)
+        return self.parser.filter_announcements(announcements, stop_words, rules)
+
+    def prepare(self, raw: List[Dict], job=None, rules: Dict = None) -> List[Dict]:
+        """
+        Фильтры и догрузка карточек: дешёвые фильтры -> карточки новых -> фильтры
+        ещё раз (по полному описанию). Без enrichment - просто filter()
+        """
+        if not self.enricher:
+            return self.filter(raw, rules=rules)
+        candidates = self.filter(raw, check_description=False, rules=rules)
+        return self.filter(self.enricher.enrich(candidates, job), rules=rules)
+
+    def save(self, announcements: List[Dict], category: str, city: str = None,
+             unit_only: bool = False) -> Dict[str, int]:
+        """
+        Сохранение в БД (ImprovedAvitoParser берёт категорию из самих объявлений), затем проверка фото
+
+        unit_only - источник единиц (unit_crawler): новые объявления не попадают в общие
+        группы категорий; найденное общим источником снимает эту отметку
+        """
+        if city:
+            for ann in announcements:
+                ann.setdefault('city', city)
+        for ann in announcements:
+            ann['unit_only'] = unit_only
+        if not unit_only:
+            self._share_unit_only(announcements)
+        if self.multi_city:
+            for ann in announcements:
+                ann.setdefault('category', category)
+            stats = self.parser.save_to_db(announcements)
+        else:
+            stats = self.parser.save_to_db(announcements, category)
+
+        # Повторы и перекупы по фото - до публикации
+        if self.image_hasher and stats.get('new'):
+            stats.update(self.image_hasher.process())
+        return stats
+
+    def _share_unit_only(self, announcements: List[Dict]):
+        """Объявления, раньше найденные только единицами, нашёл общий источник - в общие группы"""
+        from models import Announcement
+
+        avito_ids = [ann['avito_id'] for ann in announcements if ann.get('avito_id')]
+        if not avito_ids:
+            return
+        database = tenant_db(self.config)
+        session = database.get_session()
+        try:
+            session.query(Announcement).filter(
+                Announcement.user_id == tenant_id(self.config),
+                Announcement.avito_id.in_(avito_ids),
+                Announcement.unit_only == True,
+            ).update({Announcement.unit_only: False}, synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
+
+    def publish(self, job=None) -> Dict[str, Dict]:
+        """Публикация новых объявлений в VK и Telegram (job - отмечается живой по ходу)"""
+        signatures = self.signatures()
+        heartbeat = job.heartbeat if job else None
+        result = {}
+
+        if self.vk_publisher:
+            logger.info("📤 Публикация в VK...")
+            result['vk'] = self.vk_publisher.publish_announcements(signatures, heartbeat)
+            logger.info(f"📊 VK: {result['vk']}")
+
+        if self.tg_publisher:
+            logger.info("📤 Публикация в Telegram...")
+            result['telegram'] = self.tg_publisher.publish_announcements(signatures, heartbeat)
+            logger.info(f"📊 Telegram: {result['telegram']}")
+
+        return result
+
+
+# ===== КЕШ КОНВЕЙЕРОВ =====
+
+_pipelines: "OrderedDict[str, CrawlPipeline]" = OrderedDict()
+_pipelines_lock = threading.Lock()
+MAX_PIPELINES = 4
+
+
+def _fingerprint(config: dict) -> str:
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_pipeline(config: dict) -> CrawlPipeline:
+    """Конвейер для конфига: тот же конфиг - те же парсер и публикаторы (без повторного логина VK)"""
+    key = _fingerprint(config)
+    with _pipelines_lock:
+        pipeline = _pipelines.get(key)
+        if pipeline is None:
+            pipeline = _pipelines[key] = CrawlPipeline(config)
+            while len(_pipelines) > MAX_PIPELINES:
+                _pipelines.popitem(last=False)
+        else:
+            _pipelines.move_to_end(key)
+        return pipeline
@@ -0,0 +1,146 @@
+"""
+История цен объявлений - только изменения, компактно
+
+Каждое изменение цены - одна строка price_changes (announcement_id, changed_at, price,
+delta): целые рубли и unix-время вместо REAL и текстовых дат, таблица без rowid
+(SQLite) кластеризована по объявлению. Повторные наблюдения той же цены не пишутся,
+поэтому размер растёт с числом изменений, а не проходов парсера. Прежняя цена
+восстанавливается как price - delta.
+
+Строки собирает save_to_db и пишет одной пачкой вместе с новыми объявлениями.
+
+API:
+    GET /api/price-drops?category=avtomobili&hours=24&min_percent=5&limit=50
+    GET /api/announcements/<id>/prices
+"""
+import time
+from typing import Dict, List, Optional
+from sqlalchemy import select
+from models import Announcement, PriceChange
+
+
+def to_rubles(price) -> Optional[int]:
+    """Цена парсера (float) -> целые рубли"""
+    if price is None:
+        return None
+    return int(round(price))
+
+
+def change_row(announcement: Announcement, new_price, changed_at: int = None) -> Optional[Dict]:
+    """
+    Строка изменения цены (до того, как announcement.price перезаписана)
+
+    Returns:
+        None, если в целых рублях цена не изменилась
+    """
+    price = to_rubles(new_price)
+    old = to_rubles(announcement.price)
+    if price is None or price == old:
+        return None
+    return {
+        'announcement_id': announcement.id,
+        'changed_at': changed_at or int(time.time()),
+        'user_id': announcement.user_id,
+        'category': announcement.category,
+        'price': price,
+        'delta': price - old if old is not None else None,
+    }
+
+
+def record(database, session, rows: List[Dict]) -> int:
+    """Изменения пачкой в транзакции сессии (повтор в ту же секунду отбрасывается)"""
+    return database.insert(session, PriceChange, rows, conflict=('announcement_id', 'changed_at'))
+
+
+def price_drops(database, user_id: int, hours: float = 24, category: str = None,
+                min_percent: float = 0, limit: int = 50) -> List[Dict]:
+    """
+    Снижения цен за последние hours часов, самые свежие первыми
+
+    С категорией - диапазон по индексу (user_id, category, changed_at).
+    """
+    changes = PriceChange.__table__
+    ads = Announcement.__table__
+    since = int(time.time() - hours * 3600)
+
+    query = (
+        select(changes.c.announcement_id, changes.c.changed_at, changes.c.price, changes.c.delta,
+               ads.c.avito_id, ads.c.title, ads.c.category, ads.c.city, ads.c.url, ads.c.status)
+        .join(ads, ads.c.id == changes.c.announcement_id)
+        .where(changes.c.user_id == user_id, changes.c.changed_at >= since, changes.c.delta < 0)
+        .order_by(changes.c.changed_at.desc())
+        .limit(limit)
+    )
+    if category:
+        query = query.where(changes.c.category == category)
+    if min_percent:
+        # -delta / (price - delta) >= min_percent / 100, без деления
+        query = query.where(-changes.c.delta * 100 >= min_percent * (changes.c.price - changes.c.delta))
+
+    with database.engine.connect() as conn:
+        rows = conn.execute(query).mappings().all()
+
+    return [
+        {
+            'announcement_id': row['announcement_id'],
+            'avito_id': row['avito_id'],
+            'title': row['title'],
+            'category': row['category'],
+            'city': row['city'],
+            'url': row['url'],
+            'status': row['status'],
+            'old_price': row['price'] - row['delta'],
+            'price': row['price'],
+            'delta': row['delta'],
+            'percent': round(row['delta'] * 100 / (row['price'] - row['delta']), 1),
+            'changed_at': row['changed_at'],
+        }
+        for row in rows
+    ]
+
+
+def history(database, user_id: int, announcement_id: int) -> List[Dict]:
+    """Все изменения цены объявления по времени"""
+    changes = PriceChange.__table__
+    query = (
+        select(changes.c.changed_at, changes.c.price, changes.c.delta)
+        .where(changes.c.announcement_id == announcement_id, changes.c.user_id == user_id)
+        .order_by(changes.c.changed_at)
+    )
+    with database.engine.connect() as conn:
+        return [dict(row) for row in conn.execute(query).mappings()]
+
+
+# ===== FLASK =====
+
+def install(app, load_config, prefix: str = "/api"):
+    """GET {prefix}/price-drops?category=&hours=24&min_percent=0&limit=50 и {prefix}/announcements/<id>/prices"""
+    from flask import jsonify, request
+    from tenancy import tenant_id, tenant_db
+
+    @app.route(f"{prefix}/price-drops", methods=['GET'])
+    def get_price_drops():
+        hours = request.args.get('hours', 24, type=float)
+        if not hours or hours <= 0:
+            return jsonify({'error': 'hours - положительное число'}), 400
+
+        config = load_config()
+        return jsonify({
+            'hours': hours,
+            'drops': price_drops(
+                tenant_db(config), tenant_id(config), hours,
+                category=request.args.get('category') or None,
+                min_percent=max(request.args.get('min_percent', 0, type=float) or 0, 0),
+                limit=min(max(request.args.get('limit', 50, type=int), 1), 500),
+            ),
+        })
+
+    @app.route(f"{prefix}/announcements/<int:announcement_id>/prices", methods=['GET'])
+    def get_price_history(announcement_id):
+        config = load_config()
+        return jsonify({
+            'announcement_id': announcement_id,
+            'changes': history(tenant_db(config), tenant_id(config), announcement_id),
+        })
+
+    return get_price_drops
@@ -0,0 +1,430 @@
+"""
+Рыночные цены по категории x городу - квантильные скетчи (t-digest)
+
+На каждую пару (категория, город) - t-digest: несколько десятков центроидов вместо
+всех цен, квантили и процентиль цены считаются по ним без сканирования таблицы.
+Скетчи сливаемые: пачка новых цен сжимается отдельно и вливается в скетч.
+
+- save_to_db: у нового объявления (и при смене цены) price_percentile - место цены
+  среди уже виденных в его категории и городе (5 - дешевле 95% рынка); цена
+  действительно вставленного объявления (RETURNING) добавляется в скетч, изменённые
+  скетчи пишутся в price_sketches той же транзакцией. Новая цена изменённого - только при пересборке: старую из скетча не
+  вынуть, и объявление считалось бы дважды
+- раз в rebuild_hours main.py пересобирает скетчи по текущим объявлениям (задача
+  price_stats рядом с retention; одно чтение таблицы, сжатие пачкой - векторно на
+  NumPy, без него - тем же алгоритмом в цикле): так уходят цены удалённых и ушедших
+  в архив объявлений. Сохранение и API только читают price_sketches (раз в
+  RELOAD_SECONDS - заново, так сходятся копии скетчей разных процессов)
+
+Настройки (config.yaml):
+    price_stats:
+      enabled: true
+      compression: 100     # Точность: до compression / 2 центроидов на скетч
+      min_count: 20        # Меньше цен в категории - процентиль не считается
+      rebuild_hours: 24    # Пересборка по объявлениям (main.py, задача price_stats)
+
+API:
+    GET /api/price-stats?category=avtomobili&city=vorkuta&price=450000
+"""
+import bisect
+import math
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+from loguru import logger
+from sqlalchemy import delete, select
+from models import Announcement, PriceSketch
+
+_numpy = None
+
+
+def _np():
+    """NumPy при первом сжатии (API импортирует модуль при запуске); None - не установлен"""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:  # Опционально - без NumPy то же сжатие, но в цикле
+            _numpy = False
+    return _numpy or None
+
+
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+Key = Tuple[str, str]
+
+
+# ===== T-DIGEST =====
+
+def _compress(means: List[float], weights: List[float], compression: float) -> Tuple[List[float], List[float]]:
+    """
+    Слить точки/центроиды в центроиды t-digest
+
+    Шкала k1: кластер занимает не больше единицы k(q) = compression / 2pi * asin(2q - 1),
+    поэтому у краёв (дешёвые/дорогие) центроиды мелкие и квантили там точные.
+    """
+    scale = compression / (2 * math.pi)
+
+    np = _np() if len(means) > 64 else None
+    if np is not None:
+        m = np.asarray(means, dtype=float)
+        w = np.asarray(weights, dtype=float)
+        order = np.argsort(m, kind='stable')
+        m, w = m[order], w[order]
+        q = (np.cumsum(w) - w / 2) / w.sum()
+        cluster = np.floor(scale * (np.arcsin(np.clip(2 * q - 1, -1, 1)) + math.pi / 2))
+        # Номер кластера не убывает вдоль отсортированных точек - кластеры идут отрезками
+        starts = np.flatnonzero(np.r_[True, cluster[1:] != cluster[:-1]])
+        total_w = np.add.reduceat(w, starts)
+        return (np.add.reduceat(m * w, starts) / total_w).tolist(), total_w.tolist()
+
+    points = sorted(zip(means, weights))
+    total = sum(weight for _, weight in points)
+    result_means, result_weights = [], []
+    current, seen = None, 0.0
+    for mean, weight in points:
+        q = (seen + weight / 2) / total
+        cluster = math.floor(scale * (math.asin(min(max(2 * q - 1, -1.0), 1.0)) + math.pi / 2))
+        seen += weight
+        if cluster == current:
+            merged = result_weights[-1] + weight
+            result_means[-1] += (mean - result_means[-1]) * weight / merged
+            result_weights[-1] = merged
+        else:
+            current = cluster
+            result_means.append(mean)
+            result_weights.append(weight)
+    return result_means, result_weights
+
+
+class TDigest:
+    """Квантильный скетч: add/merge, quantile(q), cdf(x)"""
+
+    def __init__(self, compression: float = 100, means: List[float] = None, weights: List[float] = None,
+                 minimum: float = None, maximum: float = None):
+        self.compression = compression
+        self.means = list(means or [])
+        self.weights = list(weights or [])
+        self.min = minimum
+        self.max = maximum
+        self._buffer: List[float] = []
+        self._centers: Optional[List[float]] = None
+
+    @classmethod
+    def from_values(cls, values: Iterable[float], compression: float = 100) -> "TDigest":
+        """Скетч пачки значений сразу (пересборка - одно сжатие на пачку)"""
+        values = list(values)
+        digest = cls(compression)
+        if values:
+            digest.means, digest.weights = _compress(values, [1.0] * len(values), compression)
+            digest.min, digest.max = min(values), max(values)
+        return digest
+
+    @property
+    def count(self) -> int:
+        return int(round(sum(self.weights))) + len(self._buffer)
+
+    def add(self, value: float):
+        self._buffer.append(value)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self._centers = None
+        if len(self._buffer) >= self.compression:
+            self._flush()
+
+    def merge(self, other: "TDigest"):
+        other._flush()
+        if not other.weights:
+            return
+        self._flush()
+        self.means, self.weights = _compress(self.means + other.means, self.weights + other.weights,
+                                             self.compression)
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self._centers = None
+
+    def _flush(self):
+        if self._buffer:
+            self.means, self.weights = _compress(self.means + self._buffer,
+                                                 self.weights + [1.0] * len(self._buffer), self.compression)
+            self._buffer = []
+            self._centers = None
+
+    def _curve(self) -> List[float]:
+        """Накопленный вес в центре каждого центроида"""
+        self._flush()
+        if self._centers is None:
+            centers, seen = [], 0.0
+            for weight in self.weights:
+                centers.append(seen + weight / 2)
+                seen += weight
+            self._centers = centers
+        return self._centers
+
+    def cdf(self, value: float) -> Optional[float]:
+        """Доля значений не больше value (кусочно-линейно между центроидами)"""
+        centers = self._curve()
+        if not centers:
+            return None
+        total = centers[-1] + self.weights[-1] / 2
+        if value <= self.min:
+            return 0.0
+        if value >= self.max:
+            return 1.0
+
+        i = bisect.bisect_right(self.means, value)
+        left_x, left_y = (self.means[i - 1], centers[i - 1]) if i else (self.min, 0.0)
+        right_x, right_y = (self.means[i], centers[i]) if i < len(centers) else (self.max, total)
+        if right_x <= left_x:
+            return right_y / total
+        return (left_y + (right_y - left_y) * (value - left_x) / (right_x - left_x)) / total
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Значение квантиля q (0..1)"""
+        centers = self._curve()
+        if not centers:
+            return None
+        total = centers[-1] + self.weights[-1] / 2
+        target = min(max(q, 0.0), 1.0) * total
+
+        i = bisect.bisect_left(centers, target)
+        left_x, left_y = (self.means[i - 1], centers[i - 1]) if i else (self.min, 0.0)
+        right_x, right_y = (self.means[i], centers[i]) if i < len(centers) else (self.max, total)
+        if right_y <= left_y:
+            return right_x
+        return left_x + (right_x - left_x) * (target - left_y) / (right_y - left_y)
+
+    def to_dict(self) -> Dict:
+        self._flush()
+        return {
+            'means': [round(mean, 2) for mean in self.means],
+            'weights': [round(weight, 3) for weight in self.weights],
+            'min': self.min,
+            'max': self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict, compression: float = 100) -> "TDigest":
+        return cls(compression, data.get('means'), data.get('weights'), data.get('min'), data.get('max'))
+
+
+# ===== СТАТИСТИКА ПОЛЬЗОВАТЕЛЯ =====
+
+RELOAD_SECONDS = 300  # Перечитать скетчи из БД (их пишут другие процессы и пересборка)
+
+
+def _key(category, city) -> Key:
+    return (category or '', (city or '').lower())
+
+
+class PriceStats:
+    """Скетчи цен пользователя: процентиль при сохранении, квантили для API"""
+
+    def __init__(self, database, user_id: int, compression: float = 100, min_count: int = 20,
+                 rebuild_hours: float = 24):
+        self.db = database
+        self.user_id = user_id
+        self.compression = compression
+        self.min_count = min_count
+        self.rebuild_hours = rebuild_hours
+
+        self._sketches: Optional[Dict[Key, TDigest]] = None
+        self._built_at = 0
+        self._read_at = 0
+        self._dirty = set()
+        self._lock = threading.RLock()
+
+        PriceSketch.__table__.create(bind=self.db.engine, checkfirst=True)
+
+    def _loaded(self) -> Dict[Key, TDigest]:
+        """Скетчи из price_sketches (только чтение; пересобирает их rebuild() по расписанию)"""
+        if self._sketches is not None and (self._dirty or time.time() - self._read_at < RELOAD_SECONDS):
+            return self._sketches
+
+        table = PriceSketch.__table__
+        with self.db.engine.connect() as conn:
+            rows = conn.execute(select(table).where(table.c.user_id == self.user_id)).mappings().all()
+        self._sketches = {
+            _key(row['category'], row['city']): TDigest.from_dict(row['sketch'], self.compression)
+            for row in rows
+        }
+        self._built_at = min((row['built_at'] for row in rows), default=0)
+        self._read_at = time.time()
+        return self._sketches
+
+    def rebuild(self) -> int:
+        """Пересобрать все скетчи по ценам текущих объявлений (одно чтение, сжатие пачкой; main.py)"""
+        started = time.perf_counter()
+        table = Announcement.__table__
+        prices: Dict[Key, List[float]] = defaultdict(list)
+        query = (
+            select(table.c.category, table.c.city, table.c.price)
+            .where(table.c.user_id == self.user_id, table.c.price > 0)
+            .execution_options(yield_per=10000)
+        )
+        with self.db.engine.connect() as conn:
+            for category, city, price in conn.execute(query):
+                prices[_key(category, city)].append(price)
+
+        with self._lock:
+            self._sketches = {
+                key: TDigest.from_values(values, self.compression) for key, values in prices.items()
+            }
+            self._built_at = int(time.time())
+            self._read_at = time.time()
+            self._dirty = set(self._sketches)
+
+            session = self.db.get_session()
+            try:
+                session.execute(delete(PriceSketch).where(PriceSketch.user_id == self.user_id))
+                self.flush(session)
+                session.commit()
+            except Exception:
+                session.rollback()
+                self._sketches = None  # Перечитаются из БД
+                raise
+            finally:
+                session.close()
+
+        logger.info(f"📈 Статистика цен пересобрана: {len(prices)} категорий, "
+                    f"{sum(map(len, prices.values()))} цен за {time.perf_counter() - started:.1f} c")
+        return len(prices)
+
+    def market(self, category: str, city: str = None) -> Optional[TDigest]:
+        """Скетч категории в городе; без города - слитый по всем городам категории"""
+        with self._lock:
+            sketches = self._loaded()
+            if city:
+                return sketches.get(_key(category, city))
+            parts = [sketch for (name, _), sketch in sketches.items() if name == (category or '')]
+            if len(parts) <= 1:
+                return parts[0] if parts else None
+            merged = TDigest(self.compression)
+            for sketch in parts:
+                merged.merge(sketch)
+            return merged
+
+    def percentile(self, category: str, city: str, price) -> Optional[float]:
+        """Процентиль цены среди виденных в категории и городе (None - мало данных или нет цены)"""
+        if not price or price <= 0:
+            return None
+        with self._lock:
+            sketch = self.market(category, city)
+            if sketch is None or sketch.count < self.min_count:
+                return None
+            return round(sketch.cdf(float(price)) * 100, 1)
+
+    def add(self, category: str, city: str, price):
+        """Цена вставленного объявления - в скетч (записать - flush)"""
+        if not price or price <= 0:
+            return
+        key = _key(category, city)
+        with self._lock:
+            sketches = self._loaded()
+            sketch = sketches.get(key)
+            if sketch is None:
+                sketch = sketches[key] = TDigest(self.compression)
+            sketch.add(float(price))
+            self._dirty.add(key)
+
+    def flush(self, session) -> int:
+        """Изменённые скетчи - в price_sketches в транзакции сессии"""
+        with self._lock:
+            if not self._dirty or self._sketches is None:
+                return 0
+            now = int(time.time())
+            rows = [
+                {
+                    'user_id': self.user_id,
+                    'category': key[0],
+                    'city': key[1],
+                    'count': sketch.count,
+                    'sketch': sketch.to_dict(),
+                    'built_at': self._built_at,
+                    'updated_at': now,
+                }
+                for key, sketch in ((key, self._sketches[key]) for key in self._dirty if key in self._sketches)
+            ]
+            self._dirty = set()
+        return self.db.insert(session, PriceSketch, rows, conflict=('user_id', 'category', 'city'),
+                              update=('count', 'sketch', 'built_at', 'updated_at'))
+
+    def discard(self):
+        """Забыть скетчи в памяти (после отката транзакции - перечитаются из БД)"""
+        with self._lock:
+            self._sketches = None
+            self._dirty = set()
+
+    def summary(self, category: str = None, city: str = None) -> List[Dict]:
+        """Квантили по категориям x городам (с фильтром)"""
+        with self._lock:
+            sketches = self._loaded()
+            result = []
+            for (sketch_category, sketch_city), sketch in sorted(sketches.items()):
+                if category and sketch_category != category:
+                    continue
+                if city and sketch_city != city.lower():
+                    continue
+                result.append({
+                    'category': sketch_category,
+                    'city': sketch_city,
+                    'count': sketch.count,
+                    'min': sketch.min,
+                    'max': sketch.max,
+                    'quantiles': {f"p{int(q * 100)}": round(sketch.quantile(q)) for q in QUANTILES},
+                })
+            return result
+
+
+_stats: Dict[Tuple[int, int], PriceStats] = {}
+_stats_lock = threading.Lock()
+
+
+def get_stats(config: Dict, database=None) -> Optional[PriceStats]:
+    """Статистика цен тенанта по настройкам price_stats (None - отключена), одна на процесс"""
+    from tenancy import tenant_id, tenant_db
+
+    settings = config.get('price_stats') or {}
+    if not settings.get('enabled', True):
+        return None
+    database = database or tenant_db(config)
+    user_id = tenant_id(config)
+    with _stats_lock:
+        stats = _stats.get((id(database), user_id))
+        if stats is None:
+            stats = _stats[(id(database), user_id)] = PriceStats(
+                database, user_id,
+                compression=float(settings.get('compression', 100)),
+                min_count=int(settings.get('min_count', 20)),
+                rebuild_hours=float(settings.get('rebuild_hours', 24)),
+            )
+        return stats
+
+
+# ===== FLASK =====
+
+def install(app, load_config, prefix: str = "/api"):
+    """GET {prefix}/price-stats?category=&city=&price= - квантили рынка и процентиль цены"""
+    from flask import jsonify, request
+
+    @app.route(f"{prefix}/price-stats", methods=['GET'])
+    def get_price_stats():
+        stats = get_stats(load_config())
+        if stats is None:
+            return jsonify({'error': 'Статистика цен отключена (price_stats.enabled)'}), 404
+
+        category = request.args.get('category') or None
+        city = request.args.get('city') or None
+        result = {'stats': stats.summary(category, city)}
+
+        price = request.args.get('price', type=float)
+        if price is not None:
+            if not category:
+                return jsonify({'error': 'Для процентиля цены нужна category'}), 400
+            result['price'] = price
+            result['percentile'] = stats.percentile(category, city, price)
+        return jsonify(result)
+
+    return get_price_stats
@@ -2,24 +2,29 @@
 VK Publisher - публикация объявлений в VK группы
 """
 import vk_api
-from typing import List, Optional, Dict
+from typing import Callable, List, Optional, Dict
 from loguru import logger
 from models import Announcement
 from database import db
+from metrics import PUBLISH_SECONDS, PUBLISH_TOTAL, DB_COMMIT_SECONDS
 import requests
 import os
 import tempfile
 
 
 class VKPublisher:
-    def __init__(self, access_token: str, group_mappings: Dict[str, int]):
+    def __init__(self, access_token: str, group_mappings: Dict[str, int], user_id: int = 0, database=None):
         """
         Args:
             access_token: VK access token
             group_mappings: {category: group_id}, например {'auto': -123456}
+            user_id: тенант - публикуются только его объявления
+            database: БД тенанта (по умолчанию общая)
         """
         self.access_token = access_token
         self.group_mappings = group_mappings
+        self.user_id = user_id
+        self.db = database or db
         
         try:
             self.vk_session = vk_api.VkApi(token=access_token)
@@ -29,21 +34,27 @@ class VKPublisher:
             logger.error(f"Ошибка подключения к VK API: {e}")
             raise
     
-    def publish_announcements(self, signatures: Dict[str, str]) -> Dict[str, int]:
-        """Публикация всех новых объявлений"""
+    def publish_announcements(self, signatures: Dict[str, str],
+                              heartbeat: Callable[[], None] = None) -> Dict[str, int]:
+        """Публикация всех новых объявлений (heartbeat() - после каждого, задача жива)"""
         stats = {'published': 0, 'failed': 0, 'skipped': 0}
-        session = db.get_session()
+        session = self.db.get_session()
         
         try:
-            # Получаем все новые и обновлённые объявления
-            announcements = session.query(Announcement).filter(
+            # Получаем все новые и обновлённые объявления пользователя
+            # (в PostgreSQL - SKIP LOCKED: взятые другим публикатором пропускаются)
+            announcements = self.db.claim(session.query(Announcement).filter(
+                Announcement.user_id == self.user_id,
                 Announcement.published_to_vk == False,
-                Announcement.status.in_(['new', 'updated'])
-            ).all()
+                Announcement.status.in_(['new', 'updated']),
+                Announcement.in_global_feed(),  # Найденные только единицами - в их ленты
+            )).all()
             
             logger.info(f"Найдено {len(announcements)} объявлений для публикации")
             
             for ann in announcements:
+                if heartbeat:
+                    heartbeat()
                 try:
                     # Определяем в какую группу публиковать
                     group_id = self.group_mappings.get(ann.category)
@@ -53,21 +64,8 @@ class VKPublisher:
                         stats['skipped'] += 1
                         continue
                     
-                    # Формируем текст поста
-                    signature = signatures.get(ann.category, "")
-                    post_text = self._format_post(ann, signature)
-                    
-                    # Загружаем фото (если есть)
-                    photo_attachment = None
-                    if ann.image_urls and len(ann.image_urls) > 0:
-                        photo_attachment = self._upload_photo(ann.image_urls[0], group_id)
-                    
-                    # Публикуем
-                    post_id = self._publish_to_wall(
-                        group_id=group_id,
-                        message=post_text,
-                        photo_attachment=photo_attachment
-                    )
+                    # Публикуем с подписью категории
+                    post_id = self.publish_one(ann, group_id, signatures.get(ann.category, ""))
                     
                     if post_id:
                         # Обновляем статус в БД
@@ -83,7 +81,11 @@ class VKPublisher:
                     logger.error(f"Ошибка публикации объявления {ann.avito_id}: {e}")
                     stats['failed'] += 1
             
-            session.commit()
+            with DB_COMMIT_SECONDS.labels(operation='publish_vk').time():
+                session.commit()
+            
+            for result, count in stats.items():
+                PUBLISH_TOTAL.labels(destination='vk', result=result).inc(count)
             logger.info(f"Публикация завершена: опубликовано={stats['published']}, ошибок={stats['failed']}, пропущено={stats['skipped']}")
             
         except Exception as e:
@@ -94,6 +96,23 @@ class VKPublisher:
         
         return stats
     
+    def publish_one(self, ann: Announcement, group_id: int, signature: str = "") -> Optional[int]:
+        """Публикация одного объявления в группу (post_id или None), статус в БД не меняет"""
+        post_text = self._format_post(ann, signature)
+        
+        with PUBLISH_SECONDS.labels(destination='vk').time():
+            # Загружаем фото (если есть)
+            photo_attachment = None
+            if ann.image_urls and len(ann.image_urls) > 0:
+                photo_attachment = self._upload_photo(ann.image_urls[0], group_id)
+            
+            # Публикуем
+            return self._publish_to_wall(
+                group_id=group_id,
+                message=post_text,
+                photo_attachment=photo_attachment
+            )
+    
     def _format_post(self, ann: Announcement, signature: str = "") -> str:
         """Форматирование текста поста"""
         parts = []
@@ -0,0 +1,293 @@
+"""
+Кеш ответов Dashboard API - ETag по версии данных, 304, память на короткий TTL, сжатие
+
+Открытые дашборды опрашивают /api/stats, /api/announcements, /api/config, /api/cities
+каждые несколько секунд, и каждый опрос пересчитывал и сериализовал JSON заново.
+
+- версия данных - дешёвый запрос вместо пересчёта: объявления пользователя -
+  (max id, max last_updated_at, count), конфиг - mtime и размер файла; версия
+  запоминается на version_ttl секунд, так что все дашборды в это окно делят один запрос
+- ETag ответа = хеш (эндпоинт, параметры, версия); совпал If-None-Match - 304 без
+  пересчёта и без тела
+- готовое тело (и его сжатые варианты) хранится по (эндпоинт, параметры, версия)
+  ttl секунд, не больше max_entries
+- JSON-ответы API от compress_min_size байт сжимаются (br, если установлен brotli,
+  иначе gzip) - и кешируемые, и остальные
+
+Настройки (config.yaml):
+    api_cache:
+      enabled: true
+      ttl: 30                  # Секунд хранить готовое тело
+      version_ttl: 2           # Секунд доверять версии данных без нового запроса
+      max_entries: 256
+      compress_min_size: 1024  # Байт; меньше - не сжимается
+      compress_level: 6
+"""
+import functools
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+from sqlalchemy import func, select
+from models import Announcement
+from metrics import API_CACHE_TOTAL
+
+_brotli = None
+
+
+def _brotli_module():
+    """brotli при первом сжатии; False - не установлен"""
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:  # Опционально - без него только gzip
+            _brotli = False
+    return _brotli
+
+
+def _accepted(header: str, encoding: str) -> bool:
+    """Кодировка есть в Accept-Encoding и не запрещена q=0"""
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        if name.strip().lower() == encoding:
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+class ResponseCache:
+    """Версии данных, ETag и тела ответов в памяти процесса"""
+
+    def __init__(self, load_config: Callable[[], Dict], config_path: str, settings: Dict = None):
+        settings = settings or {}
+        self.load_config = load_config
+        self.config_path = config_path
+        self.enabled = settings.get('enabled', True)
+        self.ttl = float(settings.get('ttl', 30))
+        self.version_ttl = float(settings.get('version_ttl', 2))
+        self.max_entries = int(settings.get('max_entries', 256))
+        self.min_size = int(settings.get('compress_min_size', 1024))
+        self.level = int(settings.get('compress_level', 6))
+
+        self._versions: Dict[Tuple, Tuple[float, str]] = {}
+        self._entries: "OrderedDict[Tuple, Dict]" = OrderedDict()
+        self._config_cache: Tuple[Optional[Tuple], Optional[Dict]] = (None, None)
+        self._lock = threading.Lock()
+
+    # ===== ВЕРСИИ ДАННЫХ =====
+
+    def _config_stat(self) -> Tuple:
+        try:
+            stat = os.stat(self.config_path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return (0, 0)
+
+    def config(self) -> Dict:
+        """Конфиг, разобранный один раз на версию файла (для тенанта в версии данных)"""
+        stat = self._config_stat()
+        cached_stat, config = self._config_cache
+        if cached_stat != stat or config is None:
+            config = self.load_config() or {}
+            self._config_cache = (stat, config)
+        return config
+
+    def config_version(self) -> str:
+        return "config:%d:%d" % self._config_stat()
+
+    def announcements_version(self) -> str:
+        """Объявления тенанта: новые, изменённые и удалённые меняют хотя бы одно из трёх"""
+        from tenancy import tenant_id, tenant_db
+
+        config = self.config()
+        user_id = tenant_id(config)
+        table = Announcement.__table__
+        query = select(func.max(table.c.id), func.max(table.c.last_updated_at), func.count(table.c.id)).where(
+            table.c.user_id == user_id)
+        with tenant_db(config).engine.connect() as conn:
+            max_id, updated_at, count = conn.execute(query).one()
+        return f"ads:{user_id}:{max_id}:{updated_at}:{count}"
+
+    def version(self, name: str) -> str:
+        """Версия источника данных (запоминается на version_ttl)"""
+        if name == 'config':
+            return self.config_version()  # stat файла дешевле любого кеша
+
+        key = (name, self.config_version())
+        now = time.monotonic()
+        with self._lock:
+            cached = self._versions.get(key)
+        if cached and now - cached[0] < self.version_ttl:
+            return cached[1]
+
+        value = VERSIONS[name](self)
+        with self._lock:
+            if len(self._versions) > 64:
+                self._versions.clear()
+            self._versions[key] = (now, value)
+        return value
+
+    def invalidate(self):
+        """Забыть версии и тела (после записи из этого процесса - не ждать version_ttl)"""
+        with self._lock:
+            self._versions.clear()
+            self._entries.clear()
+
+    # ===== ОТВЕТЫ =====
+
+    def cached(self, *sources: str):
+        """
+        Декоратор GET-эндпоинта: ETag/304 и тело из памяти, пока версии sources не изменились
+
+        sources - 'announcements', 'config' (конфиг учитывается всегда: в нём тенант)
+        """
+        sources = tuple(dict.fromkeys(sources + ('config',)))
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return view(*args, **kwargs)
+
+                from flask import request
+
+                versions = '|'.join(self.version(source) for source in sources)
+                # Правки в одну секунду не сдвигают max(last_updated_at) - ETag живёт не дольше ttl
+                versions += '|%d' % (time.time() // self.ttl)
+                params = '&'.join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)))
+                key = (request.endpoint, request.path, params, versions)
+                etag = hashlib.sha1(repr(key).encode()).hexdigest()[:24]
+
+                if etag in request.if_none_match:
+                    API_CACHE_TOTAL.labels(endpoint=request.endpoint, result='not_modified').inc()
+                    return self._not_modified(etag)
+
+                entry = self._get(key)
+                if entry is None:
+                    API_CACHE_TOTAL.labels(endpoint=request.endpoint, result='miss').inc()
+                    response = view(*args, **kwargs)
+                    entry = self._store(key, response)
+                    if entry is None:
+                        return response  # Ошибка/не JSON - не кешируем
+                else:
+                    API_CACHE_TOTAL.labels(endpoint=request.endpoint, result='hit').inc()
+                return self._respond(entry, etag)
+
+            return wrapper
+        return decorator
+
+    def _get(self, key: Tuple) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry['created'] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key: Tuple, response) -> Optional[Dict]:
+        from flask import make_response
+
+        response = make_response(response)
+        if response.status_code != 200 or response.is_streamed or response.mimetype != 'application/json':
+            return None
+        entry = {'created': time.monotonic(), 'mimetype': response.mimetype,
+                 'bodies': {'identity': response.get_data()}}
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def _respond(self, entry: Dict, etag: str):
+        from flask import Response, request
+
+        encoding = self.encoding(request.headers.get('Accept-Encoding', ''), len(entry['bodies']['identity']))
+        body = entry['bodies'].get(encoding)
+        if body is None:
+            # Сжатый вариант - один раз на тело (гонка потоков лишь сожмёт дважды)
+            body = entry['bodies'][encoding] = self.compress(entry['bodies']['identity'], encoding)
+
+        response = Response(body, mimetype=entry['mimetype'])
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.set_etag(etag)
+        # Браузер хранит ответ, но каждый опрос сверяет ETag (дешёвый 304)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def _not_modified(self, etag: str):
+        from flask import Response
+
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+    # ===== СЖАТИЕ =====
+
+    def encoding(self, accept: str, size: int) -> str:
+        if size < self.min_size or not accept:
+            return 'identity'
+        if _accepted(accept, 'br') and _brotli_module():
+            return 'br'
+        if _accepted(accept, 'gzip'):
+            return 'gzip'
+        return 'identity'
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == 'br':
+            return _brotli_module().compress(body, quality=min(self.level, 11))
+        if encoding == 'gzip':
+            return gzip.compress(body, compresslevel=self.level, mtime=0)
+        return body
+
+    def compress_response(self, response):
+        """after_request: сжать JSON-ответ API, если он ещё не сжат"""
+        from flask import request
+
+        if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+                or response.mimetype != 'application/json' or 'Content-Encoding' in response.headers):
+            return response
+        encoding = self.encoding(request.headers.get('Accept-Encoding', ''), response.content_length or 0)
+        if encoding == 'identity':
+            return response
+        response.set_data(self.compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+# Источник данных -> версия
+VERSIONS: Dict[str, Callable[[ResponseCache], str]] = {
+    'announcements': ResponseCache.announcements_version,
+    'config': ResponseCache.config_version,
+}
+
+
+# ===== FLASK =====
+
+def install(app, load_config, config_path: str, prefix: str = "/api") -> ResponseCache:
+    """Кеш ответов приложения: cache.cached(...) для GET-эндпоинтов, сжатие JSON под prefix"""
+    from flask import request
+
+    cache = ResponseCache(load_config, config_path, (load_config() or {}).get('api_cache'))
+
+    @app.after_request
+    def compress_api_response(response):
+        if not cache.enabled or not request.path.startswith(prefix):
+            return response
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            cache.invalidate()  # Своя запись видна следующему опросу сразу
+        return cache.compress_response(response)
+
+    return cache
@@ -0,0 +1,317 @@
+"""
+Хранение данных (retention) - старые объявления и логи переезжают в сжатые архивы
+
+Опубликованные/отфильтрованные объявления старше retention.days выгружаются в JSONL,
+сжатый zstd (pip install zstandard) или gzip, с разбивкой по месяцу и категории:
+    data/archive/2026-01/avtomobili/announcements.jsonl.zst
+и удаляются из БД. Их avito_id остаются в archived_announcements, поэтому парсер
+не сохранит их повторно как новые. Освободившиеся страницы SQLite возвращаются
+PRAGMA incremental_vacuum небольшими порциями, без полного VACUUM на каждом проходе.
+
+Настройки (config.yaml):
+    retention:
+      enabled: false
+      days: 90                 # Объявления старше - в архив
+      statuses: [published, filtered, duplicate]
+      logs_days: 30            # Логи старше - в архив
+      archive_dir: data/archive
+      compression: zstd        # zstd или gzip
+      batch_size: 1000
+      vacuum_pages: 2000       # Страниц за проход (0 - не трогать файл БД)
+      interval_hours: 24
+
+Вручную:
+    python retention.py --dry-run
+    python retention.py --days 180
+"""
+import gzip
+import io
+import json
+import os
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Set
+from loguru import logger
+from export import json_default
+from models import Announcement, ArchivedAnnouncement, ImageHash, Log, PriceChange, UnitAnnouncement
+from tenancy import tenant_db
+
+try:
+    import zstandard
+except ImportError:  # Опционально - без него архивы пишутся в gzip
+    zstandard = None
+
+EXTENSIONS = {'zstd': '.jsonl.zst', 'gzip': '.jsonl.gz'}
+
+
+def archived_ids(session, user_id: int, avito_ids: Iterable[str]) -> Set[str]:
+    """Какие из avito_id уже ушли в архив (для дедупликации при сохранении)"""
+    avito_ids = list(avito_ids)
+    if not avito_ids:
+        return set()
+    rows = session.query(ArchivedAnnouncement.avito_id).filter(
+        ArchivedAnnouncement.user_id == user_id,
+        ArchivedAnnouncement.avito_id.in_(avito_ids),
+    )
+    return {row[0] for row in rows}
+
+
+def iter_archive(path: str) -> Iterator[Dict]:
+    """Строки файла архива (для восстановления и выгрузок)"""
+    with open(path, 'rb') as raw:
+        if path.endswith('.zst'):
+            if zstandard is None:
+                raise RuntimeError("Для чтения .zst нужен пакет zstandard")
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+        else:
+            stream = gzip.GzipFile(fileobj=raw)
+        for line in io.TextIOWrapper(stream, encoding='utf-8'):
+            if line.strip():
+                yield json.loads(line)
+
+
+class RetentionManager:
+    """Перенос старых строк в архивные файлы и возврат места в БД"""
+
+    def __init__(self, config: Dict, database=None):
+        settings = config.get('retention') or {}
+        self.db = database or tenant_db(config)
+        self.days = int(settings.get('days', 90))
+        self.statuses = list(settings.get('statuses', ['published', 'filtered', 'duplicate']))
+        self.logs_days = int(settings.get('logs_days', 30))
+        self.archive_dir = settings.get('archive_dir', 'data/archive')
+        self.batch_size = int(settings.get('batch_size', 1000))
+        self.vacuum_pages = int(settings.get('vacuum_pages', 2000))
+        self.interval_hours = float(settings.get('interval_hours', 24))
+
+        self.compression = settings.get('compression', 'zstd')
+        if self.compression == 'zstd' and zstandard is None:
+            logger.warning("zstandard не установлен - архивы пишутся в gzip")
+            self.compression = 'gzip'
+
+        ArchivedAnnouncement.__table__.create(bind=self.db.engine, checkfirst=True)
+
+    def run(self, dry_run: bool = False, job=None) -> Dict[str, int]:
+        """
+        Один проход: объявления, логи, vacuum
+
+        Args:
+            dry_run: только посчитать, ничего не писать и не удалять
+            job: JobHandle - прогресс и отмена (между пачками)
+        """
+        now = datetime.now()
+        stats = {'announcements': 0, 'logs': 0, 'vacuum_pages': 0}
+
+        if job:
+            job.progress(current_source='архив объявлений')
+        stats['announcements'] = self.archive_announcements(now - timedelta(days=self.days), dry_run, job)
+
+        if not (job and job.cancelled):
+            if job:
+                job.progress(current_source='архив логов')
+            stats['logs'] = self.archive_logs(now - timedelta(days=self.logs_days), dry_run, job)
+
+        if not dry_run and not (job and job.cancelled) and (stats['announcements'] or stats['logs']):
+            stats['vacuum_pages'] = self.vacuum()
+
+        logger.info(f"🗄️ Retention{' (dry run)' if dry_run else ''}: {stats}")
+        return stats
+
+    # ===== ОБЪЯВЛЕНИЯ =====
+
+    def archive_announcements(self, cutoff: datetime, dry_run: bool = False, job=None) -> int:
+        """Объявления старше cutoff с конечным статусом - в архив, пачками по batch_size"""
+        conditions = (Announcement.created_at < cutoff, Announcement.status.in_(self.statuses))
+        if dry_run:
+            return self._count(Announcement, *conditions)
+
+        import image_hash
+        total = 0
+        last_id = 0
+
+        while not (job and job.cancelled):
+            session = self.db.get_session()
+            try:
+                batch = (
+                    session.query(Announcement)
+                    .filter(Announcement.id > last_id, *conditions)
+                    .order_by(Announcement.id)
+                    .limit(self.batch_size)
+                    .all()
+                )
+                if not batch:
+                    break
+                last_id = batch[-1].id
+
+                # Сначала файл, потом удаление: при сбое строка останется в БД и попадёт
+                # в архив повторно, но не потеряется
+                paths = self._write(
+                    batch, lambda ann: (_month(ann.created_at), _slug(ann.category)), 'announcements')
+                self.db.insert(session, ArchivedAnnouncement, [
+                    {
+                        'user_id': ann.user_id,
+                        'avito_id': ann.avito_id,
+                        'content_hash': ann.content_hash,
+                        'archive_path': paths[ann.id],
+                    }
+                    for ann in batch
+                ], conflict=('user_id', 'avito_id'))
+
+                ids = [ann.id for ann in batch]
+                session.query(UnitAnnouncement).filter(
+                    UnitAnnouncement.announcement_id.in_(ids)).delete(synchronize_session=False)
+                session.query(PriceChange).filter(
+                    PriceChange.announcement_id.in_(ids)).delete(synchronize_session=False)
+                session.query(ImageHash).filter(
+                    ImageHash.announcement_id.in_(ids)).delete(synchronize_session=False)
+                session.query(Announcement).filter(Announcement.id.in_(ids)).delete(synchronize_session=False)
+                session.commit()
+                total += len(batch)
+                image_hash.forget(self.db, ids)  # Хеши архивных объявлений - больше не совпадения
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+        return total
+
+    # ===== ЛОГИ =====
+
+    def archive_logs(self, cutoff: datetime, dry_run: bool = False, job=None) -> int:
+        """Логи старше cutoff - в архив"""
+        if dry_run:
+            return self._count(Log, Log.created_at < cutoff)
+
+        total = 0
+
+        while not (job and job.cancelled):
+            session = self.db.get_session()
+            try:
+                batch = (
+                    session.query(Log)
+                    .filter(Log.created_at < cutoff)
+                    .order_by(Log.id)
+                    .limit(self.batch_size)
+                    .all()
+                )
+                if not batch:
+                    break
+
+                self._write(batch, lambda log: (_month(log.created_at), 'logs'), 'logs')
+                session.query(Log).filter(Log.id.in_([log.id for log in batch])).delete(synchronize_session=False)
+                session.commit()
+                total += len(batch)
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+        return total
+
+    def _count(self, model, *conditions) -> int:
+        session = self.db.get_session()
+        try:
+            return session.query(model).filter(*conditions).count()
+        finally:
+            session.close()
+
+    # ===== ФАЙЛЫ =====
+
+    def _write(self, rows: List, partition, name: str) -> Dict[int, str]:
+        """
+        Дописать строки в файлы разделов (каждый вызов - отдельный сжатый кадр в конце файла)
+
+        Returns:
+            {id строки: путь файла относительно archive_dir}
+        """
+        groups: Dict[tuple, List] = defaultdict(list)
+        for row in rows:
+            groups[partition(row)].append(row)
+
+        paths = {}
+        for parts, group in groups.items():
+            relpath = os.path.join(*parts, name + EXTENSIONS[self.compression])
+            path = os.path.join(self.archive_dir, relpath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            payload = ''.join(json.dumps(_row_dict(row), ensure_ascii=False, default=json_default) + '\n'
+                              for row in group).encode('utf-8')
+            with open(path, 'ab') as f:
+                f.write(self._compress(payload))
+
+            for row in group:
+                paths[row.id] = relpath
+        return paths
+
+    def _compress(self, payload: bytes) -> bytes:
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor(level=10).compress(payload)
+        return gzip.compress(payload)
+
+    # ===== VACUUM =====
+
+    def vacuum(self) -> int:
+        """Вернуть свободные страницы SQLite порцией vacuum_pages (PostgreSQL - autovacuum)"""
+        if not self.vacuum_pages or self.db.engine.dialect.name != 'sqlite':
+            return 0
+
+        with self.db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+                # Режим INCREMENTAL включается только полным VACUUM - один раз
+                logger.info("🗄️ Перевод БД в auto_vacuum=INCREMENTAL (однократный VACUUM)")
+                conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.exec_driver_sql("VACUUM")
+                return 0
+
+            free = conn.exec_driver_sql("PRAGMA freelist_count").scalar() or 0
+            # sqlite3.execute делает один шаг прагмы (= одна страница), executescript - до конца
+            conn.connection.dbapi_connection.executescript(f"PRAGMA incremental_vacuum({self.vacuum_pages})")
+            conn.exec_driver_sql("PRAGMA optimize")
+            return free - (conn.exec_driver_sql("PRAGMA freelist_count").scalar() or 0)
+
+
+def _month(value) -> str:
+    return (value or datetime.now()).strftime('%Y-%m')
+
+
+def _slug(category) -> str:
+    return re.sub(r'[^\w-]+', '_', category or '') or 'other'
+
+
+def _row_dict(row) -> Dict:
+    return {column.name: getattr(row, column.name) for column in row.__table__.columns}
+
+
+def main():
+    import argparse
+    import yaml
+    from database import db
+
+    parser = argparse.ArgumentParser(description="Архивация старых объявлений и логов")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--days", type=int, help="Объявления старше N дней (по умолчанию retention.days)")
+    parser.add_argument("--logs-days", type=int, help="Логи старше N дней (по умолчанию retention.logs_days)")
+    parser.add_argument("--dry-run", action="store_true", help="Только посчитать")
+    args = parser.parse_args()
+
+    config = {}
+    if os.path.exists(args.config):
+        with open(args.config, 'r', encoding='utf-8') as f:
+            config = yaml.safe_load(f) or {}
+
+    settings = config['retention'] = dict(config.get('retention') or {})
+    if args.days is not None:
+        settings['days'] = args.days
+    if args.logs_days is not None:
+        settings['logs_days'] = args.logs_days
+
+    db.configure(config.get('database'))
+    db.init_db()
+    RetentionManager(config).run(dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""
+Правила отбора объявлений - общие, на город и на единицу
+
+Набор правил - словарь (config.yaml или JSON в units.rules). Набор компилируется один
+раз: условия сливаются в одно выражение (сравнения раньше текста, пустые правила
+выбрасываются), из него собираются предикат и пакетный отбор (list comprehension без
+вызова функции на объявление). Скомпилированное кешируется по содержимому набора.
+
+Для пачки объявлений (route) признаки считаются один раз на объявление и общие для
+всех наборов: цена, автор и - главное - какие слова и выражения из словаря всех
+наборов есть в тексте. Проверка ключевых слов набора тогда - пересечение множеств,
+а не поиск по тексту, и тысячи единиц на одном источнике разбирают страницу за мс.
+
+Правила (все необязательные, объявление проходит, если выполнены все):
+    price:                     # Цена в рублях; 0 и None - цены нет
+      min: 1000
+      max: 5000000
+      allow_missing: false     # Пропускать объявления без цены
+    include: ["лада", "re:тойот[аы]"]   # Хотя бы одно в заголовке/описании
+    exclude: ["битый", "на запчасти"]   # Ни одного
+    author_types: [private]             # Только эти типы продавца
+    exclude_author_types: [business]
+    location: ["центр", "re:ул\\. ?ленина"]   # Хотя бы одно в адресе/городе
+    exclude_location: ["пос. Северный"]
+    max_age_hours: 48          # По published_at, иначе по первому появлению у нас
+    min_description: 10        # Символов в описании
+    required: [title, url]     # Непустые поля
+
+Слова сравниваются без учёта регистра, как подстроки; re: - регулярные выражения.
+"""
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Прежние жёсткие фильтры ImprovedAvitoParser.filter_announcements
+DEFAULT_RULES = {
+    'exclude_author_types': ['business'],
+    'price': {'min': 1},
+    'min_description': 10,
+}
+
+RULE_KEYS = {
+    'price', 'include', 'exclude', 'author_types', 'exclude_author_types',
+    'location', 'exclude_location', 'max_age_hours', 'min_description', 'required',
+}
+
+# Признаки объявления - индексы в кортеже features()
+PRICE, AUTHOR, SEEN, DESCRIPTION, AD, TEXT_TERMS, PLACE_TERMS = range(7)
+
+Features = Tuple
+Vocabulary = Tuple[Tuple[str, ...], Tuple[Tuple[str, Callable], ...]]
+EMPTY_VOCABULARY: Vocabulary = ((), ())
+
+
+class RuleError(ValueError):
+    """Ошибка в наборе правил (неизвестный ключ, плохое регулярное выражение, ...)"""
+
+
+# ===== ПРИЗНАКИ =====
+
+_patterns: Dict[str, "re.Pattern"] = {}
+
+
+def _pattern(term: str) -> "re.Pattern":
+    """Скомпилированное re:-выражение (без учёта регистра, одно на процесс)"""
+    pattern = _patterns.get(term)
+    if pattern is None:
+        pattern = _patterns[term] = re.compile(term[3:], re.IGNORECASE)
+    return pattern
+
+
+def vocabulary(terms: Iterable[str]) -> Vocabulary:
+    """Слова и re:-выражения наборов - (слова, (выражение, search)) для features()"""
+    words, patterns = [], []
+    for term in terms:
+        if term.startswith('re:'):
+            patterns.append((term, _pattern(term).search))
+        else:
+            words.append(term)
+    return tuple(words), tuple(patterns)
+
+
+def _found(value: str, lookup: Vocabulary) -> frozenset:
+    words, patterns = lookup
+    found = [word for word in words if word in value]
+    if patterns:
+        found += [term for term, search in patterns if search(value) is not None]
+    return frozenset(found)
+
+
+def _timestamp(value) -> Optional[float]:
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        # Без часового пояса - UTC, как created_at в БД
+        return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return _timestamp(datetime.fromisoformat(str(value)))
+    except ValueError:
+        return None
+
+
+def features(ad: Dict, text_terms: Vocabulary = EMPTY_VOCABULARY,
+             place_terms: Vocabulary = EMPTY_VOCABULARY) -> Features:
+    """
+    Признаки, которые нужны правилам, - один раз на объявление
+
+    Args:
+        text_terms, place_terms: словарь наборов (vocabulary()) - в признаки попадают
+            слова и выражения, которые есть в заголовке+описании / адресе+городе
+    """
+    description = ad.get('description') or ''
+    text = f"{ad.get('title') or ''} {description}".lower() if text_terms != EMPTY_VOCABULARY else ''
+    place = f"{ad.get('location') or ''} {ad.get('city') or ''}".lower() if place_terms != EMPTY_VOCABULARY else ''
+    return (
+        ad.get('price') or None,
+        ad.get('author_type'),
+        _timestamp(ad.get('published_at') or ad.get('first_seen')),
+        len(description),
+        ad,
+        _found(text, text_terms),
+        _found(place, place_terms),
+    )
+
+
+# ===== КОМПИЛЯЦИЯ =====
+
+def _terms(words, key: str) -> frozenset:
+    """Слова в нижнем регистре и проверенные re:-выражения"""
+    if isinstance(words, str):
+        words = [words]
+    if not isinstance(words, (list, tuple, set)):
+        raise RuleError(f"{key}: нужен список слов")
+    terms = set()
+    for word in words:
+        word = str(word)
+        if word.startswith('re:'):
+            try:
+                _pattern(word)
+            except re.error as e:
+                raise RuleError(f"{key}: {word[3:]!r} - {e}")
+            terms.add(word)
+        elif word.strip():
+            terms.add(word.strip().lower())
+    return frozenset(terms)
+
+
+def _names(values, key: str) -> frozenset:
+    """Список строк (типы продавца, поля объявления); одна строка - список из неё"""
+    if isinstance(values, str):
+        values = [values]
+    if not isinstance(values, (list, tuple, set)) or not all(isinstance(value, str) for value in values):
+        raise RuleError(f"{key}: нужен список строк, получено {values!r}")
+    return frozenset(value.strip() for value in values if value.strip())
+
+
+def _number(spec: Dict, name: str, key: str = '') -> Optional[float]:
+    value = spec.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise RuleError(f"{key + '.' if key else ''}{name}: нужно число, получено {value!r}")
+
+
+def _compile(spec: Dict) -> Tuple[List[str], Dict, Dict[int, frozenset]]:
+    """
+    Условия набора - выражения Python над признаками f
+
+    Значения правил в текст выражений не попадают - только имена v1, v2, ... из
+    bindings, поэтому строки из правил не могут стать кодом.
+
+    Returns:
+        (условия, {имя: значение}, {TEXT_TERMS/PLACE_TERMS: слова и выражения})
+    """
+    unknown = set(spec) - RULE_KEYS
+    if unknown:
+        raise RuleError(f"Неизвестные правила: {', '.join(sorted(unknown))}")
+    conditions: List[str] = []
+    bindings: Dict = {'now': time.time}
+
+    def bind(value) -> str:
+        name = f"v{len(bindings)}"
+        bindings[name] = value
+        return name
+
+    price = spec.get('price')
+    if price:
+        if not isinstance(price, dict):
+            raise RuleError("price: нужен словарь min/max/allow_missing")
+        low, high = _number(price, 'min', 'price'), _number(price, 'max', 'price')
+        bounds = []
+        if low is not None:
+            bounds.append(f"{bind(low)} <= f[{PRICE}]")
+        if high is not None:
+            bounds.append(f"f[{PRICE}] <= {bind(high)}")
+        if price.get('allow_missing'):
+            if bounds:
+                conditions.append(f"f[{PRICE}] is None or ({' and '.join(bounds)})")
+        else:
+            conditions.append(' and '.join([f"f[{PRICE}] is not None"] + bounds))
+
+    author_types = _names(spec.get('author_types') or [], 'author_types')
+    if author_types:
+        conditions.append(f"f[{AUTHOR}] in {bind(author_types)}")
+    exclude_author_types = _names(spec.get('exclude_author_types') or [], 'exclude_author_types')
+    if exclude_author_types:
+        conditions.append(f"f[{AUTHOR}] not in {bind(exclude_author_types)}")
+
+    min_description = _number(spec, 'min_description')
+    if min_description:
+        conditions.append(f"f[{DESCRIPTION}] >= {bind(min_description)}")
+
+    max_age = _number(spec, 'max_age_hours')
+    if max_age is not None:
+        # Дата неизвестна - не отбрасываем
+        conditions.append(f"f[{SEEN}] is None or now() - f[{SEEN}] <= {bind(max_age * 3600)}")
+
+    for name in sorted(_names(spec.get('required') or [], 'required')):
+        conditions.append(f"f[{AD}].get({bind(name)})")
+
+    # Текст - после сравнений: пересечение со словами/выражениями, найденными в features()
+    terms = {TEXT_TERMS: frozenset(), PLACE_TERMS: frozenset()}
+    for key, found, wanted in (
+        ('include', TEXT_TERMS, True),
+        ('exclude', TEXT_TERMS, False),
+        ('location', PLACE_TERMS, True),
+        ('exclude_location', PLACE_TERMS, False),
+    ):
+        words = _terms(spec.get(key) or [], key)
+        if not words:
+            continue
+        terms[found] |= words
+        test = f"{bind(words)}.isdisjoint(f[{found}])"
+        conditions.append(f"not {test}" if wanted else test)
+
+    return conditions, bindings, terms
+
+
+class RuleSet:
+    """Скомпилированный набор правил: rules(ad) -> bool, rules.select(ads) -> прошедшие"""
+
+    def __init__(self, spec: Dict):
+        self.spec = spec
+        conditions, bindings, terms = _compile(spec)
+        self.empty = not conditions
+        self.text_terms = terms[TEXT_TERMS]
+        self.place_terms = terms[PLACE_TERMS]
+        self._text_vocabulary = vocabulary(self.text_terms)
+        self._place_vocabulary = vocabulary(self.place_terms)
+
+        # Одно выражение на набор: и для предиката, и внутри пакетного отбора
+        expression = ' and '.join(f"({condition})" for condition in conditions) or 'True'
+        source = (
+            f"def check(f):\n    return bool({expression})\n"
+            f"def select(prepared):\n    return [f[{AD}] for f in prepared if {expression}]\n"
+        )
+        exec(compile(source, '<rules>', 'exec'), bindings)
+        self.check: Callable[[Features], bool] = bindings['check']
+        self._select = bindings['select']
+
+    def __call__(self, ad: Dict) -> bool:
+        return self.empty or self.check(features(ad, self._text_vocabulary, self._place_vocabulary))
+
+    def select(self, ads: List[Dict], prepared: List[Features] = None) -> List[Dict]:
+        """
+        Прошедшие правила
+
+        Args:
+            prepared: уже посчитанные features() тех же объявлений (со словарём,
+                      включающим text_terms/place_terms этого набора)
+        """
+        if self.empty:
+            return list(ads)
+        if prepared is None:
+            prepared = [features(ad, self._text_vocabulary, self._place_vocabulary) for ad in ads]
+        return self._select(prepared)
+
+
+_compiled: Dict[str, RuleSet] = {}
+_compiled_lock = threading.Lock()
+_MAX_COMPILED = 4096
+
+
+def compile_rules(spec: Optional[Dict]) -> RuleSet:
+    """Скомпилированный набор (одинаковые наборы компилируются один раз на процесс)"""
+    if isinstance(spec, str):
+        spec = parse(spec)
+    spec = spec or {}
+    if not isinstance(spec, dict):
+        raise RuleError("Правила - словарь")
+    key = json.dumps(spec, sort_keys=True, ensure_ascii=False, default=str)
+    with _compiled_lock:
+        rules = _compiled.get(key)
+    if rules is None:
+        rules = RuleSet(spec)
+        with _compiled_lock:
+            if len(_compiled) >= _MAX_COMPILED:
+                _compiled.clear()
+            rules = _compiled.setdefault(key, rules)
+    return rules
+
+
+def merge(*specs: Optional[Dict]) -> Dict:
+    """Наложить наборы: ключи следующих заменяют ключи предыдущих (exclude - дополняют)"""
+    result: Dict = {}
+    for spec in specs:
+        for key, value in (spec or {}).items():
+            if key == 'exclude' and result.get('exclude'):
+                value = list(result['exclude']) + list([value] if isinstance(value, str) else value)
+            result[key] = value
+    return result
+
+
+def parse(text: Optional[str]) -> Dict:
+    """Правила из JSON (колонка units.rules); пусто - без правил"""
+    if not text:
+        return {}
+    try:
+        spec = json.loads(text)
+    except ValueError as e:
+        raise RuleError(f"Правила не JSON: {e}")
+    if not isinstance(spec, dict):
+        raise RuleError("Правила - словарь")
+    return spec
+
+
+# ===== РАЗДАЧА ПО ПОДПИСЧИКАМ =====
+
+def route(ads: List[Dict], rule_sets: Dict[object, RuleSet]) -> Dict[object, List[Dict]]:
+    """
+    Объявления каждому подписчику по его правилам
+
+    Признаки (со словарём слов всех наборов) считаются один раз на объявление,
+    подписчики с одинаковыми правилами (один скомпилированный RuleSet) - один раз.
+    """
+    distinct = list({id(rules): rules for rules in rule_sets.values()}.values())
+    text_terms = vocabulary(frozenset().union(*(rules.text_terms for rules in distinct)))
+    place_terms = vocabulary(frozenset().union(*(rules.place_terms for rules in distinct)))
+    prepared = [features(ad, text_terms, place_terms) for ad in ads]
+
+    selected = {id(rules): rules.select(ads, prepared) for rules in distinct}
+    return {key: selected[id(rules)] for key, rules in rule_sets.items()}
@@ -0,0 +1,282 @@
+"""
+Полнотекстовый поиск по объявлениям - SQLite FTS5 (bm25, подсветка совпадений)
+
+Индекс announcements_fts (title, description, location) - external content над
+announcements: текст хранится один раз, индекс синхронизируют триггеры, поэтому
+парсер, публикаторы и retention ничего про поиск не знают.
+
+Русский: unicode61 приводит кириллицу к нижнему регистру, слова запроса обрезаются
+до основы и ищутся по префиксу ("квартиры" -> квартир*), так что находятся и
+"квартира", и "квартирный"; е в запросе совпадает и с ё.
+
+API:
+    GET /api/announcements/search?q=гараж кирпичный&category=&status=&limit=20&offset=0&cursor=
+    (cursor из ответа на первую страницу - следующие страницы ранжируются в том же окне)
+"""
+import html
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from loguru import logger
+from sqlalchemy import text
+
+FTS_TABLE = "announcements_fts"
+
+FTS_SCHEMA = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, description, location,
+        content='announcements', content_rowid='id',
+        prefix='3 4 5 6',
+        tokenize="unicode61 remove_diacritics 2"
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS announcements_fts_insert AFTER INSERT ON announcements BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, description, location)
+        VALUES (new.id, new.title, new.description, new.location);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS announcements_fts_delete AFTER DELETE ON announcements BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description, location)
+        VALUES ('delete', old.id, old.title, old.description, old.location);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS announcements_fts_update AFTER UPDATE OF title, description, location ON announcements BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description, location)
+        VALUES ('delete', old.id, old.title, old.description, old.location);
+        INSERT INTO {FTS_TABLE}(rowid, title, description, location)
+        VALUES (new.id, new.title, new.description, new.location);
+    END
+    """,
+]
+
+# Вес совпадения в заголовке выше, чем в описании
+RANK = "bm25(10.0, 1.0, 2.0)"
+
+# Окончания для обрезки слов запроса (длинные раньше коротких)
+RU_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'иях', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ых', 'их', 'ую', 'юю',
+    'ов', 'ев', 'ам', 'ям', 'ах', 'ях', 'ом', 'ем',
+    'а', 'я', 'ы', 'и', 'у', 'ю', 'е', 'о', 'ь',
+], key=len, reverse=True)
+MIN_STEM = 3
+# Длиннее - обрезается: префиксы 3-6 букв лежат в отдельных индексах (prefix='3 4 5 6'),
+# поиск по ним не перебирает все слова с таким началом
+MAX_PREFIX = 6
+
+# Ранжирование bm25 считается для каждого совпадения, поэтому сначала ищем среди
+# последних WINDOW объявлений и расширяем окно, только если там не набралось
+WINDOW = 10000
+WINDOW_GROWTH = 10
+
+# Маркеры подсветки: текст объявления экранируется, потом маркеры становятся <mark>
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+_ready = set()
+_ready_lock = threading.Lock()
+
+
+def available(database) -> bool:
+    """FTS5 есть только в SQLite"""
+    return database.engine.dialect.name == 'sqlite'
+
+
+def ensure_index(database):
+    """Создать индекс и триггеры; новый индекс заполняется из уже сохранённых объявлений"""
+    key = id(database)
+    if key in _ready or not available(database):
+        return
+
+    with _ready_lock:
+        if key in _ready:
+            return
+        with database.engine.begin() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': FTS_TABLE}
+            ).first()
+            for statement in FTS_SCHEMA:
+                conn.exec_driver_sql(statement)
+            if not exists:
+                start = time.perf_counter()
+                conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+                conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', '{RANK}')")
+                logger.info(f"🔎 Поисковый индекс построен за {time.perf_counter() - start:.1f} c")
+        _ready.add(key)
+
+
+def stem(word: str) -> str:
+    """Основа русского слова (грубо: без окончания)"""
+    for ending in RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def build_match(query: str) -> Optional[str]:
+    """Запрос пользователя -> выражение MATCH (все слова, каждое по префиксу основы)"""
+    terms = []
+    for word in re.findall(r'\w+', query.lower()):
+        if len(word) < 2:
+            continue
+        variants = _yo_variants(stem(word.replace('ё', 'е'))[:MAX_PREFIX])
+        if len(variants) == 1:
+            terms.append(f'"{variants[0]}"*')
+        else:
+            terms.append('(' + ' OR '.join(f'"{v}"*' for v in variants) + ')')
+    return ' AND '.join(terms) or None
+
+
+def _yo_variants(word: str) -> List[str]:
+    """unicode61 не сводит ё к е: "елка" ищем и как "ёлка" (ё в слове не больше одной)"""
+    return [word] + [word[:i] + 'ё' + word[i + 1:] for i, ch in enumerate(word) if ch == 'е']
+
+
+def parse_cursor(cursor: str) -> Tuple[int, int]:
+    """"верхний id:нижний id" -> (upper, lower); ValueError - не курсор"""
+    upper, lower = (int(part) for part in cursor.split(':'))
+    if not 0 <= lower <= upper:
+        raise ValueError(cursor)
+    return upper, lower
+
+
+def search(database, user_id: int, query: str, category: str = None, status: str = None,
+           limit: int = 20, offset: int = 0, cursor: str = None) -> Dict:
+    """
+    Объявления пользователя по запросу, лучшие совпадения (bm25) первыми
+
+    Ранжируются свежие объявления: окно id (lower, upper] - последние WINDOW, при
+    нехватке результатов для offset + limit - в WINDOW_GROWTH раз шире, пока не
+    охватит всю таблицу. Совпадения старше окна идут после всех совпадений окна,
+    ранжированные между собой. Окно возвращается курсором: страницы с тем же
+    cursor - срезы одного порядка (без повторов и пропусков).
+
+    Returns:
+        {'results': [...], 'cursor': "upper:lower"}
+    """
+    match = build_match(query)
+    if not match:
+        return {'results': [], 'cursor': cursor}
+
+    ensure_index(database)
+    where = f"""
+        FROM {FTS_TABLE}
+        JOIN announcements a ON a.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH :match AND {FTS_TABLE}.rowid > :lower AND {FTS_TABLE}.rowid <= :upper
+          AND a.user_id = :user_id
+    """
+    params = {'match': match, 'user_id': user_id, 'start': _MARK_START, 'end': _MARK_END}
+    if category:
+        where += " AND a.category = :category"
+        params['category'] = category
+    if status:
+        where += " AND a.status = :status"
+        params['status'] = status
+    sql = f"""
+        SELECT a.id, a.avito_id, a.title, a.price, a.category, a.url, a.location, a.status,
+               a.published_to_vk, a.created_at,
+               {FTS_TABLE}.rank AS rank,
+               highlight({FTS_TABLE}, 0, :start, :end) AS title_highlight,
+               snippet({FTS_TABLE}, 1, :start, :end, '…', 24) AS description_snippet
+        {where}
+        ORDER BY {FTS_TABLE}.rank LIMIT :limit OFFSET :offset
+    """
+
+    with database.engine.connect() as conn:
+        def page(lower: int, upper: int, count: int, skip: int) -> List:
+            return conn.execute(text(sql), dict(params, lower=lower, upper=upper, limit=count,
+                                                offset=skip)).mappings().all()
+
+        if cursor:
+            upper, lower = parse_cursor(cursor)
+            rows = page(lower, upper, limit, offset)
+        else:
+            upper = conn.execute(text("SELECT MAX(id) FROM announcements")).scalar() or 0
+            window = WINDOW
+            while True:
+                lower = upper - window if window < upper else 0
+                rows = page(lower, upper, limit, offset)
+                if len(rows) == limit or not lower:
+                    break
+                window *= WINDOW_GROWTH
+
+        if len(rows) < limit and lower:
+            # Совпадения окна кончились - дальше объявления старше окна
+            in_window = offset + len(rows) if rows else conn.execute(
+                text(f"SELECT COUNT(*) {where}"), dict(params, lower=lower, upper=upper)).scalar()
+            rows = list(rows) + list(page(0, lower, limit - len(rows), max(offset - in_window, 0)))
+
+    results = [
+        {
+            'id': row['id'],
+            'avito_id': row['avito_id'],
+            'title': row['title'],
+            'price': row['price'],
+            'category': row['category'],
+            'url': row['url'],
+            'location': row['location'],
+            'status': row['status'],
+            'published_to_vk': bool(row['published_to_vk']),
+            'created_at': row['created_at'],
+            'rank': round(row['rank'], 4),
+            'title_highlight': _marks(row['title_highlight']),
+            'description_snippet': _marks(row['description_snippet']),
+        }
+        for row in rows
+    ]
+    return {'results': results, 'cursor': f"{upper}:{lower}"}
+
+
+def _marks(value: Optional[str]) -> Optional[str]:
+    """Экранировать текст объявления и превратить маркеры совпадений в <mark>"""
+    if value is None:
+        return None
+    return html.escape(value).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+# ===== FLASK =====
+
+def install(app, load_config, prefix: str = "/api/announcements/search"):
+    """GET {prefix}?q=...&category=&status=&limit=20&offset=0&cursor= - поиск по объявлениям"""
+    from flask import jsonify, request
+    from tenancy import tenant_id, tenant_db
+
+    @app.route(prefix, methods=['GET'])
+    def search_announcements():
+        q = (request.args.get('q') or '').strip()
+        if not q:
+            return jsonify({'error': 'Пустой запрос (?q=...)'}), 400
+
+        config = load_config()
+        database = tenant_db(config)
+        if not available(database):
+            return jsonify({'error': 'Полнотекстовый поиск доступен только на SQLite (FTS5)'}), 501
+
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        cursor = request.args.get('cursor') or None
+        if cursor:
+            try:
+                parse_cursor(cursor)
+            except ValueError:
+                return jsonify({'error': f"Неверный cursor: {cursor}"}), 400
+
+        start = time.perf_counter()
+        found = search(database, tenant_id(config), q,
+                       category=request.args.get('category') or None,
+                       status=request.args.get('status') or None,
+                       limit=limit, offset=offset, cursor=cursor)
+
+        return jsonify({
+            'query': q,
+            'match': build_match(q),
+            'results': found['results'],
+            'cursor': found['cursor'],
+            'took_ms': round((time.perf_counter() - start) * 1000, 2),
+        })
+
+    return search_announcements
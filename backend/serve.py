@@ -0,0 +1,192 @@
+"""
+Запуск Dashboard API для продакшена - несколько воркеров, приложение загружено до fork
+
+`python api.py` - отладочный сервер Flask (debug, reloader, один процесс): для
+разработки. За nginx (SETUP_NGINX.md) - этот скрипт:
+
+    python serve.py                      # api.py, настройки из секции server
+    python serve.py api_improved --workers 4 --threads 8 --bind 127.0.0.1:5000
+    python serve.py api_units
+
+- установлен gunicorn - его мастер и воркеры gthread (workers процессов по threads потоков),
+  preload_app: приложение импортируется и setup() выполняется один раз в мастере
+- нет gunicorn - тот же prefork на werkzeug: сокет открывается в мастере, workers
+  дочерних процессов принимают соединения с него (поток на запрос), упавший воркер
+  перезапускается; без fork (Windows) - один процесс с потоками
+
+Состояние процесса после fork сбрасывают сами модули (os.register_at_fork): пулы
+соединений БД, поток записи логов, потоки задач. Кеши процесса согласованы между
+воркерами, потому что строятся по общему хранилищу: ETag response_cache - по версии
+данных в БД и mtime конфига (одинаков в любом воркере), конфиг читается с диска,
+отмена задачи другого воркера - флагом в таблице jobs. Счётчики /metrics - свои у
+каждого воркера.
+
+Настройки (config.yaml):
+    server:
+      bind: "0.0.0.0:5000"
+      workers: 2           # Процессов
+      threads: 8           # Потоков на процесс (gunicorn); SSE /api/jobs/stream держит поток
+      timeout: 120         # Секунд без ответа воркера до перезапуска (gunicorn)
+      access_log: false    # Строка на запрос в stderr (обычно пишет nginx)
+"""
+import argparse
+import importlib
+import os
+import signal
+import sys
+import threading
+import time
+from typing import Dict
+import yaml
+from loguru import logger
+
+APPS = ('api', 'api_improved', 'api_units')
+CONFIG_PATH = "config.yaml"
+
+
+def load_settings(path: str = CONFIG_PATH) -> Dict:
+    """Секция server из config.yaml"""
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return (yaml.safe_load(f) or {}).get('server') or {}
+    return {}
+
+
+def load_app(name: str):
+    """Импорт модуля API и его setup() - один раз, до fork"""
+    module = importlib.import_module(name)
+    setup = getattr(module, 'setup', None)
+    if setup:
+        setup()
+    return module.app
+
+
+# ===== GUNICORN =====
+
+def serve_gunicorn(app, bind: str, workers: int, threads: int, timeout: int, access_log: bool):
+    from gunicorn.app.base import BaseApplication
+
+    options = {
+        'bind': bind,
+        'workers': workers,
+        'threads': threads,
+        'worker_class': 'gthread',
+        'preload_app': True,
+        'timeout': timeout,
+        'accesslog': '-' if access_log else None,
+    }
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    Application().run()
+
+
+# ===== PREFORK НА WERKZEUG =====
+
+def serve_prefork(app, bind: str, workers: int, access_log: bool):
+    """Сокет в мастере, workers процессов на нём; мастер перезапускает упавших"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class RequestHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            if access_log:
+                super().log_request(*args, **kwargs)
+
+    host, _, port = bind.rpartition(':')
+    server = make_server(host or '0.0.0.0', int(port), app, threaded=True, request_handler=RequestHandler)
+
+    if workers <= 1 or not hasattr(os, 'fork'):
+        server.serve_forever()
+        return
+
+    children: Dict[int, int] = {}
+    stopping = threading.Event()
+
+    def watch_master(master: int):
+        """Мастер убит (kill -9) - воркер не остаётся висеть на порту"""
+        while os.getppid() == master:
+            time.sleep(1)
+        server.shutdown()
+
+    def spawn(number: int):
+        # Сигналы до установки обработчиков воркера не должны попасть в обработчик мастера
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM, signal.SIGINT})
+        pid = os.fork()
+        if pid:
+            children[pid] = number
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM, signal.SIGINT})
+            return
+        # Воркер: SIGTERM - дообслужить текущие запросы и выйти (atexit допишет логи)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown, daemon=True).start())
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM, signal.SIGINT})
+        threading.Thread(target=watch_master, args=(os.getppid(),), daemon=True).start()
+        try:
+            server.serve_forever()
+        except BaseException:
+            os._exit(1)
+        sys.exit(0)
+
+    def stop(*_):
+        stopping.set()
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for number in range(workers):
+        spawn(number)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        number = children.pop(pid, None)
+        if number is not None and not stopping.is_set():
+            logger.warning(f"⚠️ Воркер {number} (pid {pid}) завершился ({status}), перезапуск")
+            time.sleep(1)
+            spawn(number)
+
+    server.server_close()
+
+
+def main():
+    settings = load_settings()
+    parser = argparse.ArgumentParser(description="Dashboard API: несколько воркеров, без debug")
+    parser.add_argument("app", nargs="?", default="api", choices=APPS)
+    parser.add_argument("--bind", default=settings.get('bind', '0.0.0.0:5000'))
+    parser.add_argument("--workers", type=int, default=int(settings.get('workers', 2)))
+    parser.add_argument("--threads", type=int, default=int(settings.get('threads', 8)))
+    parser.add_argument("--timeout", type=int, default=int(settings.get('timeout', 120)))
+    parser.add_argument("--access-log", action="store_true", default=bool(settings.get('access_log', False)))
+    parser.add_argument("--no-gunicorn", action="store_true", help="Prefork на werkzeug, даже если gunicorn есть")
+    args = parser.parse_args()
+
+    app = load_app(args.app)
+
+    try:
+        if args.no_gunicorn:
+            raise ImportError
+        import gunicorn  # noqa: F401 - опционально
+    except ImportError:
+        logger.info(f"🚀 {args.app}: http://{args.bind}, воркеров {args.workers} (werkzeug prefork)")
+        serve_prefork(app, args.bind, args.workers, args.access_log)
+        return
+
+    logger.info(f"🚀 {args.app}: http://{args.bind}, воркеров {args.workers} x {args.threads} потоков (gunicorn)")
+    serve_gunicorn(app, args.bind, args.workers, args.threads, args.timeout, args.access_log)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Хранилище сессий по прокси - cookies, User-Agent и время последней капчи
+Общее для requests-парсеров и Playwright: сессия, прошедшая капчу в браузере, переходит в HTTP
+"""
+import hashlib
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+from loguru import logger
+from models import ProxySession
+from database import db
+from metrics import proxy_label
+
+DIRECT = "direct"
+
+
+def identity_for(proxy: Optional[str]) -> str:
+    """
+    Ключ сессии для прокси (без прокси - 'direct') - без логина и пароля
+
+    host:port как в метриках; у прокси с учётными данными - ещё хеш полного URL
+    (ротационные прокси выбирают выходной IP логином, у них разные сессии).
+    Ключ попадает в БД и логи, поэтому сам URL в нём не хранится.
+    """
+    if not proxy:
+        return DIRECT
+    url = proxy if '://' in proxy else f"http://{proxy}"  # user:pass@host:port без схемы
+    label = proxy_label(url)
+    if urlsplit(url).username is None:
+        return label
+    return f"{label}#{hashlib.sha256(url.encode()).hexdigest()[:12]}"
+
+
+class SessionStore:
+    """Сессии в таблице proxy_sessions (переживают перезапуски)"""
+
+    def __init__(self, database=None):
+        self.db = database or db
+        ProxySession.__table__.create(bind=self.db.engine, checkfirst=True)
+        self._redact_identities()
+
+    def _redact_identities(self):
+        """Сессии, записанные прежде по URL прокси (с паролем), - под ключ identity_for"""
+        session = self.db.get_session()
+        try:
+            rows = session.query(ProxySession).filter(ProxySession.identity.like('%://%')).all()
+            for row in rows:
+                identity = identity_for(row.identity)
+                if session.get(ProxySession, identity) is None:
+                    session.add(ProxySession(
+                        identity=identity, cookies=row.cookies, user_agent=row.user_agent,
+                        last_captcha_at=row.last_captcha_at, captcha_count=row.captcha_count,
+                    ))
+                session.delete(row)
+            session.commit()
+            if rows:
+                logger.info(f"🔐 Сессии прокси: {len(rows)} ключей без учётных данных")
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Ошибка переименования сессий прокси: {e}")
+        finally:
+            session.close()
+
+    def get(self, identity: str) -> Optional[Dict]:
+        """Сессия в виде dict (или None)"""
+        session = self.db.get_session()
+        try:
+            row = session.get(ProxySession, identity)
+            if not row:
+                return None
+            return {
+                'identity': row.identity,
+                'cookies': row.cookies or [],
+                'user_agent': row.user_agent,
+                'last_captcha_at': row.last_captcha_at,
+                'captcha_count': row.captcha_count or 0,
+            }
+        finally:
+            session.close()
+
+    def save(self, identity: str, cookies: List[Dict] = None, user_agent: str = None):
+        """Сохранить cookies и/или User-Agent"""
+        session = self.db.get_session()
+        try:
+            row = session.get(ProxySession, identity)
+            if not row:
+                row = ProxySession(identity=identity, captcha_count=0)
+                session.add(row)
+            if cookies is not None:
+                row.cookies = cookies
+            if user_agent:
+                row.user_agent = user_agent
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Ошибка сохранения сессии {identity}: {e}")
+        finally:
+            session.close()
+
+    def mark_captcha(self, identity: str):
+        """Отметить, что на этой сессии словили капчу"""
+        session = self.db.get_session()
+        try:
+            row = session.get(ProxySession, identity)
+            if not row:
+                row = ProxySession(identity=identity, captcha_count=0)
+                session.add(row)
+            row.last_captcha_at = datetime.now()
+            row.captcha_count = (row.captcha_count or 0) + 1
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Ошибка сохранения сессии {identity}: {e}")
+        finally:
+            session.close()
+
+    # ===== requests =====
+
+    def load_into_requests(self, http_session, identity: str) -> bool:
+        """Подгрузить cookies и User-Agent в requests.Session"""
+        data = self.get(identity)
+        if not data:
+            return False
+
+        for cookie in data['cookies']:
+            expires = cookie.get('expires')
+            http_session.cookies.set(
+                cookie['name'],
+                cookie['value'],
+                domain=cookie.get('domain', ''),
+                path=cookie.get('path', '/'),
+                secure=cookie.get('secure', False),
+                expires=int(expires) if expires and expires > 0 else None,
+                rest={'HttpOnly': None} if cookie.get('httpOnly') else {},
+            )
+
+        if data['user_agent']:
+            http_session.headers['User-Agent'] = data['user_agent']
+        return True
+
+    def save_from_requests(self, http_session, identity: str):
+        """Сохранить cookies из requests.Session"""
+        cookies = [
+            {
+                'name': c.name,
+                'value': c.value,
+                'domain': c.domain,
+                'path': c.path,
+                'expires': c.expires if c.expires else -1,
+                'httpOnly': c.has_nonstandard_attr('HttpOnly'),
+                'secure': bool(c.secure),
+                'sameSite': 'Lax',
+            }
+            for c in http_session.cookies
+        ]
+        self.save(identity, cookies=cookies, user_agent=http_session.headers.get('User-Agent'))
+
+    # ===== Playwright =====
+
+    async def load_into_context(self, context, identity: str) -> bool:
+        """Подгрузить cookies в контекст браузера"""
+        data = self.get(identity)
+        cookies = [c for c in (data or {}).get('cookies', []) if c.get('domain')]
+        if not cookies:
+            return False
+        await context.add_cookies(cookies)
+        return True
+
+    async def save_from_context(self, context, identity: str, user_agent: str = None):
+        """Сохранить cookies из контекста браузера"""
+        self.save(identity, cookies=await context.cookies(), user_agent=user_agent)
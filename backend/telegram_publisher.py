@@ -4,38 +4,46 @@ Telegram Publisher - публикация объявлений в Telegram ка
 import asyncio
 from telegram import Bot
 from telegram.error import TelegramError
-from typing import List, Optional, Dict
+from typing import Callable, List, Optional, Dict, Tuple
 from loguru import logger
 from models import Announcement
 from database import db
+from metrics import PUBLISH_SECONDS, PUBLISH_TOTAL, DB_COMMIT_SECONDS
 import requests
 import os
 import tempfile
 
 
 class TelegramPublisher:
-    def __init__(self, bot_token: str, channel_mappings: Dict[str, str]):
+    def __init__(self, bot_token: str, channel_mappings: Dict[str, str], user_id: int = 0, database=None):
         """
         Args:
             bot_token: Telegram bot token
             channel_mappings: {category: channel_id}, например {'auto': '@avto_vorkuta'}
+            user_id: тенант - публикуются только его объявления
+            database: БД тенанта (по умолчанию общая)
         """
         self.bot_token = bot_token
         self.channel_mappings = channel_mappings
+        self.user_id = user_id
+        self.db = database or db
         self.bot = Bot(token=bot_token)
         
         logger.info("✅ Telegram Bot подключен")
     
-    async def publish_announcements_async(self, signatures: Dict[str, str]) -> Dict[str, int]:
-        """Публикация всех новых объявлений (async)"""
+    async def publish_announcements_async(self, signatures: Dict[str, str],
+                                          heartbeat: Callable[[], None] = None) -> Dict[str, int]:
+        """Публикация всех новых объявлений (async; heartbeat() - после каждого, задача жива)"""
         stats = {'published': 0, 'failed': 0, 'skipped': 0}
-        session = db.get_session()
+        session = self.db.get_session()
         
         try:
             # Получаем все новые и обновлённые объявления (которые ещё не опубликованы в TG)
-            announcements = session.query(Announcement).filter(
+            announcements = self.db.claim(session.query(Announcement).filter(
+                Announcement.user_id == self.user_id,
                 Announcement.status.in_(['new', 'updated', 'published']),  # Включая уже опубликованные в VK
-            ).all()
+                Announcement.in_global_feed(),  # Найденные только единицами - в их ленты
+            )).all()
             
             # Фильтруем те, что ещё не в TG
             unpublished = [ann for ann in announcements if not hasattr(ann, 'published_to_tg') or not ann.published_to_tg]
@@ -43,6 +51,8 @@ class TelegramPublisher:
             logger.info(f"Найдено {len(unpublished)} объявлений для публикации в Telegram")
             
             for ann in unpublished:
+                if heartbeat:
+                    heartbeat()
                 try:
                     # Определяем в какой канал публиковать
                     channel_id = self.channel_mappings.get(ann.category)
@@ -52,16 +62,8 @@ class TelegramPublisher:
                         stats['skipped'] += 1
                         continue
                     
-                    # Формируем текст поста
-                    signature = signatures.get(ann.category, "")
-                    post_text = self._format_post(ann, signature)
-                    
-                    # Публикуем
-                    message_id = await self._publish_to_channel(
-                        channel_id=channel_id,
-                        text=post_text,
-                        photo_url=ann.image_urls[0] if ann.image_urls and len(ann.image_urls) > 0 else None
-                    )
+                    # Публикуем с подписью категории
+                    message_id = await self.publish_one_async(ann, channel_id, signatures.get(ann.category, ""))
                     
                     if message_id:
                         # Обновляем статус в БД
@@ -83,7 +85,11 @@ class TelegramPublisher:
                 # Задержка между публикациями (защита от флуда)
                 await asyncio.sleep(2)
             
-            session.commit()
+            with DB_COMMIT_SECONDS.labels(operation='publish_telegram').time():
+                session.commit()
+            
+            for result, count in stats.items():
+                PUBLISH_TOTAL.labels(destination='telegram', result=result).inc(count)
             logger.info(f"Публикация в TG завершена: опубликовано={stats['published']}, ошибок={stats['failed']}, пропущено={stats['skipped']}")
             
         except Exception as e:
@@ -94,9 +100,42 @@ class TelegramPublisher:
         
         return stats
     
-    def publish_announcements(self, signatures: Dict[str, str]) -> Dict[str, int]:
+    def publish_announcements(self, signatures: Dict[str, str],
+                              heartbeat: Callable[[], None] = None) -> Dict[str, int]:
         """Синхронная обёртка для async публикации"""
-        return asyncio.run(self.publish_announcements_async(signatures))
+        return asyncio.run(self.publish_announcements_async(signatures, heartbeat))
+    
+    async def publish_one_async(self, ann: Announcement, channel_id: str, signature: str = "") -> Optional[int]:
+        """Публикация одного объявления в канал (message_id или None), статус в БД не меняет"""
+        post_text = self._format_post(ann, signature)
+        
+        with PUBLISH_SECONDS.labels(destination='telegram').time():
+            return await self._publish_to_channel(
+                channel_id=channel_id,
+                text=post_text,
+                photo_url=ann.image_urls[0] if ann.image_urls and len(ann.image_urls) > 0 else None
+            )
+    
+    async def publish_many_async(self, items: List[Tuple[Announcement, str, str]],
+                                 heartbeat: Callable[[], None] = None) -> List[Optional[int]]:
+        """Публикация пачки (объявление, канал, подпись) с защитой от флуда"""
+        results = []
+        for i, (ann, channel_id, signature) in enumerate(items):
+            if heartbeat:
+                heartbeat()
+            if i:
+                await asyncio.sleep(2)
+            try:
+                results.append(await self.publish_one_async(ann, channel_id, signature))
+            except Exception as e:
+                logger.error(f"Ошибка публикации в TG объявления {ann.avito_id}: {e}")
+                results.append(None)
+        return results
+    
+    def publish_many(self, items: List[Tuple[Announcement, str, str]],
+                     heartbeat: Callable[[], None] = None) -> List[Optional[int]]:
+        """Синхронная обёртка для publish_many_async"""
+        return asyncio.run(self.publish_many_async(items, heartbeat))
     
     def _format_post(self, ann: Announcement, signature: str = "") -> str:
         """Форматирование текста поста для Telegram"""
@@ -0,0 +1,25 @@
+"""
+Тенанты (пользователи) - к кому относятся объявления и в какой БД они лежат
+
+Настройки (config.yaml):
+    tenant:
+      user_id: 0          # 0 - однопользовательский режим
+      storage: shared     # shared - общая БД, все индексы начинаются с user_id
+                          # database - отдельный SQLite файл на пользователя (data/tenants/<id>.db)
+"""
+from database import Database, db
+
+DEFAULT_TENANT = 0
+
+
+def tenant_id(config: dict) -> int:
+    """ID пользователя из конфига"""
+    return int((config.get('tenant') or {}).get('user_id', DEFAULT_TENANT))
+
+
+def tenant_db(config: dict) -> Database:
+    """БД пользователя: общая или своя (storage: database)"""
+    tenant = config.get('tenant') or {}
+    if tenant.get('storage', 'shared') == 'database':
+        return db.for_tenant(tenant_id(config))
+    return db
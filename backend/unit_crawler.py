@@ -0,0 +1,285 @@
+"""
+Парсинг по единицам (units) - одинаковые ссылки разных единиц загружаются один раз
+
+Несколько единиц могут смотреть один и тот же город + раздел (например, две единицы
+на vorkuta/avtomobili). Источники сливаются по (city_slug, url_path), каждый грузится
+один раз за проход, а результат раскладывается в ленты всех подписанных единиц
+(таблица unit_announcements) и публикуется в их VK группы и TG каналы.
+
+У единицы могут быть свои правила отбора (units.rules, см. rules.py) - в её ленту
+попадают только прошедшие их объявления источника.
+"""
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional
+from loguru import logger
+from sqlalchemy.exc import IntegrityError
+from models import Announcement, UnitAnnouncement
+from tenancy import tenant_id, tenant_db
+from pipeline import CrawlPipeline
+from units_db import get_pool
+from rules import RuleError, compile_rules, route
+
+AVITO_URL = "https://www.avito.ru"
+DEFAULT_UNITS_DB = "../data/avito_parser.db"  # Как DB_PATH в api_units.py
+HIDDEN_STATUSES = ('duplicate', 'filtered')  # Не публикуются в ленты единиц
+
+
+class UnitCrawler:
+    """Обход уникальных источников всех включённых единиц с раздачей результатов по единицам"""
+
+    def __init__(self, pipeline: CrawlPipeline, units_db_path: str = None, database=None):
+        self.pipeline = pipeline
+        units_config = pipeline.config.get('units', {})
+        self.units_db_path = units_db_path or units_config.get('db_path', DEFAULT_UNITS_DB)
+        self.publish_limit = units_config.get('publish_limit', 20)  # Постов на единицу за проход
+        self.base_url = units_config.get('base_url', AVITO_URL).rstrip('/')
+        self.user_id = tenant_id(pipeline.config)
+        self.db = database or tenant_db(pipeline.config)
+        UnitAnnouncement.__table__.create(bind=self.db.engine, checkfirst=True)
+
+    # ===== ЕДИНИЦЫ =====
+
+    def _query_units(self, sql: str, unit_ids: Optional[Iterable[int]]) -> List[Dict]:
+        params = []
+        if unit_ids is not None:
+            unit_ids = list(unit_ids)
+            if not unit_ids:
+                return []
+            sql += f" AND u.id IN ({','.join('?' * len(unit_ids))})"
+            params = unit_ids
+
+        try:
+            with get_pool(self.units_db_path).connection() as conn:
+                return [dict(row) for row in conn.execute(sql, params)]
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Единицы недоступны ({self.units_db_path}): {e}")
+            return []
+
+    def load_subscriptions(self, unit_ids: Iterable[int] = None) -> List[Dict]:
+        """Включённые ссылки включённых единиц (одним запросом)"""
+        return self._query_units('''
+            SELECT u.id AS unit_id, u.name, u.city_slug, u.vk_group_id, u.telegram_channel_id, u.rules,
+                   s.category, s.url_path, s.signature
+            FROM units u
+            JOIN unit_sources s ON s.unit_id = u.id
+            WHERE u.is_enabled = 1 AND s.is_enabled = 1
+        ''', unit_ids)
+
+    def load_units(self, unit_ids: Iterable[int] = None) -> Dict[int, Dict]:
+        """Включённые единицы по id"""
+        rows = self._query_units('SELECT u.* FROM units u WHERE u.is_enabled = 1', unit_ids)
+        return {row['id']: row for row in rows}
+
+    def merge_sources(self, subscriptions: List[Dict]) -> List[Dict]:
+        """Слить одинаковые (city_slug, url_path): один источник - список подписчиков"""
+        merged: Dict[tuple, Dict] = {}
+        for sub in subscriptions:
+            key = (sub['city_slug'].strip().lower(), sub['url_path'].strip('/').lower())
+            source = merged.get(key)
+            if source is None:
+                source = merged[key] = {
+                    'url': f"{self.base_url}/{key[0]}/{key[1]}",
+                    'category': sub['category'],
+                    'city': key[0],
+                    'city_slug': key[0],
+                    'rules': self.pipeline.rules_for(key[0]),
+                    'subscribers': [],
+                }
+            source['subscribers'].append({
+                'unit_id': sub['unit_id'],
+                'signature': sub.get('signature') or '',
+                'rules': sub.get('rules') or '',
+            })
+        return list(merged.values())
+
+    def pages_total(self, unit_ids: Iterable[int] = None, max_pages: int = None) -> int:
+        """Страниц за проход - для прогресса задачи"""
+        sources = self.merge_sources(self.load_subscriptions(unit_ids))
+        return len(sources) * (max_pages or self.pipeline.max_pages)
+
+    # ===== ПРОХОД =====
+
+    def run(self, unit_ids: Iterable[int] = None, max_pages: int = None, job=None,
+            publish: bool = True) -> Dict[str, int]:
+        """
+        Загрузить уникальные источники единиц и разложить объявления по лентам
+
+        Args:
+            unit_ids: только эти единицы (наполнение одной единицы), None - все включённые
+            job: JobHandle - прогресс и отмена
+        """
+        max_pages = max_pages or self.pipeline.max_pages
+        subscriptions = self.load_subscriptions(unit_ids)
+        sources = self.merge_sources(subscriptions)
+        stats = {'subscriptions': len(subscriptions), 'sources': 0, 'new': 0, 'linked': 0}
+
+        if not sources:
+            logger.info("Нет включённых ссылок единиц")
+            return stats
+
+        logger.info(f"🧩 Единицы: {len(subscriptions)} ссылок -> {len(sources)} уникальных источников")
+
+        with self.pipeline.lock:
+            for i, source in enumerate(sources):
+                if job and not job.checkpoint():
+                    break
+
+                if i and self.pipeline.source_delay:
+                    if job and not job.sleep(self.pipeline.source_delay):
+                        break
+                    if not job:
+                        time.sleep(self.pipeline.source_delay)
+
+                raw = self.pipeline.fetch(source, max_pages, job)
+                stats['sources'] += 1
+                if not raw:
+                    continue
+
+                filtered = self.pipeline.prepare(raw, job, source['rules'])
+                saved = self.pipeline.save(filtered, source['category'], source['city_slug'], unit_only=True)
+                stats['new'] += saved.get('new', 0)
+                stats['linked'] += self.link(filtered, source['subscribers'])
+
+                if job:
+                    job.progress(ads_new=saved.get('new', 0))
+
+            if job and job.cancelled:
+                logger.warning(f"⏹️ Задача {job.id} отменена, публикация пропущена")
+                return stats
+
+            if publish:
+                if job:
+                    job.progress(current_source='публикация единиц')
+                stats['published'] = self.publish(unit_ids, job)
+
+        logger.info(f"📊 Единицы: {stats}")
+        return stats
+
+    def link(self, announcements: List[Dict], subscribers: List[Dict]) -> int:
+        """Добавить объявления в ленты подписчиков по их правилам (уже добавленные пропускаются)"""
+        avito_ids = [ann['avito_id'] for ann in announcements]
+        if not avito_ids or not subscribers:
+            return 0
+
+        rule_sets = {}
+        for sub in subscribers:
+            try:
+                rule_sets[sub['unit_id']] = compile_rules(sub.get('rules'))
+            except RuleError as e:
+                logger.warning(f"Единица {sub['unit_id']}: правила не применены, лента пропущена - {e}")
+
+        session = self.db.get_session()
+        try:
+            rows = session.query(Announcement.avito_id, Announcement.id, Announcement.created_at).filter(
+                Announcement.user_id == self.user_id, Announcement.avito_id.in_(avito_ids))
+            ids, first_seen = {}, {}
+            for avito_id, ann_id, created_at in rows:
+                ids[avito_id] = ann_id
+                first_seen[avito_id] = created_at
+
+            # max_age_hours без даты публикации - по первому появлению у нас
+            saved = [
+                dict(ann, first_seen=first_seen[ann['avito_id']]) if 'published_at' not in ann else ann
+                for ann in announcements if ann['avito_id'] in ids
+            ]
+            selected = route(saved, rule_sets)
+
+            existing = set(
+                session.query(UnitAnnouncement.unit_id, UnitAnnouncement.announcement_id).filter(
+                    UnitAnnouncement.unit_id.in_(list(rule_sets)),
+                    UnitAnnouncement.announcement_id.in_(list(ids.values())),
+                )
+            )
+
+            links = [
+                UnitAnnouncement(user_id=self.user_id, unit_id=sub['unit_id'], announcement_id=ids[ann['avito_id']],
+                                 signature=sub['signature'])
+                for sub in subscribers if sub['unit_id'] in selected
+                for ann in selected[sub['unit_id']]
+                if (sub['unit_id'], ids[ann['avito_id']]) not in existing
+            ]
+            session.add_all(links)
+            session.commit()
+            return len(links)
+        except IntegrityError:
+            # Параллельный проход уже добавил часть - не страшно, добавим в следующий раз
+            session.rollback()
+            return 0
+        finally:
+            session.close()
+
+    # ===== ПУБЛИКАЦИЯ =====
+
+    def publish(self, unit_ids: Iterable[int] = None, job=None) -> Dict[str, int]:
+        """Публикация лент единиц в их VK группы и TG каналы (job - отмечается живой по ходу)"""
+        stats = {'vk': 0, 'telegram': 0, 'failed': 0}
+        heartbeat = job.heartbeat if job else None
+        units = self.load_units(unit_ids)
+        vk = self.pipeline.vk_publisher
+        tg = self.pipeline.tg_publisher
+
+        session = self.db.get_session()
+        try:
+            for unit_id, unit in units.items():
+                vk_group = _vk_owner_id(unit.get('vk_group_id'))
+                tg_channel = (unit.get('telegram_channel_id') or '').strip()
+
+                if vk and vk_group:
+                    pending = self._pending(session, unit_id, UnitAnnouncement.published_to_vk)
+                    for link, ann in pending:
+                        if heartbeat:
+                            heartbeat()
+                        post_id = vk.publish_one(ann, vk_group, link.signature or '')
+                        if post_id:
+                            link.published_to_vk = True
+                            link.vk_post_id = str(post_id)
+                            stats['vk'] += 1
+                        else:
+                            stats['failed'] += 1
+                    session.commit()
+
+                if tg and tg_channel:
+                    pending = self._pending(session, unit_id, UnitAnnouncement.published_to_tg)
+                    results = tg.publish_many([(ann, tg_channel, link.signature or '') for link, ann in pending],
+                                             heartbeat)
+                    for (link, _), message_id in zip(pending, results):
+                        if message_id:
+                            link.published_to_tg = True
+                            link.tg_message_id = str(message_id)
+                            stats['telegram'] += 1
+                        else:
+                            stats['failed'] += 1
+                    session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Ошибка публикации единиц: {e}")
+        finally:
+            session.close()
+
+        return stats
+
+    def _pending(self, session, unit_id: int, published_column) -> List[tuple]:
+        """
+        Неопубликованные объявления ленты (старые первыми), взятые другим воркером пропускаются
+
+        Повторы и перекупы (image_hash помечает их уже после попадания в ленту) не публикуются.
+        """
+        query = (
+            session.query(UnitAnnouncement, Announcement)
+            .join(Announcement, Announcement.id == UnitAnnouncement.announcement_id)
+            .filter(UnitAnnouncement.user_id == self.user_id, UnitAnnouncement.unit_id == unit_id,
+                    published_column == False,
+                    Announcement.status.notin_(HIDDEN_STATUSES))
+            .order_by(UnitAnnouncement.id)
+            .limit(self.publish_limit)
+        )
+        return self.db.claim(query, of=UnitAnnouncement).all()
+
+
+def _vk_owner_id(value) -> Optional[int]:
+    """ID группы VK как owner_id стены (отрицательный)"""
+    try:
+        return -abs(int(str(value).strip()))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,212 @@
+"""
+Слой доступа к БД единиц (units) - пул соединений SQLite, схема, запросы
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS units (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        city_slug TEXT NOT NULL,
+        vk_group_id TEXT,
+        telegram_channel_id TEXT,
+        is_enabled INTEGER DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        rules TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS unit_sources (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        unit_id INTEGER,
+        category TEXT NOT NULL,
+        url_path TEXT NOT NULL,
+        signature TEXT,
+        is_enabled INTEGER DEFAULT 1,
+        FOREIGN KEY (unit_id) REFERENCES units(id) ON DELETE CASCADE
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_unit_sources_unit_id ON unit_sources(unit_id);
+    CREATE INDEX IF NOT EXISTS idx_units_created_at ON units(created_at DESC, id DESC);
+'''
+
+
+class ConnectionPool:
+    """Пул соединений SQLite: соединение берётся на запрос/задачу и возвращается, а не открывается заново"""
+
+    def __init__(self, db_path: str, size: int = 8, timeout: float = 10.0):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # WAL: чтение не блокируется записью из парсера/другого воркера
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+
+        with self._lock:
+            if not self._schema_ready:
+                conn.executescript(SCHEMA)
+                _migrate(conn)
+                conn.commit()
+                self._schema_ready = True
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        # Все соединения заняты - ждём освободившееся
+        return self._idle.get(timeout=self.timeout)
+
+    def release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+
+def _migrate(conn: sqlite3.Connection):
+    """Колонки, добавленные после создания таблиц (CREATE TABLE IF NOT EXISTS их не добавит)"""
+    columns = {row['name'] for row in conn.execute("PRAGMA table_info(units)")}
+    if 'rules' not in columns:
+        conn.execute("ALTER TABLE units ADD COLUMN rules TEXT")  # JSON, см. rules.py
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def _after_fork():
+    """В дочернем процессе (воркеры serve.py) - свои соединения вместо унаследованных"""
+    global _pools_lock
+    _pools_lock = threading.Lock()
+    for pool in _pools.values():
+        pool._idle = queue.LifoQueue()
+        pool._created = 0
+        pool._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def get_pool(db_path: str) -> ConnectionPool:
+    """Общий пул на файл БД (в процессе)"""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(db_path)
+        return pool
+
+
+# ===== FLASK =====
+
+def install(app, db_path_getter):
+    """Соединение на запрос: берётся из пула при первом обращении, возвращается в teardown"""
+    from flask import g
+
+    @app.teardown_appcontext
+    def release_units_connection(exc):
+        conn = g.pop('units_conn', None)
+        if conn is not None:
+            g.pop('units_pool').release(conn)
+
+    def get_conn() -> sqlite3.Connection:
+        if 'units_conn' not in g:
+            g.units_pool = get_pool(db_path_getter())
+            g.units_conn = g.units_pool.acquire()
+        return g.units_conn
+
+    return get_conn
+
+
+# ===== ЗАПРОСЫ =====
+
+def fetch_units(conn: sqlite3.Connection, unit_id: Optional[int] = None) -> List[Dict]:
+    """Единицы со ссылками одним запросом (LEFT JOIN, группировка по единице)"""
+    sql = '''
+        SELECT u.id, u.name, u.city_slug, u.vk_group_id, u.telegram_channel_id, u.is_enabled, u.created_at, u.rules,
+               s.id AS source_id, s.category, s.url_path, s.signature, s.is_enabled AS source_enabled
+        FROM units u
+        LEFT JOIN unit_sources s ON s.unit_id = u.id
+    '''
+    params = ()
+    if unit_id is not None:
+        sql += ' WHERE u.id = ?'
+        params = (unit_id,)
+    sql += ' ORDER BY u.created_at DESC, u.id DESC, s.id'
+
+    units: List[Dict] = []
+    current = None
+    for row in conn.execute(sql, params):
+        if current is None or current['id'] != row['id']:
+            current = {
+                'id': row['id'],
+                'name': row['name'],
+                'city_slug': row['city_slug'],
+                'vk_group_id': row['vk_group_id'],
+                'telegram_channel_id': row['telegram_channel_id'],
+                'is_enabled': row['is_enabled'],
+                'created_at': row['created_at'],
+                'rules': json.loads(row['rules']) if row['rules'] else {},
+                'sources': [],
+            }
+            units.append(current)
+        if row['source_id'] is not None:
+            current['sources'].append({
+                'id': row['source_id'],
+                'unit_id': row['id'],
+                'category': row['category'],
+                'url_path': row['url_path'],
+                'signature': row['signature'],
+                'is_enabled': row['source_enabled'],
+            })
+    return units